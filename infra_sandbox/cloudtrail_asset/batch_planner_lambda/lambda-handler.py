@@ -0,0 +1,225 @@
+import heapq
+import json
+import math
+import os
+import re
+from typing import Dict, List
+
+import boto3
+
+s3_client = boto3.client("s3")
+
+DEFAULT_MAX_FILES_PER_BATCH = int(os.environ.get("MAX_FILES_PER_BATCH", "20000"))
+DEFAULT_MAX_BYTES_PER_BATCH = int(
+    os.environ.get("MAX_BYTES_PER_BATCH", str(10 * 1024 * 1024 * 1024))
+)
+DEFAULT_MAX_PREFIXES_PER_BATCH = int(os.environ.get("MAX_PREFIXES_PER_BATCH", "50"))
+PLAN_KEY_PREFIX = os.environ.get("PLAN_KEY_PREFIX", "glue_job_tmp/batch_plans")
+# AWSLogs/{account}/CloudTrail/ or, for an organization trail, AWSLogs/{o-xxxx}/{account}/CloudTrail/
+ACCOUNT_PATTERN = re.compile(r"AWSLogs/(?:o-[a-z0-9]{10,32}/)?(\d{12})/CloudTrail/")
+
+
+def lambda_handler(event, context):
+    """
+    Group sized day prefixes into balanced batches so one Glue run can process many
+    account-region-days in a single Spark session.
+    Expected event: {"bucket_name", "plan_id", "prefix_sizes": [{"prefix", "file_count", "total_bytes"}]}
+    as returned by the discovery Lambda, which sizes the prefixes while it finds them, or
+    {"bucket_name", "plan_id", "discovery_manifest"} when discovery wrote them to S3.
+    Account is the shard key: the prefixes of an account that fits in one batch stay together,
+    so concurrent runs write disjoint account partitions and the batch count grows with the
+    number of accounts rather than one run covering them all.
+    Every batch is written to s3://{bucket_name}/{PLAN_KEY_PREFIX}/{plan_id}/ as a JSON
+    prefix manifest that the Glue job reads through --prefix_manifest.
+    """
+    try:
+        bucket_name = event["bucket_name"]
+        plan_id = event.get("plan_id") or context.aws_request_id
+        max_files = int(event.get("max_files_per_batch", DEFAULT_MAX_FILES_PER_BATCH))
+        max_bytes = int(event.get("max_bytes_per_batch", DEFAULT_MAX_BYTES_PER_BATCH))
+        max_prefixes = int(
+            event.get("max_prefixes_per_batch", DEFAULT_MAX_PREFIXES_PER_BATCH)
+        )
+
+        prefix_sizes = event.get("prefix_sizes")
+        if prefix_sizes is None and event.get("discovery_manifest"):
+            prefix_sizes = read_json(event["discovery_manifest"]).get("prefix_sizes", [])
+        sized_prefixes = parse_prefix_sizes(prefix_sizes or [])
+        units = group_by_account(sized_prefixes, max_files, max_bytes, max_prefixes)
+        batches = plan_batches(units, max_files, max_bytes, max_prefixes)
+
+        planned = []
+        for index, batch in enumerate(batches, start=1):
+            batch_id = f"batch-{index:04d}"
+            key = f"{PLAN_KEY_PREFIX}/{plan_id}/{batch_id}.json"
+            s3_client.put_object(
+                Bucket=bucket_name,
+                Key=key,
+                # prefix_bytes lets the Glue job start its largest prefixes first
+                Body=json.dumps(
+                    {"prefixes": batch["prefixes"], "prefix_bytes": batch["prefix_bytes"]}
+                ).encode("utf-8"),
+                ContentType="application/json",
+            )
+            planned.append(
+                {
+                    "batch_id": batch_id,
+                    "prefix_manifest": f"s3://{bucket_name}/{key}",
+                    "prefix_count": len(batch["prefixes"]),
+                    "account_count": len(batch["accounts"]),
+                    "file_count": batch["file_count"],
+                    "total_bytes": batch["total_bytes"],
+                }
+            )
+
+        print(
+            f"planned {len(planned)} batches for {len(sized_prefixes)} prefixes "
+            f"of {len({p['account_id'] for p in sized_prefixes})} accounts: {planned}"
+        )
+        return {
+            "statusCode": 200,
+            "batches": planned,
+            "total_batches": len(planned),
+            "total_prefixes": len(sized_prefixes),
+        }
+
+    except Exception as e:
+        print(f"Error planning batches: {str(e)}")
+        return {"statusCode": 500, "error": str(e), "batches": [], "total_batches": 0}
+
+
+def read_json(uri: str) -> Dict:
+    bucket, _, key = uri.replace("s3://", "", 1).partition("/")
+    return json.loads(s3_client.get_object(Bucket=bucket, Key=key)["Body"].read())
+
+
+def parse_prefix_sizes(prefix_sizes: List[Dict]) -> List[Dict]:
+    """
+    Normalise the sized prefixes into {"prefix", "account_id", "file_count", "total_bytes"}.
+    Lambda invoke results wrapped in {"Payload": ...} are accepted as well.
+    """
+    sized = []
+    for item in prefix_sizes:
+        payload = item.get("Payload", item)
+        prefix = payload.get("prefix")
+        if not prefix:
+            continue
+        match = ACCOUNT_PATTERN.search(prefix)
+        sized.append(
+            {
+                "prefix": prefix,
+                "account_id": payload.get("account_id") or (match.group(1) if match else ""),
+                "file_count": int(payload.get("file_count", 0) or 0),
+                "total_bytes": int(payload.get("total_bytes", 0) or 0),
+            }
+        )
+    return sized
+
+
+def group_by_account(
+    sized_prefixes: List[Dict], max_files: int, max_bytes: int, max_prefixes: int
+) -> List[Dict]:
+    """
+    Packing units: all prefixes of an account as one unit when they fit in a batch together,
+    otherwise one unit per prefix, so only accounts too large for one batch are spread.
+    """
+    by_account = {}
+    for item in sized_prefixes:
+        by_account.setdefault(item["account_id"], []).append(item)
+    units = []
+    for account_id, items in sorted(by_account.items()):
+        file_count = sum(item["file_count"] for item in items)
+        total_bytes = sum(item["total_bytes"] for item in items)
+        if file_count <= max_files and total_bytes <= max_bytes and len(items) <= max_prefixes:
+            groups = [items]
+        else:
+            groups = [[item] for item in items]
+        for group in groups:
+            units.append(
+                {
+                    "prefixes": [item["prefix"] for item in group],
+                    "prefix_bytes": {item["prefix"]: item["total_bytes"] for item in group},
+                    "account_id": account_id,
+                    "file_count": sum(item["file_count"] for item in group),
+                    "total_bytes": sum(item["total_bytes"] for item in group),
+                }
+            )
+    return units
+
+
+def new_batch() -> Dict:
+    return {
+        "prefixes": [],
+        "prefix_bytes": {},
+        "accounts": set(),
+        "file_count": 0,
+        "total_bytes": 0,
+    }
+
+
+def plan_batches(
+    units: List[Dict], max_files: int, max_bytes: int, max_prefixes: int
+) -> List[Dict]:
+    """
+    Bin-pack units into the fewest batches that respect the file, byte and prefix
+    caps, keeping the batches balanced (largest unit first onto the lightest batch).
+    A unit that alone exceeds a cap gets a batch of its own.
+    """
+    if not units:
+        return []
+
+    total_files = sum(u["file_count"] for u in units)
+    total_bytes = sum(u["total_bytes"] for u in units)
+    total_prefixes = sum(len(u["prefixes"]) for u in units)
+    batch_count = max(
+        1,
+        math.ceil(total_files / max_files),
+        math.ceil(total_bytes / max_bytes),
+        math.ceil(total_prefixes / max_prefixes),
+    )
+
+    def weight(file_count, byte_count):
+        return file_count / max_files + byte_count / max_bytes
+
+    batches = [new_batch() for _ in range(batch_count)]
+    heap = [(0.0, index) for index in range(batch_count)]
+    ordered = sorted(
+        units,
+        key=lambda p: weight(p["file_count"], p["total_bytes"]),
+        reverse=True,
+    )
+
+    for item in ordered:
+        skipped = []
+        target = None
+        while heap:
+            load, index = heapq.heappop(heap)
+            batch = batches[index]
+            fits = (
+                not batch["prefixes"]
+                or (
+                    batch["file_count"] + item["file_count"] <= max_files
+                    and batch["total_bytes"] + item["total_bytes"] <= max_bytes
+                    and len(batch["prefixes"]) + len(item["prefixes"]) <= max_prefixes
+                )
+            )
+            if fits:
+                target = index
+                break
+            skipped.append((load, index))
+        if target is None:
+            batches.append(new_batch())
+            target = len(batches) - 1
+        batch = batches[target]
+        batch["prefixes"].extend(item["prefixes"])
+        batch["prefix_bytes"].update(item["prefix_bytes"])
+        batch["accounts"].add(item["account_id"])
+        batch["file_count"] += item["file_count"]
+        batch["total_bytes"] += item["total_bytes"]
+        heapq.heappush(
+            heap, (weight(batch["file_count"], batch["total_bytes"]), target)
+        )
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+
+    return [batch for batch in batches if batch["prefixes"]]
@@ -0,0 +1,101 @@
+import sys
+import time
+import logging
+
+from awsglue.utils import getResolvedOptions
+from awsglue.context import GlueContext
+from awsglue.job import Job
+
+from cloudtrail_common import get_optional_args
+from cloudtrail_derived import (
+    ensure_derived_columns,
+    ensure_rules_table,
+    select_rule_version,
+    classification_sql_expressions,
+    ensure_rollup_tables,
+    ensure_security_events_table,
+    event_time_bound_sql,
+    refresh_derived_tables
+)
+from cloudtrail_ingest_engine import GlueCatalogBackend, create_spark_session
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+def build_backfill_predicate(start_date, end_date, version, only_stale):
+    clauses = []
+    if start_date:
+        clauses.append(f"event_date >= DATE '{start_date}'")
+        # Prunes a table partitioned by event_time too
+        clauses.append(event_time_bound_sql(start_date, end_date or None))
+    if end_date:
+        clauses.append(f"event_date <= DATE '{end_date}'")
+    if only_stale:
+        clauses.append(f"(classification_version IS NULL OR classification_version <> {version})")
+    return " AND ".join(clauses) or "true"
+
+args = getResolvedOptions(
+    sys.argv,
+    [
+        "JOB_NAME",
+        "output_path",
+        "database_name"
+    ]
+)
+
+optional_args = get_optional_args(
+    sys.argv,
+    {
+        "rule_version": "latest",
+        "start_date": "",
+        "end_date": "",
+        # Only rewrite rows classified by another rule version, so an interrupted run can resume
+        "only_stale": "true"
+    }
+)
+
+database_name = args["database_name"]
+s3_output_path = args["output_path"]
+logging_bucket_name = s3_output_path.split("/")[2]
+table_fqn = f"glue_catalog.{database_name}.cloudtrail_events"
+
+spark = create_spark_session(GlueCatalogBackend(f"s3://{logging_bucket_name}/glue_job_tmp/"))
+glueContext = GlueContext(spark.sparkContext)
+job = Job(glueContext)
+job.init(args["JOB_NAME"], args)
+
+ensure_derived_columns(spark, table_fqn)
+rules_table_fqn = ensure_rules_table(spark, database_name, s3_output_path)
+version, rules = select_rule_version(
+    [row.asDict() for row in spark.table(rules_table_fqn).collect()],
+    optional_args["rule_version"]
+)
+predicate = build_backfill_predicate(
+    optional_args["start_date"],
+    optional_args["end_date"],
+    version,
+    optional_args["only_stale"].lower() == "true"
+)
+
+stale_partitions = [
+    (row.region, row.event_date)
+    for row in spark.sql(f"SELECT DISTINCT region, event_date FROM {table_fqn} WHERE {predicate}").collect()
+]
+logger.info(f"Backfilling classification version {version} into {len(stale_partitions)} partitions matching: {predicate}")
+
+set_clause = ", ".join(f"{name} = {sql}" for name, sql in classification_sql_expressions(version, rules))
+job_start = time.time()
+# One UPDATE per day keeps each commit small and lets a failed run pick up where it stopped
+for event_date in sorted({event_date for _, event_date in stale_partitions}):
+    start_time = time.time()
+    spark.sql(
+        f"UPDATE {table_fqn} SET {set_clause} "
+        f"WHERE event_date = DATE '{event_date}' AND {event_time_bound_sql(event_date, event_date)} AND {predicate}"
+    )
+    logger.info(f"Reclassified event_date={event_date} in {time.time() - start_time:.1f}s")
+
+ensure_rollup_tables(spark, database_name, s3_output_path)
+ensure_security_events_table(spark, database_name, s3_output_path)
+refresh_derived_tables(spark, database_name, table_fqn, stale_partitions)
+logger.info(f"Backfill of classification version {version} completed for {len(stale_partitions)} partitions in {time.time() - job_start:.1f}s")
+job.commit()
@@ -0,0 +1,164 @@
+import sys
+import time
+import logging
+from datetime import datetime
+
+from awsglue.utils import getResolvedOptions
+from awsglue.context import GlueContext
+from awsglue.job import Job
+
+from cloudtrail_common import get_optional_args, load_derived_refreshes
+from cloudtrail_derived import ensure_security_events_table, refresh_derived_tables
+from cloudtrail_ingest_engine import (
+    CATALOG_NAME,
+    EVENTS_TABLE,
+    MANIFEST_TABLE,
+    GlueCatalogBackend,
+    S3Storage,
+    create_spark_session,
+    load_staged_writes,
+    manifest_has_run,
+    record_processed_objects,
+    apply_retention
+)
+from cloudtrail_ingest_stages import get_partition_timezone, get_unpublished_snapshots, partition_event_dates
+from cloudtrail_retention import DEFAULT_RETENTION_DAYS
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+def get_staged_partitions(spark, table_fqn, snapshot_ids):
+    """(region, event_date) pairs of the files the staged snapshots added, from metadata only."""
+    if not snapshot_ids:
+        return set()
+    id_list = ", ".join(str(snapshot_id) for snapshot_id in snapshot_ids)
+    rows = spark.sql(
+        f"SELECT DISTINCT data_file.partition AS partition FROM {table_fqn}.all_entries "
+        f"WHERE snapshot_id IN ({id_list}) AND status = 1"
+    ).collect()
+    partition_timezone = get_partition_timezone(spark, table_fqn)
+    touched_partitions = set()
+    for row in rows:
+        partition = row.partition.asDict()
+        touched_partitions.update(
+            (partition.get("region"), event_date) for event_date in partition_event_dates(partition, partition_timezone)
+        )
+    return touched_partitions
+
+def parse_staged_objects(objects):
+    """Objects of a staged-write document, with last_modified back as a datetime."""
+    return [
+        {**obj, "last_modified": datetime.fromisoformat(obj["last_modified"]) if obj.get("last_modified") else None}
+        for obj in objects
+    ]
+
+def complete_staged_writes(spark, manifest_table_fqn, storage, staged_writes, deleter):
+    """Record the objects of published staged writes in the manifest, then delete them and their documents.
+
+    A run interrupted part way is completed by the next: the manifest append is skipped when
+    the wap.id is already recorded, and deletes are idempotent.
+    """
+    for key, document in staged_writes:
+        day_prefix, wap_id = document["day_prefix"], document["wap_id"]
+        objects = parse_staged_objects(document["objects"])
+        if not manifest_has_run(spark, manifest_table_fqn, day_prefix, wap_id):
+            record_processed_objects(spark, manifest_table_fqn, day_prefix, objects, wap_id)
+        if document.get("delete_raw_objects", True):
+            deleter.delete(day_prefix, [obj["key"] for obj in objects])
+        storage.delete_object(key)
+
+def publish_snapshots(spark, table_fqn, snapshots):
+    """Cherry-pick the staged snapshots into the table, one fast metadata commit each."""
+    table_identifier = table_fqn.split(".", 1)[1]
+    for snapshot_id, wap_id, _ in snapshots:
+        start_time = time.time()
+        spark.sql(f"CALL {CATALOG_NAME}.system.cherrypick_snapshot('{table_identifier}', {snapshot_id})")
+        logger.info(f"Published snapshot {snapshot_id} staged as {wap_id} in {time.time() - start_time:.1f}s")
+
+args = getResolvedOptions(
+    sys.argv,
+    [
+        "JOB_NAME",
+        "output_path",
+        "database_name"
+    ]
+)
+
+optional_args = get_optional_args(
+    sys.argv,
+    {
+        "run_retention": "true",
+        "retention_days_for_processed_logs": str(DEFAULT_RETENTION_DAYS),
+        # Retention runs at most once per interval, however often the orchestrator runs
+        "retention_interval_hours": "24",
+        # List the whole table location for orphans instead of the recently written directories
+        "full_orphan_scan": "false",
+        "security_rule_version": "latest",
+        "delete_max_workers": "16",
+        "delete_initial_objects_per_second": "3000"
+    }
+)
+
+database_name = args["database_name"]
+logging_bucket_name = args["output_path"].split("/")[2]
+table_fqn = f"{CATALOG_NAME}.{database_name}.{EVENTS_TABLE}"
+manifest_table_fqn = f"{CATALOG_NAME}.{database_name}.{MANIFEST_TABLE}"
+storage = S3Storage(logging_bucket_name)
+
+spark = create_spark_session(GlueCatalogBackend(f"s3://{logging_bucket_name}/glue_job_tmp/"))
+glueContext = GlueContext(spark.sparkContext)
+job = Job(glueContext)
+job.init(args["JOB_NAME"], args)
+
+job_start = time.time()
+# Runs one at a time, so it is the only writer of the published table state. Only snapshots an
+# ingest run handed over with a staged-write document are published; one without, e.g. from a
+# run that failed right after its write, is never published and its objects are ingested again
+staged_writes = load_staged_writes(storage)
+staged_snapshot_ids = {document["snapshot_id"] for _, document in staged_writes}
+snapshots = [snapshot for snapshot in get_unpublished_snapshots(spark, table_fqn) if snapshot[0] in staged_snapshot_ids]
+existing_snapshot_ids = {row.snapshot_id for row in spark.sql(f"SELECT snapshot_id FROM {table_fqn}.snapshots").collect()}
+expired_writes = [(key, document) for key, document in staged_writes if document["snapshot_id"] not in existing_snapshot_ids]
+for key, document in expired_writes:
+    # Its objects were never recorded, so the next ingest run of the prefix reads them again
+    logger.warning(f"Staged snapshot {document['snapshot_id']} of {document['wap_id']} no longer exists; dropping its staged write")
+    storage.delete_object(key)
+touched_partitions = get_staged_partitions(spark, table_fqn, [snapshot_id for snapshot_id, _, _ in snapshots])
+logger.info(f"Publishing {len(snapshots)} staged snapshots touching {len(touched_partitions)} partitions")
+publish_snapshots(spark, table_fqn, snapshots)
+
+# Published now, or already by an earlier run that stopped before completing them
+published_writes = [(key, document) for key, document in staged_writes if document["snapshot_id"] in existing_snapshot_ids]
+with storage.create_deleter(
+    int(optional_args["delete_max_workers"]), int(optional_args["delete_initial_objects_per_second"])
+) as raw_log_deleter:
+    complete_staged_writes(spark, manifest_table_fqn, storage, published_writes, raw_log_deleter)
+deletion_summary = raw_log_deleter.summary()
+logger.info(f"Completed {len(published_writes)} staged writes: {deletion_summary['deleted']} of {deletion_summary['requested']} raw objects deleted, {deletion_summary['failed']} failed")
+
+# Fast ingest runs commit directly but leave their derived refresh here too. Read after the
+# publish, so a document is only deleted once the rows it describes were aggregated
+derived_refreshes = load_derived_refreshes(storage)
+for _, partitions in derived_refreshes:
+    touched_partitions |= partitions
+# Once per region-day for every account and run, so partitions shared by concurrent runs
+# are aggregated once by the only writer of the derived tables
+if touched_partitions:
+    ensure_security_events_table(spark, database_name, args["output_path"])
+    refresh_derived_tables(spark, database_name, table_fqn, touched_partitions, optional_args["security_rule_version"])
+for key, _ in derived_refreshes:
+    storage.delete_object(key)
+logger.info(f"Refreshed {len(touched_partitions)} derived partitions, {len(derived_refreshes)} handed over by fast ingest runs")
+
+if optional_args["run_retention"].lower() == "true":
+    apply_retention(
+        spark,
+        database_name,
+        int(optional_args["retention_days_for_processed_logs"]),
+        storage,
+        min_interval_hours=int(optional_args["retention_interval_hours"]),
+        full_orphan_scan=optional_args["full_orphan_scan"].lower() == "true"
+    )
+
+logger.info(f"Commit coordinator completed in {time.time() - job_start:.1f}s")
+job.commit()
@@ -0,0 +1,198 @@
+"""Helpers and constants shared by every CloudTrail Glue job, Spark and Python shell alike.
+
+Shipped with --extra-py-files; imports neither Spark nor awsglue at module level, so the
+Python shell fast ingest and the local benchmark can import it too.
+"""
+import re
+import hashlib
+import json
+import logging
+import threading
+from datetime import date
+
+import boto3
+
+from cloudtrail_s3_deleter import RawLogDeleter
+
+logger = logging.getLogger(__name__)
+log_lock = threading.Lock()
+
+# Write sort order of cloudtrail_events, so row-group min/max stats on eventName are selective
+EVENTS_SORT_ORDER = ["eventName", "event_time"]
+# event_time_local, the local-time reporting column, is always in this zone
+REPORTING_TIMEZONE = "America/Toronto"
+# Zone of the event_date partition values. UTC matches the raw day prefixes, so one source day
+# lands in one partition; the zone a table was built with is kept in a table property, and
+# tables created before it existed used the reporting zone
+DEFAULT_PARTITION_TIMEZONE = "UTC"
+LEGACY_PARTITION_TIMEZONE = REPORTING_TIMEZONE
+PARTITION_TIMEZONE_PROPERTY = "cloudtrail.partition-timezone"
+# Staged writes waiting for the commit coordinator, one JSON document per wap.id under a
+# directory per day prefix
+STAGED_WRITES_PREFIX = "glue_job_tmp/staged_writes/"
+# Region-days written outside the staged path whose derived rows the commit coordinator
+# recomputes, one JSON document per ingest run
+DERIVED_REFRESH_PREFIX = "glue_job_tmp/derived_refresh/"
+# AWSLogs/{account_id}/CloudTrail/{region}/, or for an organization trail
+# AWSLogs/{o-xxxx}/{account_id}/CloudTrail/{region}/
+CLOUDTRAIL_PREFIX_PATTERN = re.compile(r'AWSLogs/(?:o-[a-z0-9]{10,32}/)?(\d{12})/CloudTrail/([a-z]{2}(?:-[a-z]+)+-\d)/')
+
+
+def thread_safe_log(level, message):
+    with log_lock:
+        if level == "info":
+            logger.info(message)
+        elif level == "warning":
+            logger.warning(message)
+        elif level == "error":
+            logger.error(message)
+        else:
+            logger.info(message)
+
+
+def get_optional_args(argv, defaults):
+    """Resolve optional job arguments, falling back to the given defaults."""
+    # Only present on Glue, so the benchmark can import this module without it
+    from awsglue.utils import getResolvedOptions
+
+    present = [name for name in defaults if f"--{name}" in argv]
+    resolved = getResolvedOptions(argv, present) if present else {}
+    return {name: resolved.get(name, default) for name, default in defaults.items()}
+
+
+def extract_account_region_from_prefix(prefix):
+    """Extract (account_id, region) from a CloudTrail prefix path, or None."""
+    match = CLOUDTRAIL_PREFIX_PATTERN.search(prefix)
+    if match:
+        return match.group(1), match.group(2)
+    return None
+
+
+def resolve_day_prefixes(storage, specific_prefix, prefixes_arg, prefix_manifest_uri):
+    """Combine --prefix, --prefixes and --prefix_manifest into one de-duplicated, ordered list.
+
+    Also returns the compressed bytes per prefix the planner recorded in the manifest, if any.
+    """
+    candidates = []
+    prefix_bytes = {}
+    if specific_prefix:
+        candidates.append(specific_prefix)
+    if prefixes_arg:
+        candidates.extend(p.strip() for p in prefixes_arg.split(",") if p.strip())
+    if prefix_manifest_uri:
+        manifest = storage.read_json(prefix_manifest_uri)
+        candidates.extend(manifest.get("prefixes", []))
+        prefix_bytes = manifest.get("prefix_bytes", {})
+    resolved = []
+    for prefix in candidates:
+        # Ensure prefix ends with / for consistency
+        if not prefix.endswith("/"):
+            prefix = f"{prefix}/"
+        if prefix not in resolved:
+            resolved.append(prefix)
+    return resolved, {
+        (prefix if prefix.endswith("/") else f"{prefix}/"): size for prefix, size in prefix_bytes.items()
+    }
+
+
+def get_staged_writes_prefix(day_prefix=None):
+    if day_prefix is None:
+        return STAGED_WRITES_PREFIX
+    return f"{STAGED_WRITES_PREFIX}{hashlib.md5(day_prefix.encode('utf-8')).hexdigest()}/"
+
+
+def load_staged_writes(storage, day_prefix=None):
+    """(key, document) of the staged writes not yet published, for one day prefix or all of them."""
+    return [
+        (obj["key"], storage.read_json(storage.uri(obj["key"])))
+        for obj in storage.list_objects(get_staged_writes_prefix(day_prefix))
+        if obj["key"].endswith(".json")
+    ]
+
+
+def load_staged_objects(storage, day_prefix):
+    """(key, etag) of the objects of a day prefix whose staged writes are not yet published."""
+    return {
+        (obj["key"], obj["etag"])
+        for _, document in load_staged_writes(storage, day_prefix) for obj in document["objects"]
+    }
+
+
+def record_derived_refresh(storage, job_run_id, touched_partitions):
+    """Leave the derived refresh of the touched (region, event_date) partitions to the commit coordinator.
+
+    The rollups aggregate every account of a region-day, so runs over different accounts
+    refreshing the same partitions concurrently could overwrite each other's results; the
+    coordinator, the only writer of the derived tables, recomputes each one once.
+    """
+    if not touched_partitions:
+        return
+    storage.write_json(storage.uri(f"{DERIVED_REFRESH_PREFIX}{job_run_id}.json"), {
+        "job_run_id": job_run_id,
+        "partitions": sorted([region, str(event_date)] for region, event_date in touched_partitions)
+    })
+    thread_safe_log("info", f"Left the derived refresh of {len(touched_partitions)} partitions to the commit coordinator")
+
+
+def load_derived_refreshes(storage):
+    """(key, set of (region, event_date)) of the derived refreshes waiting for the commit coordinator."""
+    refreshes = []
+    for obj in storage.list_objects(DERIVED_REFRESH_PREFIX):
+        if not obj["key"].endswith(".json"):
+            continue
+        document = storage.read_json(storage.uri(obj["key"]))
+        refreshes.append((obj["key"], {
+            (region, date.fromisoformat(event_date)) for region, event_date in document["partitions"]
+        }))
+    return refreshes
+
+
+class S3Storage:
+    """Raw CloudTrail objects in an S3 bucket. Pass an s3_client created against moto to test locally."""
+
+    def __init__(self, bucket, s3_client=None, uri_scheme="s3"):
+        self.bucket = bucket
+        self.injected_client = s3_client
+        self.s3_client = s3_client or boto3.client("s3")
+        self.uri_scheme = uri_scheme
+
+    def list_objects(self, prefix):
+        """List the log objects under a day prefix together with their ETag, size and LastModified."""
+        objects = []
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                if obj["Key"].endswith("/"):
+                    continue
+                objects.append({
+                    "key": obj["Key"],
+                    "etag": obj["ETag"].strip('"'),
+                    "size": obj["Size"],
+                    "last_modified": obj["LastModified"]
+                })
+        return objects
+
+    def uri(self, key):
+        return f"{self.uri_scheme}://{self.bucket}/{key}"
+
+    def read_json(self, uri):
+        bucket, _, key = re.sub(r"^s3a?://", "", uri).partition("/")
+        return json.loads(self.s3_client.get_object(Bucket=bucket, Key=key)["Body"].read())
+
+    def write_json(self, uri, document):
+        bucket, _, key = re.sub(r"^s3a?://", "", uri).partition("/")
+        self.s3_client.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=json.dumps(document, default=str).encode("utf-8"),
+            ContentType="application/json"
+        )
+
+    def delete_object(self, key):
+        self.s3_client.delete_object(Bucket=self.bucket, Key=key)
+
+    def create_deleter(self, max_workers, initial_rate):
+        # Without an injected client the deleter builds its own, with a pool sized to max_workers
+        return RawLogDeleter(
+            self.bucket, max_workers=max_workers, initial_rate=initial_rate, s3_client=self.injected_client
+        )
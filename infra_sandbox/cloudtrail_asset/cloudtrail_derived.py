@@ -0,0 +1,736 @@
+"""Derived columns and tables shared by the CloudTrail Glue jobs.
+
+Shipped to the Spark ingest, fast ingest and backfill jobs with --extra-py-files, so it
+imports without Spark and only needs pyarrow for the Arrow helpers.
+"""
+import re
+import json
+import logging
+from datetime import date, datetime, timedelta, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+    pc = None
+
+logger = logging.getLogger(__name__)
+
+CLASSIFICATION_RULES_TABLE = "cloudtrail_classification_rules"
+
+# Stored on cloudtrail_events in this order; older tables get them appended by ALTER TABLE
+CLASSIFICATION_COLUMNS = [
+    ("hour_of_day", "int"),
+    ("day_of_week", "int"),
+    ("is_failed", "int"),
+    ("is_root_user", "int"),
+    ("operation_type", "string"),
+    ("time_category", "string"),
+    ("classification_version", "int")
+]
+
+# Columns whose values come from the rule table; the rest are plain functions of event_time
+RULE_TARGET_COLUMNS = ["is_failed", "is_root_user", "operation_type", "time_category"]
+DERIVED_FIELD_SQL = {
+    "hour_of_day": "hour(event_time)",
+    # ISO numbering, 1 = Monday, like Athena's DAY_OF_WEEK
+    "day_of_week": "weekday(event_time) + 1"
+}
+
+# Rules are evaluated per target column in ascending priority, the first match wins and the
+# "default" rule supplies the value when nothing matches
+RULE_MATCH_TYPES = ("contains", "equals", "not_null", "between", "default")
+RULE_FIELD_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+DEFAULT_CLASSIFICATION_RULE_VERSION = 1
+# (target_column, priority, match_field, match_type, pattern, result), same logic the
+# cloudtrail_flattened view used to evaluate at query time
+DEFAULT_CLASSIFICATION_RULES = [
+    ("is_failed", 1, "errorCode", "not_null", None, "1"),
+    ("is_failed", 99, None, "default", None, "0"),
+    ("is_root_user", 1, "userIdentity.type", "equals", "Root", "1"),
+    ("is_root_user", 99, None, "default", None, "0"),
+    ("operation_type", 1, "eventName", "contains", "Create", "Create"),
+    ("operation_type", 2, "eventName", "contains", "Delete", "Delete"),
+    ("operation_type", 3, "eventName", "contains", "Update", "Update"),
+    ("operation_type", 3, "eventName", "contains", "Modify", "Update"),
+    ("operation_type", 3, "eventName", "contains", "Put", "Update"),
+    ("operation_type", 4, "eventName", "contains", "Get", "Read"),
+    ("operation_type", 4, "eventName", "contains", "Describe", "Read"),
+    ("operation_type", 4, "eventName", "contains", "List", "Read"),
+    ("operation_type", 99, None, "default", None, "Other"),
+    ("time_category", 1, "hour_of_day", "between", "9,17", "Business Hours"),
+    ("time_category", 99, None, "default", None, "Off Hours")
+]
+
+def get_rules_table_schema_ddl():
+    return (
+        "rule_version int, target_column string, priority int, match_field string, "
+        "match_type string, pattern string, result string, created_at timestamp"
+    )
+
+def ensure_rules_table(spark, database_name, output_path):
+    """Create the versioned rule table and seed it with the default rules when it is empty."""
+    table_fqn = f"glue_catalog.{database_name}.{CLASSIFICATION_RULES_TABLE}"
+    spark.sql(f"""
+        CREATE TABLE IF NOT EXISTS {table_fqn} ({get_rules_table_schema_ddl()})
+        USING iceberg
+        LOCATION '{output_path.rstrip('/')}/{CLASSIFICATION_RULES_TABLE}'
+        TBLPROPERTIES ('format-version'='2')
+    """)
+    if spark.table(table_fqn).limit(1).count() == 0:
+        created_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        rows = [
+            (DEFAULT_CLASSIFICATION_RULE_VERSION, *rule, created_at)
+            for rule in DEFAULT_CLASSIFICATION_RULES
+        ]
+        spark.createDataFrame(rows, get_rules_table_schema_ddl()).writeTo(table_fqn).append()
+        logger.info(f"Seeded {table_fqn} with {len(rows)} default rules as version {DEFAULT_CLASSIFICATION_RULE_VERSION}")
+    return table_fqn
+
+def default_rule_rows():
+    columns = ("target_column", "priority", "match_field", "match_type", "pattern", "result")
+    return [
+        {"rule_version": DEFAULT_CLASSIFICATION_RULE_VERSION, **dict(zip(columns, rule))}
+        for rule in DEFAULT_CLASSIFICATION_RULES
+    ]
+
+def select_rule_version(rule_rows, requested_version):
+    """Pick one version out of the rule table rows and group its rules by target column.
+
+    Returns (version, {target_column: {"matchers": [...], "default": result}}).
+    """
+    versions = {row["rule_version"] for row in rule_rows}
+    if not versions:
+        raise ValueError("Classification rule table is empty")
+    version = max(versions) if requested_version in ("", "latest") else int(requested_version)
+    if version not in versions:
+        raise ValueError(f"Classification rule version {version} not found, available: {sorted(versions)}")
+
+    rules = {}
+    for row in rule_rows:
+        if row["rule_version"] != version:
+            continue
+        target = row["target_column"]
+        match_type = row["match_type"]
+        if target not in RULE_TARGET_COLUMNS:
+            raise ValueError(f"Rule targets unsupported column: {target}")
+        if match_type not in RULE_MATCH_TYPES:
+            raise ValueError(f"Rule for {target} has unsupported match_type: {match_type}")
+        entry = rules.setdefault(target, {"matchers": [], "default": None})
+        if match_type == "default":
+            entry["default"] = row["result"]
+            continue
+        if not RULE_FIELD_PATTERN.match(row["match_field"] or ""):
+            raise ValueError(f"Rule for {target} has invalid match_field: {row['match_field']}")
+        entry["matchers"].append(row)
+    for target in RULE_TARGET_COLUMNS:
+        entry = rules.get(target)
+        if entry is None or entry["default"] is None:
+            raise ValueError(f"Rule version {version} has no default for {target}")
+        entry["matchers"].sort(key=lambda rule: (rule["priority"], rule["pattern"] or ""))
+    return version, rules
+
+def sql_string(value):
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+def sql_result(target, value):
+    return str(int(value)) if dict(CLASSIFICATION_COLUMNS)[target] == "int" else sql_string(value)
+
+def rule_condition_sql(rule):
+    # Derived fields are inlined so the expression also works in an UPDATE that sets them
+    field = DERIVED_FIELD_SQL.get(rule["match_field"], rule["match_field"])
+    match_type = rule["match_type"]
+    if match_type == "contains":
+        # instr instead of LIKE so '_' and '%' in patterns are literal
+        return f"instr({field}, {sql_string(rule['pattern'])}) > 0"
+    if match_type == "equals":
+        return f"{field} = {sql_string(rule['pattern'])}"
+    if match_type == "not_null":
+        return f"{field} IS NOT NULL"
+    low, high = (int(bound) for bound in rule["pattern"].split(","))
+    return f"{field} BETWEEN {low} AND {high}"
+
+def classification_sql_expressions(version, rules):
+    """Spark SQL expressions for every classification column, in CLASSIFICATION_COLUMNS order."""
+    column_types = dict(CLASSIFICATION_COLUMNS)
+    expressions = [(name, f"CAST({sql} AS int)") for name, sql in DERIVED_FIELD_SQL.items()]
+    for target in RULE_TARGET_COLUMNS:
+        column_type = column_types[target]
+        entry = rules[target]
+        branches = " ".join(
+            f"WHEN {rule_condition_sql(rule)} THEN {sql_result(target, rule['result'])}"
+            for rule in entry["matchers"]
+        )
+        default = sql_result(target, entry["default"])
+        case_sql = f"CASE {branches} ELSE {default} END" if branches else default
+        expressions.append((target, f"CAST({case_sql} AS {column_type})"))
+    expressions.append(("classification_version", f"CAST({version} AS int)"))
+    return expressions
+
+def get_derived_event_columns():
+    """Columns the ingest jobs compute onto cloudtrail_events, in the order they are appended."""
+    return [*CLASSIFICATION_COLUMNS, *[(name, "string") for name, *_ in EXTRACTED_COLUMNS], (EXTRACTED_ATTRIBUTES_COLUMN, "map<string,string>")]
+
+def ensure_derived_columns(spark, table_fqn):
+    """Append the derived columns to an events table created before they existed."""
+    existing = {name.lower() for name in spark.table(table_fqn).columns}
+    missing = [(name, column_type) for name, column_type in get_derived_event_columns() if name.lower() not in existing]
+    if not missing:
+        return False
+    spark.sql(f"ALTER TABLE {table_fqn} ADD COLUMNS ({', '.join(f'{name} {column_type}' for name, column_type in missing)})")
+    logger.info(f"Added derived columns to {table_fqn}: {[name for name, _ in missing]}")
+    return True
+
+def arrow_field(table, field):
+    if field == "hour_of_day":
+        return pc.hour(table.column("event_time"))
+    if field == "day_of_week":
+        return pc.day_of_week(table.column("event_time"), count_from_zero=False, week_start=1)
+    name, *path = field.split(".")
+    values = table.column(name).combine_chunks()
+    for child in path:
+        values = pc.struct_field(values, child)
+    return values
+
+def arrow_rule_condition(table, rule):
+    values = arrow_field(table, rule["match_field"])
+    match_type = rule["match_type"]
+    if match_type == "contains":
+        matched = pc.match_substring(values, rule["pattern"])
+    elif match_type == "equals":
+        matched = pc.equal(values, rule["pattern"])
+    elif match_type == "not_null":
+        matched = pc.is_valid(values)
+    else:
+        low, high = (int(bound) for bound in rule["pattern"].split(","))
+        matched = pc.and_(pc.greater_equal(values, low), pc.less_equal(values, high))
+    return pc.fill_null(matched, False)
+
+def arrow_result(target, value):
+    if dict(CLASSIFICATION_COLUMNS)[target] == "int":
+        return pa.scalar(int(value), pa.int32())
+    return pa.scalar(value, pa.string())
+
+def classify_arrow(table, version, rules):
+    """Arrow counterpart of classification_sql_expressions for the fast ingest engine.
+
+    Only columns present in the table's schema are filled, so a table the Spark job has not
+    migrated yet is written unchanged.
+    """
+    def set_column(current, name, values):
+        index = current.schema.get_field_index(name)
+        if index < 0:
+            return current
+        field = current.schema.field(index)
+        return current.set_column(index, field, pc.cast(values, field.type))
+
+    for name in DERIVED_FIELD_SQL:
+        table = set_column(table, name, arrow_field(table, name))
+    for target in RULE_TARGET_COLUMNS:
+        if table.schema.get_field_index(target) < 0:
+            continue
+        entry = rules[target]
+        values = pa.repeat(arrow_result(target, entry["default"]), table.num_rows)
+        for rule in reversed(entry["matchers"]):
+            values = pc.if_else(arrow_rule_condition(table, rule), arrow_result(target, rule["result"]), values)
+        table = set_column(table, target, values)
+    return set_column(table, "classification_version", pa.repeat(pa.scalar(version, pa.int32()), table.num_rows))
+
+# Frequently queried request/response fields, each pulled out of the raw JSON text only for
+# events of its service: (column, source field, path, eventSource). Integers index arrays.
+EXTRACTED_COLUMNS = [
+    ("s3_bucket_name", "requestParameters", ("bucketName",), "s3.amazonaws.com"),
+    ("iam_role_name", "requestParameters", ("roleName",), "iam.amazonaws.com"),
+    ("iam_policy_arn", "requestParameters", ("policyArn",), "iam.amazonaws.com"),
+    ("iam_user_name", "requestParameters", ("userName",), "iam.amazonaws.com"),
+    ("ec2_instance_id", "requestParameters", ("instancesSet", "items", 0, "instanceId"), "ec2.amazonaws.com"),
+    ("kms_key_id", "requestParameters", ("keyId",), "kms.amazonaws.com"),
+    ("lambda_function_name", "requestParameters", ("functionName",), "lambda.amazonaws.com")
+]
+# Less common fields go into one map column, so adding one here needs no schema change
+EXTRACTED_ATTRIBUTES_COLUMN = "extracted_attributes"
+EXTRACTED_ATTRIBUTES = [
+    ("s3_object_key", "requestParameters", ("key",), "s3.amazonaws.com"),
+    ("sts_role_arn", "requestParameters", ("roleArn",), "sts.amazonaws.com"),
+    ("sts_role_session_name", "requestParameters", ("roleSessionName",), "sts.amazonaws.com"),
+    ("ec2_launched_instance_id", "responseElements", ("instancesSet", "items", 0, "instanceId"), "ec2.amazonaws.com"),
+    ("ec2_security_group_id", "requestParameters", ("groupId",), "ec2.amazonaws.com"),
+    ("iam_access_key_id", "responseElements", ("accessKey", "accessKeyId"), "iam.amazonaws.com"),
+    ("kms_encryption_context_arn", "requestParameters", ("encryptionContext", "aws:lambda:FunctionArn"), "kms.amazonaws.com"),
+    ("signin_mfa_used", "additionalEventData", ("MFAUsed",), "signin.amazonaws.com"),
+    ("s3_bytes_transferred_out", "additionalEventData", ("bytesTransferredOut",), "s3.amazonaws.com")
+]
+
+def build_extraction_tree(paths):
+    """Merge JSON paths into one tree so each source column is parsed once for all of them."""
+    tree = {}
+    for path in paths:
+        node = tree
+        for index, step in enumerate(path):
+            if isinstance(step, int):
+                continue
+            node = node.setdefault(step, {})
+            if index + 1 < len(path) and isinstance(path[index + 1], int):
+                node = node.setdefault("[]", {})
+    return tree
+
+def extraction_tree_ddl(node, top_level=False):
+    fields = []
+    for name, child in node.items():
+        if name == "[]":
+            continue
+        if "[]" in child:
+            child_type = f"ARRAY<{extraction_tree_ddl(child['[]']) if child['[]'] else 'STRING'}>"
+        elif child:
+            child_type = extraction_tree_ddl(child)
+        else:
+            child_type = "STRING"
+        fields.append(f"`{name}` {child_type}" if top_level else f"`{name}`: {child_type}")
+    return ", ".join(fields) if top_level else f"STRUCT<{', '.join(fields)}>"
+
+def extraction_sql_expressions():
+    """Spark SQL for the extraction stage: (parse expressions, column expressions, temp columns).
+
+    Each source column is parsed by one from_json with a schema holding only the wanted paths,
+    and only for events of services that have something to extract.
+    """
+    specs = [*EXTRACTED_COLUMNS, *EXTRACTED_ATTRIBUTES]
+    parse_expressions = []
+    for source in sorted({source for _, source, _, _ in specs}):
+        source_specs = [spec for spec in specs if spec[1] == source]
+        event_sources = ", ".join(sql_string(event_source) for event_source in sorted({spec[3] for spec in source_specs}))
+        ddl = extraction_tree_ddl(build_extraction_tree([spec[2] for spec in source_specs]), top_level=True)
+        parse_expressions.append((
+            f"_parsed_{source}",
+            f"CASE WHEN eventSource IN ({event_sources}) THEN from_json({source}, {sql_string(ddl)}) END"
+        ))
+
+    def access_sql(source, path, event_source):
+        access = f"`_parsed_{source}`" + "".join(f"[{step}]" if isinstance(step, int) else f".`{step}`" for step in path)
+        return f"CASE WHEN eventSource = {sql_string(event_source)} THEN {access} END"
+
+    column_expressions = [(name, access_sql(*spec)) for name, *spec in EXTRACTED_COLUMNS]
+    attribute_pairs = ", ".join(f"{sql_string(name)}, {access_sql(*spec)}" for name, *spec in EXTRACTED_ATTRIBUTES)
+    column_expressions.append((
+        EXTRACTED_ATTRIBUTES_COLUMN,
+        f"map_filter(map({attribute_pairs}), (k, v) -> v IS NOT NULL)"
+    ))
+    return parse_expressions, column_expressions, [name for name, _ in parse_expressions]
+
+def extract_json_path(value, path):
+    for step in path:
+        if isinstance(step, int):
+            if not isinstance(value, list) or len(value) <= step:
+                return None
+        elif not isinstance(value, dict):
+            return None
+        value = value[step] if isinstance(step, int) else value.get(step)
+    if value is None:
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"))
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+def extract_fields_python(record):
+    """Pure Python counterpart of extraction_sql_expressions for one record with lower-cased top-level keys."""
+    event_source = record.get("eventsource")
+
+    def extract(source, path, spec_event_source):
+        if event_source != spec_event_source:
+            return None
+        return extract_json_path(record.get(source.lower()), path)
+
+    extracted = {name: extract(*spec) for name, *spec in EXTRACTED_COLUMNS}
+    attributes = [(name, extract(*spec)) for name, *spec in EXTRACTED_ATTRIBUTES]
+    extracted[EXTRACTED_ATTRIBUTES_COLUMN] = [(name, value) for name, value in attributes if value is not None]
+    return extracted
+
+def get_rollup_table_definitions():
+    """Column DDL of the physical rollups behind cloudtrail_daily_metrics and cloudtrail_user_summary."""
+    return {
+        "cloudtrail_daily_metrics_rollup": """
+            event_date date,
+            region string,
+            eventsource string,
+            operation_type string,
+            user_type string,
+            time_category string,
+            total_events bigint,
+            unique_users bigint,
+            unique_ips bigint,
+            failed_events bigint,
+            root_user_events bigint,
+            unique_api_calls bigint
+        """,
+        # One row per user, service and action per day; the view re-aggregates these exactly
+        "cloudtrail_user_activity_rollup": """
+            event_date date,
+            region string,
+            user_principal_id string,
+            user_type string,
+            eventsource string,
+            eventname string,
+            total_api_calls bigint,
+            failed_attempts bigint,
+            first_activity timestamp,
+            last_activity timestamp
+        """
+    }
+
+def ensure_rollup_tables(spark, database_name, output_path):
+    for rollup_table, columns in get_rollup_table_definitions().items():
+        spark.sql(f"""
+            CREATE TABLE IF NOT EXISTS glue_catalog.{database_name}.{rollup_table} ({columns})
+            USING iceberg
+            LOCATION '{output_path.rstrip('/')}/{rollup_table}'
+            TBLPROPERTIES ('format-version'='2')
+            PARTITIONED BY (region, event_date)
+        """)
+
+# Widest UTC offset, so an event_time window around a local event_date holds all of its events
+MAX_UTC_OFFSET = timedelta(hours=14)
+
+def event_time_bounds(first_date, last_date=None):
+    """[start, end) event_time window holding every event of the event_date range, whatever its zone.
+
+    Dates may be date objects or YYYY-MM-DD strings; without last_date the window is open ended.
+    """
+    first_date = date.fromisoformat(str(first_date))
+    start = datetime.combine(first_date, datetime.min.time()) - MAX_UTC_OFFSET
+    if last_date is None:
+        return start, None
+    last_date = date.fromisoformat(str(last_date))
+    return start, datetime.combine(last_date, datetime.min.time()) + timedelta(days=1) + MAX_UTC_OFFSET
+
+def event_time_bound_sql(first_date, last_date=None):
+    """SQL predicate of event_time_bounds, so reads of a table partitioned by event_time prune."""
+    start, end = event_time_bounds(first_date, last_date)
+    clause = f"event_time >= TIMESTAMP '{start:%Y-%m-%d %H:%M:%S}'"
+    if end is not None:
+        clause = f"{clause} AND event_time < TIMESTAMP '{end:%Y-%m-%d %H:%M:%S}'"
+    return clause
+
+def build_partition_filter(touched_partitions, bound_event_time=False):
+    """SQL predicate selecting the given (region, event_date) partitions.
+
+    With bound_event_time, each region's clause also bounds event_time, so reads of a
+    cloudtrail_events table partitioned by days(event_time) or hours(event_time) prune too.
+    """
+    dates_by_region = {}
+    for region, event_date in touched_partitions:
+        dates_by_region.setdefault(region, set()).add(event_date)
+    clauses = []
+    for region, event_dates in sorted(dates_by_region.items()):
+        date_list = ", ".join(f"DATE '{event_date}'" for event_date in sorted(event_dates))
+        clause = f"region = '{region}' AND event_date IN ({date_list})"
+        if bound_event_time:
+            clause = f"{clause} AND {event_time_bound_sql(min(event_dates), max(event_dates))}"
+        clauses.append(f"({clause})")
+    return " OR ".join(clauses)
+
+def refresh_rollups(spark, database_name, events_table_fqn, touched_partitions):
+    """Recompute the rollup partitions matching the given (region, event_date) partitions.
+
+    INSERT OVERWRITE runs with dynamic partition overwrite, so only those partitions are replaced.
+    """
+    if not touched_partitions:
+        return
+    partition_filter = build_partition_filter(touched_partitions)
+    spark.sql(f"""
+        SELECT
+            event_date,
+            region,
+            event_time,
+            eventSource AS eventsource,
+            eventName AS eventname,
+            sourceIpAddress AS sourceipaddress,
+            userIdentity.type AS user_type,
+            userIdentity.principalId AS user_principal_id,
+            is_failed,
+            is_root_user,
+            operation_type,
+            time_category
+        FROM {events_table_fqn}
+        WHERE {build_partition_filter(touched_partitions, bound_event_time=True)}
+    """).createOrReplaceTempView("tmp_classified_events")
+    spark.sql(f"""
+        INSERT OVERWRITE glue_catalog.{database_name}.cloudtrail_daily_metrics_rollup
+        SELECT
+            event_date,
+            region,
+            eventsource,
+            operation_type,
+            user_type,
+            time_category,
+            COUNT(*) AS total_events,
+            COUNT(DISTINCT user_principal_id) AS unique_users,
+            COUNT(DISTINCT sourceipaddress) AS unique_ips,
+            SUM(is_failed) AS failed_events,
+            SUM(is_root_user) AS root_user_events,
+            COUNT(DISTINCT eventname) AS unique_api_calls
+        FROM tmp_classified_events
+        GROUP BY event_date, region, eventsource, operation_type, user_type, time_category
+    """)
+    spark.sql(f"""
+        INSERT OVERWRITE glue_catalog.{database_name}.cloudtrail_user_activity_rollup
+        SELECT
+            event_date,
+            region,
+            user_principal_id,
+            user_type,
+            eventsource,
+            eventname,
+            COUNT(*) AS total_api_calls,
+            SUM(is_failed) AS failed_attempts,
+            MIN(event_time) AS first_activity,
+            MAX(event_time) AS last_activity
+        FROM tmp_classified_events
+        GROUP BY event_date, region, user_principal_id, user_type, eventsource, eventname
+    """)
+    logger.info(f"Refreshed rollups for {len(touched_partitions)} partitions: {partition_filter}")
+
+SECURITY_EVENTS_TABLE = "cloudtrail_security_events"
+SECURITY_RULES_TABLE = "cloudtrail_security_rules"
+DEFAULT_SECURITY_RULE_VERSION = 1
+ACCESS_DENIED_ERROR_CODES = ["AccessDenied", "UnauthorizedOperation"]
+# Declarative security rules over the raw event fields. A rule matches when any of its clauses
+# matches, a clause matches when all of its field conditions do. Conditions are "in" (exact
+# match set), "contains" (any of the substrings), "contains_all" and "not_null".
+SECURITY_RULE_SETS = ("include", "alert_type", "severity")
+SECURITY_CONDITION_TYPES = ("in", "contains", "contains_all", "not_null")
+# Seeded into the rule table as version 1
+DEFAULT_SECURITY_RULES = {
+    "include": [
+        {"userIdentity.type": {"in": ["Root"]}},
+        {"errorCode": {"in": ACCESS_DENIED_ERROR_CODES}},
+        {"eventName": {"in": ["ConsoleLogin", "CreateUser", "CreateRole", "CreateAccessKey", "DeleteUser"]}},
+        {"eventName": {"contains": ["Policy"]}}
+    ],
+    "alert_type": {
+        "rules": [
+            ("Root Account Usage", [{"userIdentity.type": {"in": ["Root"]}}]),
+            ("Access Denied", [{"errorCode": {"in": ACCESS_DENIED_ERROR_CODES}}]),
+            ("Failed Login", [{"eventName": {"in": ["ConsoleLogin"]}, "errorCode": {"not_null": True}}]),
+            ("Policy Change", [{"eventName": {"contains": ["Policy"]}}]),
+            ("IAM Change", [{"eventName": {"in": ["CreateUser", "CreateRole", "CreateAccessKey", "DeleteUser"]}}]),
+            ("S3 Public Access", [{"eventName": {"contains_all": ["Bucket", "Public"]}}])
+        ],
+        "default": "Other Security Event"
+    },
+    "severity": {
+        "rules": [
+            ("High", [{"userIdentity.type": {"in": ["Root"]}}, {"errorCode": {"in": ACCESS_DENIED_ERROR_CODES}}]),
+            ("Medium", [{"eventName": {"contains": ["Policy"]}}, {"eventName": {"in": ["CreateUser", "CreateRole", "CreateAccessKey"]}}])
+        ],
+        "default": "Low"
+    }
+}
+
+def get_security_rules_table_schema_ddl():
+    # One row per label, in ascending priority; clauses is the JSON list of clauses and is null
+    # for the default label of a rule set. The include rule set has a single unlabelled row
+    return "rule_version int, rule_set string, priority int, label string, clauses string, created_at timestamp"
+
+def default_security_rule_rows():
+    rows = [{
+        "rule_version": DEFAULT_SECURITY_RULE_VERSION, "rule_set": "include", "priority": 1,
+        "label": None, "clauses": json.dumps(DEFAULT_SECURITY_RULES["include"])
+    }]
+    for rule_set in ("alert_type", "severity"):
+        label_rules = DEFAULT_SECURITY_RULES[rule_set]
+        rows.extend(
+            {
+                "rule_version": DEFAULT_SECURITY_RULE_VERSION, "rule_set": rule_set, "priority": priority,
+                "label": label, "clauses": json.dumps(clauses)
+            }
+            for priority, (label, clauses) in enumerate(label_rules["rules"], start=1)
+        )
+        rows.append({
+            "rule_version": DEFAULT_SECURITY_RULE_VERSION, "rule_set": rule_set, "priority": 99,
+            "label": label_rules["default"], "clauses": None
+        })
+    return rows
+
+def ensure_security_rules_table(spark, database_name, output_path):
+    """Create the versioned security rule table and seed it with the default rules when it is empty."""
+    table_fqn = f"glue_catalog.{database_name}.{SECURITY_RULES_TABLE}"
+    spark.sql(f"""
+        CREATE TABLE IF NOT EXISTS {table_fqn} ({get_security_rules_table_schema_ddl()})
+        USING iceberg
+        LOCATION '{output_path.rstrip('/')}/{SECURITY_RULES_TABLE}'
+        TBLPROPERTIES ('format-version'='2')
+    """)
+    if spark.table(table_fqn).limit(1).count() == 0:
+        created_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        columns = ("rule_version", "rule_set", "priority", "label", "clauses")
+        rows = [(*(row[column] for column in columns), created_at) for row in default_security_rule_rows()]
+        spark.createDataFrame(rows, get_security_rules_table_schema_ddl()).writeTo(table_fqn).append()
+        logger.info(f"Seeded {table_fqn} with {len(rows)} default security rules as version {DEFAULT_SECURITY_RULE_VERSION}")
+    return table_fqn
+
+def parse_security_clauses(clauses_json, context):
+    """Decode and check the clauses of one rule row; field names end up verbatim in the SQL."""
+    clauses = json.loads(clauses_json)
+    if not isinstance(clauses, list) or not clauses:
+        raise ValueError(f"Security rule {context} has no clauses")
+    for clause in clauses:
+        if not isinstance(clause, dict) or not clause:
+            raise ValueError(f"Security rule {context} has an empty clause")
+        for field, condition in clause.items():
+            if not RULE_FIELD_PATTERN.match(field):
+                raise ValueError(f"Security rule {context} has invalid field: {field}")
+            if not condition or set(condition) - set(SECURITY_CONDITION_TYPES):
+                raise ValueError(f"Security rule {context} has unsupported condition on {field}: {condition}")
+    return clauses
+
+def select_security_rule_version(rule_rows, requested_version):
+    """Pick one version out of the security rule table rows, in the shape of DEFAULT_SECURITY_RULES.
+
+    Returns (version, {"include": clauses, label_rule_set: {"rules": [(label, clauses)], "default": label}}).
+    """
+    versions = {row["rule_version"] for row in rule_rows}
+    if not versions:
+        raise ValueError("Security rule table is empty")
+    version = max(versions) if requested_version in ("", "latest") else int(requested_version)
+    if version not in versions:
+        raise ValueError(f"Security rule version {version} not found, available: {sorted(versions)}")
+
+    rules = {"include": [], "alert_type": {"rules": [], "default": None}, "severity": {"rules": [], "default": None}}
+    for row in sorted(
+        (row for row in rule_rows if row["rule_version"] == version), key=lambda row: (row["priority"], row["label"] or "")
+    ):
+        rule_set = row["rule_set"]
+        if rule_set not in SECURITY_RULE_SETS:
+            raise ValueError(f"Security rule has unsupported rule_set: {rule_set}")
+        if rule_set == "include":
+            rules["include"].extend(parse_security_clauses(row["clauses"], f"{rule_set}/{row['priority']}"))
+        elif row["clauses"] is None:
+            rules[rule_set]["default"] = row["label"]
+        else:
+            rules[rule_set]["rules"].append((row["label"], parse_security_clauses(row["clauses"], f"{rule_set}/{row['label']}")))
+    if not rules["include"]:
+        raise ValueError(f"Security rule version {version} has no include rules")
+    for rule_set in ("alert_type", "severity"):
+        if rules[rule_set]["default"] is None:
+            raise ValueError(f"Security rule version {version} has no default for {rule_set}")
+    return version, rules
+
+def load_security_rules(spark, database_name, requested_version):
+    rows = [row.asDict() for row in spark.table(f"glue_catalog.{database_name}.{SECURITY_RULES_TABLE}").collect()]
+    return select_security_rule_version(rows, requested_version)
+
+def get_security_events_table_ddl():
+    return """
+        event_date date,
+        event_time timestamp,
+        region string,
+        eventname string,
+        user_type string,
+        user_principal_id string,
+        sourceipaddress string,
+        errorcode string,
+        errormessage string,
+        alert_type string,
+        severity string,
+        eventid string,
+        eventsource string,
+        security_rule_version int
+    """
+
+def get_derived_table_names():
+    """Every table derived from cloudtrail_events, so retention can trim them alongside it."""
+    return [*get_rollup_table_definitions(), SECURITY_EVENTS_TABLE]
+
+def ensure_security_events_table(spark, database_name, output_path):
+    ensure_security_rules_table(spark, database_name, output_path)
+    spark.sql(f"""
+        CREATE TABLE IF NOT EXISTS glue_catalog.{database_name}.{SECURITY_EVENTS_TABLE} ({get_security_events_table_ddl()})
+        USING iceberg
+        LOCATION '{output_path.rstrip('/')}/{SECURITY_EVENTS_TABLE}'
+        TBLPROPERTIES ('format-version'='2')
+        PARTITIONED BY (region, event_date)
+    """)
+
+def substring_regex(patterns):
+    """One alternation for all substrings of a condition, so each value is scanned once."""
+    return "|".join(re.escape(pattern) for pattern in sorted(set(patterns)))
+
+def compile_security_clauses(clauses):
+    """Fold single-condition "in" and "contains" clauses on the same field into one set or one
+    alternation, so each field is matched once per rule however many clauses name it."""
+    merged = {}
+    compiled = []
+    for clause in clauses:
+        if len(clause) == 1:
+            field, condition = next(iter(clause.items()))
+            if len(condition) == 1 and ("in" in condition or "contains" in condition):
+                match_type, values = next(iter(condition.items()))
+                key = (field, match_type)
+                if key not in merged:
+                    merged[key] = []
+                    compiled.append({field: {match_type: merged[key]}})
+                merged[key].extend(value for value in values if value not in merged[key])
+                continue
+        compiled.append(clause)
+    return compiled
+
+def security_condition_sql(field, condition):
+    clauses = []
+    if "in" in condition:
+        # Catalyst turns larger IN lists into a hash set lookup
+        clauses.append(f"{field} IN ({', '.join(sql_string(value) for value in condition['in'])})")
+    if "contains" in condition:
+        clauses.append(f"{field} RLIKE {sql_string(substring_regex(condition['contains']))}")
+    for pattern in condition.get("contains_all", []):
+        clauses.append(f"instr({field}, {sql_string(pattern)}) > 0")
+    if condition.get("not_null"):
+        clauses.append(f"{field} IS NOT NULL")
+    return " AND ".join(clauses)
+
+def security_rule_sql(clauses):
+    return " OR ".join(
+        "(" + " AND ".join(security_condition_sql(field, condition) for field, condition in clause.items()) + ")"
+        for clause in compile_security_clauses(clauses)
+    )
+
+def security_label_sql(label_rules):
+    branches = " ".join(
+        f"WHEN {security_rule_sql(clauses)} THEN {sql_string(label)}" for label, clauses in label_rules["rules"]
+    )
+    return f"CASE {branches} ELSE {sql_string(label_rules['default'])} END"
+
+def refresh_security_events(spark, database_name, events_table_fqn, touched_partitions, security_rule_version="latest"):
+    """Recompute the security event partitions matching the given (region, event_date) partitions."""
+    if not touched_partitions:
+        return
+    version, rules = load_security_rules(spark, database_name, security_rule_version)
+    partition_filter = build_partition_filter(touched_partitions, bound_event_time=True)
+    spark.sql(f"""
+        INSERT OVERWRITE glue_catalog.{database_name}.{SECURITY_EVENTS_TABLE}
+        SELECT
+            event_date,
+            event_time,
+            region,
+            eventName AS eventname,
+            userIdentity.type AS user_type,
+            userIdentity.principalId AS user_principal_id,
+            sourceIpAddress AS sourceipaddress,
+            errorCode AS errorcode,
+            errorMessage AS errormessage,
+            {security_label_sql(rules['alert_type'])} AS alert_type,
+            {security_label_sql(rules['severity'])} AS severity,
+            eventId AS eventid,
+            eventSource AS eventsource,
+            {version} AS security_rule_version
+        FROM {events_table_fqn}
+        WHERE ({partition_filter}) AND ({security_rule_sql(rules['include'])})
+    """)
+    logger.info(f"Refreshed {SECURITY_EVENTS_TABLE} for {len(touched_partitions)} partitions with security rule version {version}")
+
+def refresh_derived_tables(spark, database_name, events_table_fqn, touched_partitions, security_rule_version="latest"):
+    refresh_rollups(spark, database_name, events_table_fqn, touched_partitions)
+    refresh_security_events(spark, database_name, events_table_fqn, touched_partitions, security_rule_version)
@@ -0,0 +1,524 @@
+import sys
+import gzip
+import zlib
+import json
+import time
+import random
+import logging
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from zoneinfo import ZoneInfo
+
+import boto3
+import pyarrow as pa
+import pyarrow.compute as pc
+from botocore.config import Config
+from awsglue.utils import getResolvedOptions
+from pyiceberg.catalog import load_catalog
+from pyiceberg.exceptions import CommitFailedException, NoSuchTableError
+from pyiceberg.expressions import And, EqualTo, GreaterThanOrEqual, In, IsNull, LessThanOrEqual, Or
+from pyiceberg.transforms import BucketTransform, TruncateTransform
+from pyiceberg.types import TimestamptzType
+
+from cloudtrail_common import (
+    REPORTING_TIMEZONE,
+    LEGACY_PARTITION_TIMEZONE,
+    PARTITION_TIMEZONE_PROPERTY,
+    EVENTS_SORT_ORDER,
+    S3Storage,
+    load_staged_objects,
+    record_derived_refresh,
+    thread_safe_log,
+    get_optional_args,
+    extract_account_region_from_prefix,
+    resolve_day_prefixes
+)
+from cloudtrail_derived import (
+    CLASSIFICATION_RULES_TABLE,
+    default_rule_rows,
+    select_rule_version,
+    classify_arrow,
+    extract_fields_python
+)
+from cloudtrail_ingest_metrics import StageTimer, emf_documents, emit_emf
+from cloudtrail_s3_deleter import RawLogDeleter
+
+try:
+    import orjson
+
+    def parse_json(payload):
+        return orjson.loads(payload)
+
+    def dump_json(value):
+        return orjson.dumps(value).decode("utf-8")
+except ImportError:
+    def parse_json(payload):
+        return json.loads(payload)
+
+    def dump_json(value):
+        return json.dumps(value, separators=(",", ":"))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# event_time_local is in the reporting zone; event_date in the zone recorded on the table,
+# like the Spark engine, with the reporting zone for tables created before the property
+REPORTING_ZONE = ZoneInfo(REPORTING_TIMEZONE)
+# Optimistic commit retries against the other fast ingest runs writing the same tables
+COMMIT_MAX_ATTEMPTS = 8
+COMMIT_BASE_BACKOFF_SECONDS = 1.0
+COMMIT_MAX_BACKOFF_SECONDS = 30.0
+
+def load_key_manifest(storage, manifest_uri):
+    """Group the objects of an event-driven micro-batch manifest by day prefix."""
+    objects_by_prefix = {}
+    for obj in storage.read_json(manifest_uri).get("objects", []):
+        day_prefix = obj["key"].rsplit("/", 1)[0] + "/"
+        objects_by_prefix.setdefault(day_prefix, []).append({
+            "key": obj["key"],
+            "etag": obj["etag"].strip('"'),
+            "size": obj["size"],
+            # The notification's eventTime is when S3 finished writing the object
+            "last_modified": datetime.fromisoformat(obj["event_time"].replace("Z", "+00:00"))
+        })
+    return objects_by_prefix
+
+def publish_lag_metrics(cloudwatch_client, ingest_mode, lags):
+    """Publish seconds from object delivery to commit in cloudtrail_events as one statistic set."""
+    if not lags:
+        return
+    cloudwatch_client.put_metric_data(
+        Namespace="CloudTrailPipeline",
+        MetricData=[{
+            "MetricName": "EndToEndLagSeconds",
+            "Dimensions": [{"Name": "IngestMode", "Value": ingest_mode}],
+            "StatisticValues": {
+                "SampleCount": len(lags),
+                "Sum": sum(lags),
+                "Minimum": min(lags),
+                "Maximum": max(lags)
+            },
+            "Unit": "Seconds"
+        }]
+    )
+    thread_safe_log("info", f"End-to-end lag over {len(lags)} objects: max {max(lags):.0f}s, mean {sum(lags) / len(lags):.0f}s")
+
+def load_processed_objects(manifest_table, prefix):
+    """Return the (key, etag) pairs already ingested from a day prefix."""
+    processed = manifest_table.scan(
+        row_filter=EqualTo("source_prefix", prefix),
+        selected_fields=("s3_key", "etag")
+    ).to_arrow()
+    return set(zip(processed.column("s3_key").to_pylist(), processed.column("etag").to_pylist()))
+
+def coerce_value(value, arrow_type):
+    """Shape a parsed JSON value like Spark's JSON reader does for the given column type."""
+    if value is None:
+        return None
+    if pa.types.is_struct(arrow_type):
+        if not isinstance(value, dict):
+            return None
+        lowered = {k.lower(): v for k, v in value.items()}
+        return {
+            field.name: coerce_value(lowered.get(field.name.lower()), field.type)
+            for field in arrow_type
+        }
+    if pa.types.is_list(arrow_type):
+        if not isinstance(value, list):
+            return None
+        return [coerce_value(item, arrow_type.value_type) for item in value]
+    if pa.types.is_map(arrow_type):
+        if not isinstance(value, dict):
+            return None
+        return [(str(k), coerce_value(v, arrow_type.item_type)) for k, v in value.items()]
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        # Spark keeps nested JSON as its raw text when the schema says string
+        if isinstance(value, (dict, list)):
+            return dump_json(value)
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        return str(value)
+    return value
+
+def parse_event_time(event_time):
+    if not event_time:
+        return None
+    try:
+        return datetime.strptime(event_time, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    except ValueError:
+        try:
+            return datetime.fromisoformat(event_time.replace("Z", "+00:00")).astimezone(timezone.utc)
+        except ValueError:
+            return None
+
+def build_row(record, arrow_schema, account_id, region, partition_timezone):
+    """Map one CloudTrail record onto the cloudtrail_events columns, including the derived ones."""
+    lowered = {k.lower(): v for k, v in record.items()}
+    event_time = parse_event_time(lowered.get("eventtime"))
+    event_time_local = None
+    event_date = None
+    if event_time is not None:
+        local = event_time.astimezone(REPORTING_ZONE)
+        # from_utc_timestamp semantics: local wall-clock time stored as if it were UTC
+        event_time_local = local.replace(tzinfo=timezone.utc)
+        event_date = event_time.astimezone(partition_timezone).date()
+    derived = {
+        "event_time": event_time,
+        "event_time_local": event_time_local,
+        "event_date": event_date,
+        "region": region,
+        "account_id": account_id
+    }
+    derived.update(extract_fields_python(lowered))
+    row = {}
+    for field in arrow_schema:
+        if field.name in derived:
+            row[field.name] = derived[field.name]
+        else:
+            row[field.name] = coerce_value(lowered.get(field.name.lower()), field.type)
+    return row
+
+def read_log_object(s3_client, bucket, key, arrow_schema, account_id, region, partition_timezone):
+    """Download, decompress and parse one CloudTrail log file into column rows, or None if it is corrupt.
+
+    Only decode and parse failures make an object corrupt. Download errors propagate and fail
+    the run before anything is recorded or deleted, so a network error never loses raw logs.
+    """
+    body = s3_client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    try:
+        if key.endswith(".gz"):
+            body = gzip.decompress(body)
+        document = parse_json(body)
+    except (gzip.BadGzipFile, EOFError, zlib.error, ValueError) as e:
+        thread_safe_log("warning", f"Skipping corrupt object s3://{bucket}/{key}: {e}")
+        return None
+    records = document.get("Records", []) if isinstance(document, dict) else None
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        thread_safe_log("warning", f"Skipping corrupt object s3://{bucket}/{key}: no Records list of events")
+        return None
+    return [build_row(record, arrow_schema, account_id, region, partition_timezone) for record in records]
+
+def read_objects_to_arrow(s3_client, bucket, objects, arrow_schema, account_id, region, partition_timezone,
+                          max_workers, batch_rows):
+    """Read objects concurrently and return an Arrow table plus the objects that failed to parse."""
+    batches = []
+    pending_rows = []
+    corrupt_objects = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                read_log_object, s3_client, bucket, obj["key"], arrow_schema, account_id, region, partition_timezone
+            ): obj
+            for obj in objects
+        }
+        for fut in as_completed(futures):
+            rows = fut.result()
+            if rows is None:
+                corrupt_objects.append(futures[fut])
+                continue
+            pending_rows.extend(rows)
+            if len(pending_rows) >= batch_rows:
+                batches.append(pa.RecordBatch.from_pylist(pending_rows, schema=arrow_schema))
+                pending_rows = []
+    if pending_rows:
+        batches.append(pa.RecordBatch.from_pylist(pending_rows, schema=arrow_schema))
+    return pa.Table.from_batches(batches, schema=arrow_schema), corrupt_objects
+
+def format_event_time_literal(events_table, value):
+    """ISO literal for an event_time predicate, with an offset only if the column is timestamptz."""
+    value = value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(events_table.schema().find_field("event_time").field_type, TimestamptzType):
+        return value.astimezone(timezone.utc).isoformat()
+    return value.replace(tzinfo=None).isoformat()
+
+def drop_existing_events(events_table, batch, account_id, region):
+    """Remove rows whose eventId already exists in the touched (account_id, region, event_date) partitions.
+
+    A duplicate carries the same eventTime, so the batch's event_time range bounds the scan
+    as well, which is what prunes a table partitioned by days or hours of event_time.
+    Rows written before account_id existed are null there and still checked.
+    """
+    event_dates = [d for d in set(batch.column("event_date").to_pylist()) if d is not None]
+    seen = set()
+    if event_dates:
+        row_filter = And(EqualTo("region", region), In("event_date", event_dates))
+        # The Spark job adds account_id; until its next write the table may not have it yet
+        if "account_id" in batch.column_names:
+            row_filter = And(Or(EqualTo("account_id", account_id), IsNull("account_id")), row_filter)
+        event_time_range = pc.min_max(batch.column("event_time"))
+        if event_time_range["min"].is_valid:
+            row_filter = And(
+                row_filter,
+                And(
+                    GreaterThanOrEqual("event_time", format_event_time_literal(events_table, event_time_range["min"].as_py())),
+                    LessThanOrEqual("event_time", format_event_time_literal(events_table, event_time_range["max"].as_py()))
+                )
+            )
+        existing = events_table.scan(row_filter=row_filter, selected_fields=("eventId",)).to_arrow()
+        seen = set(existing.column("eventId").to_pylist())
+    keep = []
+    for event_id in batch.column("eventId").to_pylist():
+        if event_id is None:
+            keep.append(True)
+        elif event_id in seen:
+            keep.append(False)
+        else:
+            seen.add(event_id)
+            keep.append(True)
+    return batch.filter(pa.array(keep, type=pa.bool_()))
+
+def load_classification_rules(catalog, database_name, requested_version):
+    """Read the rule table the Spark job seeds, falling back to the built-in defaults."""
+    try:
+        rule_rows = catalog.load_table((database_name, CLASSIFICATION_RULES_TABLE)).scan().to_arrow().to_pylist()
+    except NoSuchTableError:
+        thread_safe_log("warning", f"{CLASSIFICATION_RULES_TABLE} not found, using the default classification rules")
+        rule_rows = default_rule_rows()
+    return select_rule_version(rule_rows, requested_version)
+
+def commit_with_retry(table, commit, max_attempts=COMMIT_MAX_ATTEMPTS):
+    """Run commit(table), refreshing the table and backing off when a concurrent run committed first.
+
+    Up to 25 runs append to the same tables; pyiceberg raises CommitFailedException when the
+    metadata it built on is no longer current, and commit rebuilds its write from the
+    refreshed table.
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return commit(table)
+        except CommitFailedException as e:
+            if attempt == max_attempts:
+                thread_safe_log("error", f"Commit to {table.identifier} failed after {max_attempts} attempts: {e}")
+                raise
+            delay = min(COMMIT_MAX_BACKOFF_SECONDS, COMMIT_BASE_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            thread_safe_log("warning", f"Commit to {table.identifier} conflicted, attempt {attempt}, retrying: {e}")
+            time.sleep(random.uniform(delay / 2, delay))
+            table.refresh()
+
+def record_processed_objects(manifest_table, prefix, objects, job_run_id):
+    if not objects:
+        return
+    processed_at = datetime.now(timezone.utc)
+    rows = [
+        {
+            "source_prefix": prefix,
+            "s3_key": obj["key"],
+            "etag": obj["etag"],
+            "size_bytes": obj["size"],
+            "last_modified": obj["last_modified"],
+            "processed_at": processed_at,
+            "job_run_id": job_run_id
+        }
+        for obj in objects
+    ]
+    batch = pa.Table.from_pylist(rows, schema=manifest_table.schema().as_arrow())
+    commit_with_retry(manifest_table, lambda table: table.append(batch))
+    thread_safe_log("info", f"Recorded {len(rows)} processed objects for {prefix}")
+
+args = getResolvedOptions(
+    sys.argv,
+    [
+        "input_path",
+        "database_name"
+    ]
+)
+
+s3_input_path = args["input_path"]
+database_name = args["database_name"]
+
+optional_args = get_optional_args(
+    sys.argv,
+    {
+        "JOB_RUN_ID": "unknown",
+        "prefix": "",
+        "prefixes": "",
+        "prefix_manifest": "",
+        # Micro-batch written by the object queue consumer: exact keys instead of listing prefixes
+        "key_manifest": "",
+        "ingest_mode": "batch",
+        "reprocess_all": "false",
+        "write_mode": "merge",
+        "max_workers": "32",
+        "batch_rows": "50000",
+        "delete_max_workers": "16",
+        "delete_initial_objects_per_second": "3000",
+        "classification_rule_version": "latest",
+        # The run summary is written to {summary_prefix}{JOB_RUN_ID}.json for the orchestrator to aggregate
+        "summary_prefix": ""
+    }
+)
+job_run_id = optional_args["JOB_RUN_ID"]
+reprocess_all = optional_args["reprocess_all"].lower() == "true"
+write_mode = optional_args["write_mode"].lower()
+max_workers = int(optional_args["max_workers"])
+batch_rows = int(optional_args["batch_rows"])
+if write_mode not in ("merge", "append"):
+    thread_safe_log("error", f"Unsupported write_mode: {write_mode}")
+    raise ValueError(f"Unsupported write_mode: {write_mode}")
+
+logging_bucket_name = s3_input_path.split("/")[2]
+# One pooled client shared by every download thread
+s3_client = boto3.client(
+    "s3",
+    config=Config(max_pool_connections=max_workers, retries={"max_attempts": 10, "mode": "adaptive"})
+)
+
+storage = S3Storage(logging_bucket_name, s3_client=s3_client)
+
+subfolders, _ = resolve_day_prefixes(
+    storage, optional_args["prefix"], optional_args["prefixes"], optional_args["prefix_manifest"]
+)
+key_manifest_objects = {}
+if optional_args["key_manifest"]:
+    key_manifest_objects = load_key_manifest(storage, optional_args["key_manifest"])
+    subfolders.extend(prefix for prefix in sorted(key_manifest_objects) if prefix not in subfolders)
+if not subfolders:
+    thread_safe_log("error", "No prefix, prefixes, prefix_manifest or key_manifest provided")
+    raise ValueError("No prefix, prefixes, prefix_manifest or key_manifest provided")
+cloudwatch_client = boto3.client("cloudwatch")
+
+prefix_shards = {}
+for day_prefix in subfolders:
+    prefix_shard = extract_account_region_from_prefix(day_prefix)
+    if not prefix_shard:
+        thread_safe_log("error", f"Could not extract account and region from prefix: {day_prefix}")
+        raise ValueError(f"Invalid prefix format: {day_prefix}")
+    prefix_shards[day_prefix] = prefix_shard
+
+catalog = load_catalog("glue", **{"type": "glue"})
+# The Spark job owns table creation; this engine only appends to an existing table
+events_table = catalog.load_table((database_name, "cloudtrail_events"))
+# pyiceberg computes partition values in Arrow, which it cannot do for bucket or truncate yet;
+# failing here sends the batch to the Spark job instead of after the reads
+unsupported_fields = [
+    field.name for field in events_table.spec().fields
+    if isinstance(field.transform, (BucketTransform, TruncateTransform))
+]
+if unsupported_fields:
+    thread_safe_log("error", f"cloudtrail_events partition fields {unsupported_fields} cannot be written by the fast ingest")
+    raise ValueError(f"Unsupported partition transforms for fast ingest: {unsupported_fields}")
+partition_timezone = ZoneInfo(events_table.properties.get(PARTITION_TIMEZONE_PROPERTY, LEGACY_PARTITION_TIMEZONE))
+thread_safe_log("info", f"Computing event_date in {partition_timezone.key}")
+manifest_table = catalog.load_table((database_name, "cloudtrail_processed_objects"))
+arrow_schema = events_table.schema().as_arrow()
+classification_version, classification_rules = load_classification_rules(
+    catalog, database_name, optional_args["classification_rule_version"]
+)
+thread_safe_log("info", f"Using classification rule version {classification_version}")
+
+job_start = time.time()
+# Same fields and stage names as the Spark engine's run summary, so AggregateRunMetrics sums both
+summary = {
+    "status": "SUCCEEDED",
+    "prefixes": len(subfolders),
+    "files": 0,
+    "input_bytes": 0,
+    "records": 0,
+    "inserted": 0,
+    "corrupt_files": 0,
+    "touched_partitions": 0
+}
+timer = StageTimer()
+touched_partitions = set()
+lag_seconds = []
+# Deletes only keys the manifest holds, in the background while later prefixes are read
+raw_log_deleter = RawLogDeleter(
+    logging_bucket_name,
+    max_workers=int(optional_args["delete_max_workers"]),
+    initial_rate=int(optional_args["delete_initial_objects_per_second"])
+)
+
+for day_prefix in subfolders:
+    account_to_process, region_to_process = prefix_shards[day_prefix]
+    start_time = time.time()
+
+    with timer.stage("list"):
+        if day_prefix in key_manifest_objects:
+            listed_objects = key_manifest_objects[day_prefix]
+        else:
+            listed_objects = storage.list_objects(day_prefix)
+    with timer.stage("manifest_diff"):
+        processed_objects = set() if reprocess_all else load_processed_objects(manifest_table, day_prefix)
+        # Like the Spark engine, objects of staged writes still waiting to be published are neither
+        # read again nor deleted; the commit coordinator records and deletes them once it publishes
+        staged_objects = set() if reprocess_all else load_staged_objects(storage, day_prefix)
+    skipped_objects = processed_objects | staged_objects
+    new_objects = [obj for obj in listed_objects if (obj["key"], obj["etag"]) not in skipped_objects]
+    deletable_keys = [obj["key"] for obj in listed_objects if (obj["key"], obj["etag"]) not in staged_objects]
+    thread_safe_log("info", f"{day_prefix}: {len(listed_objects)} objects listed, {len(listed_objects) - len(new_objects)} already processed or staged, {len(new_objects)} new")
+    if not new_objects:
+        raw_log_deleter.delete(day_prefix, deletable_keys)
+        continue
+
+    with timer.stage("read"):
+        batch, corrupt_objects = read_objects_to_arrow(
+            s3_client, logging_bucket_name, new_objects, arrow_schema, account_to_process, region_to_process, partition_timezone,
+            max_workers, batch_rows
+        )
+        if corrupt_objects:
+            thread_safe_log("warning", f"Found {len(corrupt_objects)} corrupt objects in {day_prefix}")
+        batch = classify_arrow(batch, classification_version, classification_rules)
+        source_rows = batch.num_rows
+        batch = batch.sort_by([(column, "ascending") for column in EVENTS_SORT_ORDER])
+
+    def append_events(table):
+        # Re-checked on every attempt: the conflicting commit may hold the same events
+        rows = drop_existing_events(table, batch, account_to_process, region_to_process) if write_mode == "merge" else batch
+        if rows.num_rows:
+            table.append(rows)
+        return rows
+
+    with timer.stage("write"):
+        batch = commit_with_retry(events_table, append_events)
+        if batch.num_rows:
+            events_table.refresh()
+    if batch.num_rows:
+        committed_at = datetime.now(timezone.utc)
+        lag_seconds.extend((committed_at - obj["last_modified"]).total_seconds() for obj in new_objects)
+        touched_partitions.update(
+            (region_to_process, event_date)
+            for event_date in set(batch.column("event_date").to_pylist()) if event_date is not None
+        )
+
+    # Like the Spark engine, corrupt objects are recorded too so they are not re-read forever
+    with timer.stage("manifest"):
+        record_processed_objects(manifest_table, day_prefix, new_objects, job_run_id)
+
+    # All listed objects but the staged ones are in the manifest now: previously processed or just recorded
+    raw_log_deleter.delete(day_prefix, deletable_keys)
+
+    summary["files"] += len(new_objects)
+    summary["input_bytes"] += sum(obj["size"] for obj in new_objects)
+    summary["records"] += source_rows
+    summary["inserted"] += batch.num_rows
+    summary["corrupt_files"] += len(corrupt_objects)
+    thread_safe_log("info", f"Processed {day_prefix} in {time.time() - start_time:.1f}s: {source_rows} records, {batch.num_rows} inserted, {source_rows - batch.num_rows} skipped as duplicates")
+
+# The commit coordinator refreshes each region-day once, whichever accounts and runs wrote it
+with timer.stage("derived_refresh"):
+    record_derived_refresh(storage, job_run_id, touched_partitions)
+
+publish_lag_metrics(cloudwatch_client, optional_args["ingest_mode"], lag_seconds)
+
+# Deletes overlap with ingestion; this is only the tail still pending after the last prefix
+with timer.stage("delete_wait"):
+    deletion_summary = raw_log_deleter.close()
+thread_safe_log("info", f"Deletion summary: {deletion_summary['deleted']} of {deletion_summary['requested']} objects deleted in {deletion_summary['elapsed_seconds']}s ({deletion_summary['objects_per_second']} objects/s), {deletion_summary['failed']} failed, {deletion_summary['throttled']} throttled requests")
+
+elapsed = time.time() - job_start
+summary["touched_partitions"] = len(touched_partitions)
+summary["deletion"] = deletion_summary
+summary["stage_seconds"] = timer.summary()
+summary["spark_metrics"] = {}
+summary["elapsed_seconds"] = round(elapsed, 1)
+summary["job_run_id"] = job_run_id
+summary["ingest_mode"] = optional_args["ingest_mode"]
+summary["commit_mode"] = "direct"
+summary["engine"] = "fast"
+summary["partition_timezone"] = partition_timezone.key
+emit_emf(emf_documents(summary, optional_args["ingest_mode"]))
+if optional_args["summary_prefix"]:
+    summary_uri = f"{optional_args['summary_prefix'].rstrip('/')}/{job_run_id}.json"
+    storage.write_json(summary_uri, summary)
+    thread_safe_log("info", f"Run summary written to {summary_uri}")
+thread_safe_log("info", f"Fast ingest completed: {summary['files']} files, {summary['records']} records, {summary['inserted']} inserted in {elapsed:.1f}s ({summary['files'] / max(elapsed, 0.001):.1f} files/s)")
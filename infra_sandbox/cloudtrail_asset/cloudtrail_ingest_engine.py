@@ -0,0 +1,669 @@
+"""CloudTrail ingest engine: one run over a batch of day prefixes, callable outside Glue.
+
+run(config) is the whole Spark ingest the Glue job performs: resolve the day prefixes, diff
+them against the processed-object manifest, read, classify and write new events, record and
+delete the ingested raw objects, refresh the derived tables and apply retention. The catalog
+and the raw-log storage are pluggable, so the same code path runs on Glue (Glue catalog, S3)
+and on local Spark (Hadoop catalog, local files or an S3 client pointed at moto).
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from pyspark.sql import SparkSession
+from pyspark.sql.types import StructType, StructField, StringType, LongType, TimestampType
+
+from cloudtrail_common import (
+    S3Storage,
+    extract_account_region_from_prefix,
+    get_staged_writes_prefix,
+    load_staged_objects,
+    load_staged_writes,
+    record_derived_refresh,
+    resolve_day_prefixes
+)
+from cloudtrail_derived import (
+    ensure_rules_table,
+    select_rule_version,
+    classification_sql_expressions,
+    extraction_sql_expressions,
+    ensure_rollup_tables,
+    ensure_security_events_table,
+    get_derived_table_names
+)
+from cloudtrail_ingest_stages import (
+    get_spark_session_config,
+    get_events_partition_spec,
+    resolve_partition_timezone,
+    read_raw_events,
+    build_events,
+    prepare_events_for_write,
+    get_wap_snapshot_id,
+    write_events
+)
+from cloudtrail_ingest_metrics import (
+    StageTimer,
+    register_spark_listener,
+    unregister_spark_listener,
+    emf_documents,
+    emit_emf
+)
+from cloudtrail_retention import (
+    DEFAULT_RETENTION_DAYS,
+    RETENTION_STATE_KEY,
+    load_retention_state,
+    retention_due,
+    drop_expired_partitions,
+    expire_snapshots,
+    remove_recent_orphan_files
+)
+
+logger = logging.getLogger(__name__)
+
+CATALOG_NAME = "glue_catalog"
+EVENTS_TABLE = "cloudtrail_events"
+MANIFEST_TABLE = "cloudtrail_processed_objects"
+
+# Every value is a string, as Glue job arguments are
+DEFAULT_CONFIG = {
+    "JOB_RUN_ID": "unknown",
+    "database_name": "cloudtrail_logs",
+    "output_path": "",
+    "retention_days_for_processed_logs": str(DEFAULT_RETENTION_DAYS),
+    # A run processes one --prefix, a comma separated --prefixes list or a planner --prefix_manifest
+    "prefix": "",
+    "prefixes": "",
+    "prefix_manifest": "",
+    # Ignore the processed-object manifest and read every object under the prefix again
+    "reprocess_all": "false",
+    # "merge" de-duplicates on eventId within the touched partitions, "append" blindly inserts
+    "write_mode": "merge",
+    # Compressed input bytes per write partition, roughly 200k CloudTrail records
+    "target_input_bytes_per_partition": str(32 * 1024 * 1024),
+    # Day prefixes processed concurrently from driver threads, each in its own FAIR scheduler pool
+    "prefix_concurrency": "4",
+    "classification_rule_version": "latest",
+    # Time partition of cloudtrail_events: "event_date", or hidden "days" / "hours" of event_time.
+    # An existing table is evolved in place on its next write
+    "partition_granularity": "event_date",
+    # Buckets of eventSource within each time partition; 0 leaves eventSource unpartitioned
+    "partition_bucket_count": "0",
+    # Zone event_date is computed in. Only applies to a new table; an existing one keeps the
+    # zone recorded on it until the partition timezone migration job re-partitions it
+    "partition_timezone": "UTC",
+    # "direct" commits every write; "staged" stages the cloudtrail_events writes with
+    # write-audit-publish and leaves publishing, the derived refresh and retention to the
+    # commit coordinator job, so concurrent runs never race on table commits
+    "commit_mode": "direct",
+    "delete_raw_objects": "true",
+    "delete_max_workers": "16",
+    "delete_initial_objects_per_second": "3000",
+    "run_retention": "true",
+    # Retention runs at most once per interval, however often the ingest runs
+    "retention_interval_hours": "24",
+    # Dimension of the emitted metrics: "batch" for planned runs, "event-driven" for micro-batches
+    "ingest_mode": "batch",
+    "collect_spark_metrics": "true",
+    # The run summary is written to {summary_prefix}{JOB_RUN_ID}.json for the orchestrator to aggregate
+    "summary_prefix": ""
+}
+
+
+class GlueCatalogBackend:
+    """Iceberg tables registered in the Glue Data Catalog, data files on S3."""
+
+    def __init__(self, warehouse):
+        self.warehouse = warehouse
+
+    def spark_config(self):
+        return {
+            f"spark.sql.catalog.{CATALOG_NAME}": "org.apache.iceberg.spark.SparkCatalog",
+            f"spark.sql.catalog.{CATALOG_NAME}.catalog-impl": "org.apache.iceberg.aws.glue.GlueCatalog",
+            f"spark.sql.catalog.{CATALOG_NAME}.io-impl": "org.apache.iceberg.aws.s3.S3FileIO",
+            f"spark.sql.catalog.{CATALOG_NAME}.warehouse": self.warehouse
+        }
+
+
+class HadoopCatalogBackend:
+    """Iceberg tables tracked by metadata files under a local or HDFS warehouse directory.
+
+    A Hadoop catalog only accepts a table's default location, so output_path must be
+    {warehouse}/{database_name} for the locations the table DDLs use to match.
+    """
+
+    def __init__(self, warehouse):
+        self.warehouse = warehouse.rstrip("/")
+
+    def spark_config(self):
+        return {
+            f"spark.sql.catalog.{CATALOG_NAME}": "org.apache.iceberg.spark.SparkCatalog",
+            f"spark.sql.catalog.{CATALOG_NAME}.type": "hadoop",
+            f"spark.sql.catalog.{CATALOG_NAME}.warehouse": self.warehouse
+        }
+
+    def output_path(self, database_name):
+        return f"{self.warehouse}/{database_name}"
+
+
+class LocalStorage:
+    """Raw CloudTrail files under a local directory; keys are paths relative to it."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def list_objects(self, prefix):
+        directory = os.path.join(self.root, prefix)
+        objects = []
+        if not os.path.isdir(directory):
+            return objects
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            objects.append({
+                "key": f"{prefix}{name}",
+                # Stands in for the ETag: changes whenever the file is rewritten
+                "etag": hashlib.md5(f"{stat.st_size}-{stat.st_mtime_ns}".encode("utf-8")).hexdigest(),
+                "size": stat.st_size,
+                "last_modified": datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+            })
+        return objects
+
+    def uri(self, key):
+        return os.path.join(self.root, key)
+
+    def read_json(self, uri):
+        with open(uri) as f:
+            return json.load(f)
+
+    def write_json(self, uri, document):
+        os.makedirs(os.path.dirname(uri), exist_ok=True)
+        with open(uri, "w") as f:
+            json.dump(document, f, default=str)
+
+    def delete_object(self, key):
+        os.remove(self.uri(key))
+
+    def create_deleter(self, max_workers, initial_rate):
+        return LocalDeleter(self.root)
+
+
+class LocalDeleter:
+    """Same interface as RawLogDeleter for LocalStorage; removes files synchronously."""
+
+    def __init__(self, root):
+        self.root = root
+        self.stats = {"requested": 0, "deleted": 0, "failed": 0, "throttled": 0}
+        self.failed_prefixes = set()
+        self.prefixes = set()
+        self.started_at = time.monotonic()
+        self.finished_at = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def delete(self, prefix, keys):
+        self.prefixes.add(prefix)
+        for key in sorted(set(keys)):
+            self.stats["requested"] += 1
+            try:
+                os.remove(os.path.join(self.root, key))
+                self.stats["deleted"] += 1
+            except OSError as e:
+                logger.warning(f"Failed to delete {key}: {e}")
+                self.stats["failed"] += 1
+                self.failed_prefixes.add(prefix)
+
+    def close(self):
+        if self.finished_at is None:
+            self.finished_at = time.monotonic()
+        return self.summary()
+
+    def summary(self):
+        elapsed = (self.finished_at or time.monotonic()) - self.started_at
+        return {
+            **self.stats,
+            "prefixes": len(self.prefixes),
+            "failed_prefixes": sorted(self.failed_prefixes),
+            "elapsed_seconds": round(elapsed, 1),
+            "objects_per_second": round(self.stats["deleted"] / elapsed, 1) if elapsed > 0 else 0.0,
+            "final_rate": 0.0
+        }
+
+
+class NoOpDeleter(LocalDeleter):
+    """Used when delete_raw_objects is false, e.g. to re-run a benchmark over the same files."""
+
+    def __init__(self):
+        super().__init__(None)
+
+    def delete(self, prefix, keys):
+        self.prefixes.add(prefix)
+
+
+def create_spark_session(catalog) -> SparkSession:
+    spark_builder = SparkSession.builder
+    for key, value in {**catalog.spark_config(), **get_spark_session_config()}.items():
+        spark_builder = spark_builder.config(key, value)
+    return spark_builder.getOrCreate()
+
+
+def get_manifest_schema():
+    """Schema of the processed-object manifest table."""
+    return StructType([
+        StructField("source_prefix", StringType(), False),
+        StructField("s3_key", StringType(), False),
+        StructField("etag", StringType(), False),
+        StructField("size_bytes", LongType(), True),
+        StructField("last_modified", TimestampType(), True),
+        StructField("processed_at", TimestampType(), True),
+        StructField("job_run_id", StringType(), True)
+    ])
+
+
+def ensure_manifest_table(spark, manifest_table_fqn, manifest_location):
+    spark.sql(f"""
+        CREATE TABLE IF NOT EXISTS {manifest_table_fqn} (
+            source_prefix string,
+            s3_key string,
+            etag string,
+            size_bytes bigint,
+            last_modified timestamp,
+            processed_at timestamp,
+            job_run_id string
+        )
+        USING iceberg
+        LOCATION '{manifest_location}'
+        TBLPROPERTIES ('format-version'='2')
+        PARTITIONED BY (source_prefix)
+    """)
+
+
+def load_processed_objects(spark, manifest_table_fqn, prefix):
+    """Return the (key, etag) pairs already ingested from a day prefix."""
+    rows = spark.sql(
+        f"SELECT s3_key, etag FROM {manifest_table_fqn} WHERE source_prefix = '{prefix}'"
+    ).collect()
+    return {(row.s3_key, row.etag) for row in rows}
+
+
+def diff_against_manifest(objects, processed_objects):
+    return [obj for obj in objects if (obj["key"], obj["etag"]) not in processed_objects]
+
+
+def record_processed_objects(spark, manifest_table_fqn, prefix, objects, job_run_id):
+    if not objects:
+        return
+    processed_at = datetime.now(timezone.utc)
+    rows = [
+        (prefix, obj["key"], obj["etag"], obj["size"], obj["last_modified"].replace(tzinfo=None), processed_at, job_run_id)
+        for obj in objects
+    ]
+    spark.createDataFrame(rows, get_manifest_schema()).writeTo(manifest_table_fqn).append()
+    logger.info(f"Recorded {len(rows)} processed objects for {prefix} in {manifest_table_fqn}")
+
+
+def manifest_has_run(spark, manifest_table_fqn, prefix, job_run_id):
+    """Whether the manifest already holds objects of the prefix recorded under job_run_id."""
+    return bool(spark.sql(
+        f"SELECT 1 FROM {manifest_table_fqn} WHERE source_prefix = '{prefix}' AND job_run_id = '{job_run_id}' LIMIT 1"
+    ).collect())
+
+
+def record_staged_write(storage, day_prefix, wap_id, snapshot_id, objects, delete_raw_objects):
+    """Hand the objects of a staged write to the commit coordinator.
+
+    It records them in the manifest and deletes them only once it has published the snapshot;
+    until then ingest runs treat them as processed, so a retry does not stage them again.
+    """
+    key = f"{get_staged_writes_prefix(day_prefix)}{wap_id}.json"
+    storage.write_json(storage.uri(key), {
+        "wap_id": wap_id,
+        "snapshot_id": snapshot_id,
+        "day_prefix": day_prefix,
+        "delete_raw_objects": delete_raw_objects,
+        "objects": objects
+    })
+    logger.info(f"Staged {len(objects)} objects of {day_prefix} as {wap_id} for the commit coordinator")
+
+
+def get_oldest_pending_commit(spark, table_fqn, storage):
+    """Commit time of the oldest staged snapshot a staged-write document still waits on, or None."""
+    snapshot_ids = {document["snapshot_id"] for _, document in load_staged_writes(storage)}
+    if not snapshot_ids:
+        return None
+    id_list = ", ".join(str(snapshot_id) for snapshot_id in sorted(snapshot_ids))
+    rows = spark.sql(
+        f"SELECT MIN(committed_at) AS committed_at FROM {table_fqn}.snapshots WHERE snapshot_id IN ({id_list})"
+    ).collect()
+    return rows[0].committed_at if rows else None
+
+
+def cleanup_dataframe_cache(df, stage_name):
+    try:
+        df.unpersist()
+        logger.info(f"{stage_name} unpersisted")
+    except Exception as e:
+        logger.warning(f"{stage_name} unpersist failed: {e}")
+
+
+def apply_retention(spark, database_name, retention_days, storage, min_interval_hours=0, full_orphan_scan=False):
+    """Drop expired partitions, expire snapshots and remove orphan files of recently written directories.
+
+    Partitions are dropped from the table metadata without rewriting files, and the orphan
+    scan covers only the data directories written since the previous run, tracked in a state
+    document in storage. Skipped when the previous run is less than min_interval_hours old.
+    """
+    try:
+        state_uri = storage.uri(RETENTION_STATE_KEY)
+        state = load_retention_state(storage, state_uri)
+        if not retention_due(state, min_interval_hours):
+            logger.info(f"Retention last ran at {state['last_run_at']}, less than {min_interval_hours}h ago; skipped")
+            return
+        retention_cutoff = (datetime.now(timezone.utc) - timedelta(days=retention_days)).strftime("%Y-%m-%d")
+        events_table_fqn = f"{CATALOG_NAME}.{database_name}.{EVENTS_TABLE}"
+        for table_name in [EVENTS_TABLE, *get_derived_table_names()]:
+            drop_expired_partitions(spark, f"{CATALOG_NAME}.{database_name}.{table_name}", retention_cutoff)
+        expire_snapshots(spark, events_table_fqn, get_oldest_pending_commit(spark, events_table_fqn, storage))
+        orphan_state, _ = remove_recent_orphan_files(spark, events_table_fqn, state.get("orphan_scan", {}), full_orphan_scan)
+        storage.write_json(state_uri, {"last_run_at": datetime.now(timezone.utc).isoformat(), "orphan_scan": orphan_state})
+        logger.info(f"Retention cleanup executed for {events_table_fqn} older than {retention_cutoff}")
+    except Exception as e:
+        logger.error(f"Retention cleanup failed: {e}")
+
+
+def run(config, spark=None, catalog=None, storage=None):
+    """Ingest the configured day prefixes and return a summary of the run.
+
+    config holds the job arguments (see DEFAULT_CONFIG) and needs output_path. Without explicit
+    backends, the Glue catalog and S3 storage are derived from the bucket of input_path.
+    """
+    config = {**DEFAULT_CONFIG, **config}
+    output_path = config["output_path"]
+    if not output_path or not ((storage and catalog) or config.get("input_path")):
+        logger.error("input_path or output_path missing")
+        raise ValueError("input_path or output_path missing")
+    database_name = config["database_name"]
+    job_run_id = config["JOB_RUN_ID"]
+    reprocess_all = config["reprocess_all"].lower() == "true"
+    write_mode = config["write_mode"].lower()
+    target_input_bytes_per_partition = int(config["target_input_bytes_per_partition"])
+    if write_mode not in ("merge", "append"):
+        logger.error(f"Unsupported write_mode: {write_mode}")
+        raise ValueError(f"Unsupported write_mode: {write_mode}")
+    prefix_concurrency = max(1, int(config["prefix_concurrency"]))
+    commit_mode = config["commit_mode"].lower()
+    if commit_mode not in ("direct", "staged"):
+        logger.error(f"Unsupported commit_mode: {commit_mode}")
+        raise ValueError(f"Unsupported commit_mode: {commit_mode}")
+    partition_spec = get_events_partition_spec(
+        config["partition_granularity"].lower(), int(config["partition_bucket_count"])
+    )
+    delete_raw_objects = config["delete_raw_objects"].lower() == "true"
+
+    if not (storage and catalog):
+        logging_bucket_name = config["input_path"].split("/")[2]
+        storage = storage or S3Storage(logging_bucket_name)
+        catalog = catalog or GlueCatalogBackend(f"s3://{logging_bucket_name}/glue_job_tmp/")
+    timer = StageTimer()
+    job_start = time.time()
+
+    subfolders, prefix_sizes = resolve_day_prefixes(storage, config["prefix"], config["prefixes"], config["prefix_manifest"])
+    if not subfolders and not (config["prefix"] or config["prefixes"] or config["prefix_manifest"]):
+        logger.error("No prefix, prefixes or prefix_manifest provided")
+        raise ValueError("No prefix, prefixes or prefix_manifest provided")
+
+    # Extract account and region from every prefix up front so a bad batch fails before Spark starts
+    prefix_shards = {}
+    for day_prefix in subfolders:
+        prefix_shard = extract_account_region_from_prefix(day_prefix)
+        if not prefix_shard:
+            logger.error(f"Could not extract account and region from prefix: {day_prefix}")
+            raise ValueError(f"Invalid prefix format: {day_prefix}")
+        prefix_shards[day_prefix] = prefix_shard
+    logger.info(f"Extracted {len(set(prefix_shards.values()))} account-regions from {len(subfolders)} prefixes: {sorted({account for account, _ in prefix_shards.values()})}")
+
+    summary = {
+        "status": "SUCCEEDED",
+        "prefixes": len(subfolders),
+        "files": 0,
+        "input_bytes": 0,
+        "records": 0,
+        "corrupt_files": 0,
+        "touched_partitions": 0
+    }
+    if not subfolders:
+        logger.info("No prefixes to process. Exiting.")
+        summary["status"] = "SKIPPED"
+        return summary
+    logger.info(f"Processing {len(subfolders)} prefixes: {subfolders}")
+
+    spark = spark or create_spark_session(catalog)
+    listener = register_spark_listener(spark, timer) if config["collect_spark_metrics"].lower() == "true" else None
+    current_date_str = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    table_fqn = f"{CATALOG_NAME}.{database_name}.{EVENTS_TABLE}"
+    table_output_path = f"{output_path.rstrip('/')}/{EVENTS_TABLE}"
+    manifest_table_fqn = f"{CATALOG_NAME}.{database_name}.{MANIFEST_TABLE}"
+
+    with timer.stage("setup"):
+        spark.sql(f"CREATE DATABASE IF NOT EXISTS {CATALOG_NAME}.{database_name}")
+        ensure_manifest_table(spark, manifest_table_fqn, f"{output_path.rstrip('/')}/{MANIFEST_TABLE}")
+        ensure_rollup_tables(spark, database_name, output_path)
+        ensure_security_events_table(spark, database_name, output_path)
+
+        # Classification columns are computed once here from the versioned rule table
+        rules_table_fqn = ensure_rules_table(spark, database_name, output_path)
+        classification_version, classification_rules = select_rule_version(
+            [row.asDict() for row in spark.table(rules_table_fqn).collect()],
+            config["classification_rule_version"]
+        )
+        classification_expressions = classification_sql_expressions(classification_version, classification_rules)
+        logger.info(f"Using classification rule version {classification_version}")
+        extraction_expressions = extraction_sql_expressions()
+        partition_timezone = resolve_partition_timezone(spark, table_fqn, config["partition_timezone"])
+        logger.info(f"Computing event_date in {partition_timezone}")
+    touched_partitions = set()
+    # Table DDL, Iceberg commits and manifest appends of the concurrent pipelines, one at a time.
+    # Reentrant, as staged_write takes it again inside write_events' critical section
+    commit_lock = threading.RLock() if prefix_concurrency > 1 else None
+
+    def process_prefix(prefix_index, day_prefix):
+        """List, diff, read, write and record one day prefix; None when it was skipped on a failure."""
+        account_to_process, region_to_process = prefix_shards[day_prefix]
+        region_input_path = storage.uri(day_prefix)
+        logger.info(f"Processing prefix {region_input_path}")
+        start_time = time.time()
+        # Pipelines share the executors through FAIR pools instead of queueing behind each other
+        spark.sparkContext.setLocalProperty("spark.scheduler.pool", f"prefix_{prefix_index % prefix_concurrency}")
+        result = {
+            "day_prefix": day_prefix,
+            "files": 0,
+            "input_bytes": 0,
+            "records": 0,
+            "corrupt_files": 0,
+            "touched_partitions": set()
+        }
+
+        try:
+            with timer.stage("list"):
+                listed_objects = storage.list_objects(day_prefix)
+            with timer.stage("manifest_diff"):
+                processed_objects = set() if reprocess_all else load_processed_objects(spark, manifest_table_fqn, day_prefix)
+                # Objects of writes still waiting to be published are neither read again nor deleted yet
+                staged_objects = set() if reprocess_all else load_staged_objects(storage, day_prefix)
+        except Exception as e:
+            logger.error(f"Listing failure for {region_input_path}: {e}")
+            return None
+        new_objects = diff_against_manifest(listed_objects, processed_objects | staged_objects)
+        logger.info(f"{region_input_path}: {len(listed_objects)} objects listed, {len(listed_objects) - len(new_objects)} already processed or staged, {len(new_objects)} new")
+        recorded_objects = set(processed_objects)
+
+        if new_objects:
+            try:
+                df_raw = read_raw_events(spark, [storage.uri(obj["key"]) for obj in new_objects])
+            except Exception as e:
+                logger.error(f"Read failure for {region_input_path}: {e}")
+                return None
+
+            df = build_events(
+                df_raw,
+                account_to_process,
+                region_to_process,
+                classification_expressions,
+                extraction_expressions,
+                partition_timezone
+            )
+            input_bytes = sum(obj["size"] for obj in new_objects)
+            df = prepare_events_for_write(df, input_bytes, target_input_bytes_per_partition, f"prefix_{day_prefix}")
+
+            wap_id = f"{job_run_id}-{prefix_index}" if commit_mode == "staged" else None
+            temp_view = f"tmp_{EVENTS_TABLE}_{prefix_index}_{account_to_process}_{region_to_process.replace('-', '_')}_{current_date_str.replace('-', '_')}"
+            try:
+                # Reading, parsing and exploding happen once, in the batch aggregate; the write reads the cached rows
+                with timer.stage("write"):
+                    partition_counts, event_dates, batch_metrics = write_events(
+                        spark, df, table_fqn, table_output_path, temp_view, account_to_process, region_to_process,
+                        write_mode, partition_spec, commit_lock,
+                        wap_id=wap_id,
+                        partition_timezone=partition_timezone
+                    )
+            except Exception as e:
+                logger.error(f"Failed to create/insert into table: {e}")
+                raise
+
+            # Files that yielded no event were corrupt, or held no records
+            corrupt_files = max(0, len(new_objects) - len(batch_metrics["source_files"]))
+            if corrupt_files:
+                logger.warning(f"Found {corrupt_files} corrupt or empty files in {region_input_path}")
+            min_event_time, max_event_time = batch_metrics["event_time_range"] or (None, None)
+            logger.info(f"Ingest metrics for {region_input_path}: files_read={len(new_objects)}, records={batch_metrics['records']}, event_time_range=[{min_event_time}, {max_event_time}], partition_counts={partition_counts}")
+
+            result["touched_partitions"].update((region_to_process, event_date) for event_date in event_dates)
+            result["files"] = len(new_objects)
+            result["input_bytes"] = input_bytes
+            result["records"] = batch_metrics["records"]
+            result["corrupt_files"] = corrupt_files
+
+            # Only mark objects as processed once their records are published: a staged write
+            # leaves that, and deleting them, to the commit coordinator
+            staged_snapshot_id = get_wap_snapshot_id(spark, table_fqn, wap_id) if wap_id else None
+            with timer.stage("manifest"):
+                if staged_snapshot_id is not None:
+                    record_staged_write(storage, day_prefix, wap_id, staged_snapshot_id, new_objects, delete_raw_objects)
+                else:
+                    with commit_lock or nullcontext():
+                        record_processed_objects(spark, manifest_table_fqn, day_prefix, new_objects, job_run_id)
+                    recorded_objects.update((obj["key"], obj["etag"]) for obj in new_objects)
+
+            cleanup_dataframe_cache(df, f"prefix_{day_prefix}")
+        else:
+            logger.info(f"No new objects under {region_input_path}; skipping read")
+
+        logger.info(f"Processed {day_prefix} in {time.time() - start_time:.1f}s")
+
+        # Only objects now in the manifest are deleted: ones already there or just recorded above.
+        # Staged ones, and anything that arrived after the listing, are left in place.
+        result["recorded_keys"] = [obj["key"] for obj in listed_objects if (obj["key"], obj["etag"]) in recorded_objects]
+        return result
+
+    # Raw objects are deleted in the background while later prefixes are ingested
+    if delete_raw_objects:
+        raw_log_deleter = storage.create_deleter(
+            int(config["delete_max_workers"]), int(config["delete_initial_objects_per_second"])
+        )
+    else:
+        raw_log_deleter = NoOpDeleter()
+    with raw_log_deleter:
+        # Largest prefixes first, so the longest pipeline starts right away and the smaller
+        # ones fill the executors around it
+        ordered_prefixes = sorted(
+            enumerate(subfolders), key=lambda item: prefix_sizes.get(item[1], 0), reverse=True
+        )
+        ingest_start = time.time()
+        failed_prefixes = []
+        with ThreadPoolExecutor(max_workers=prefix_concurrency) as executor:
+            futures_prefixes = {
+                executor.submit(process_prefix, prefix_index, day_prefix): day_prefix
+                for prefix_index, day_prefix in ordered_prefixes
+            }
+            futures = list(futures_prefixes)
+            try:
+                for future in as_completed(futures):
+                    result = future.result()
+                    if result is None:
+                        failed_prefixes.append(futures_prefixes[future])
+                        continue
+                    touched_partitions.update(result["touched_partitions"])
+                    for key in ("files", "input_bytes", "records", "corrupt_files"):
+                        summary[key] += result[key]
+                    raw_log_deleter.delete(result["day_prefix"], result["recorded_keys"])
+            except Exception:
+                # A failed write fails the run; pipelines not started yet are dropped
+                for future in futures:
+                    future.cancel()
+                raise
+        summary["ingest_seconds"] = round(time.time() - ingest_start, 1)
+        logger.info(f"Ingested {len(subfolders)} prefixes with {prefix_concurrency} concurrent pipelines in {summary['ingest_seconds']}s")
+
+        # Deletes overlap with ingestion; this is only the tail still pending after the last prefix
+        with timer.stage("delete_wait"):
+            raw_log_deleter.close()
+
+    deletion_summary = raw_log_deleter.summary()
+    logger.info(f"Deletion summary: {deletion_summary['deleted']} of {deletion_summary['requested']} objects deleted from {deletion_summary['prefixes']} prefixes in {deletion_summary['elapsed_seconds']}s ({deletion_summary['objects_per_second']} objects/s), {deletion_summary['failed']} failed, {deletion_summary['throttled']} throttled requests, final rate {deletion_summary['final_rate']} objects/s")
+    if deletion_summary["failed_prefixes"]:
+        logger.warning(f"Deletion incomplete for {deletion_summary['failed_prefixes']}; their objects stay in the manifest and are retried next run")
+    if failed_prefixes:
+        # Failing the run keeps the orchestrator from committing discovery watermarks past
+        # prefixes that were never ingested; the other prefixes are in the manifest or staged,
+        # so a retry only reads these again
+        logger.error(f"Listing or reading failed for {len(failed_prefixes)} prefixes: {sorted(failed_prefixes)}")
+        raise RuntimeError(f"Listing or reading failed for {len(failed_prefixes)} prefixes: {sorted(failed_prefixes)}")
+
+    if commit_mode == "staged":
+        logger.info(f"Writes staged under wap.id {job_run_id}-*; the commit coordinator publishes them, records and deletes their objects, refreshes the derived tables and applies retention")
+    else:
+        # Like fast ingest: the commit coordinator, the only writer of the derived tables,
+        # refreshes each region-day once, whichever accounts and runs wrote it
+        with timer.stage("derived_refresh"):
+            record_derived_refresh(storage, job_run_id, touched_partitions)
+
+    if config["run_retention"].lower() == "true" and commit_mode == "direct":
+        with timer.stage("retention"):
+            apply_retention(
+                spark,
+                database_name,
+                int(config["retention_days_for_processed_logs"]),
+                storage,
+                min_interval_hours=int(config["retention_interval_hours"])
+            )
+
+    spark.catalog.clearCache()
+    unregister_spark_listener(spark, listener)
+    summary["touched_partitions"] = len(touched_partitions)
+    summary["deletion"] = deletion_summary
+    summary["stage_seconds"] = timer.summary()
+    summary["spark_metrics"] = listener.summary() if listener else {}
+    summary["elapsed_seconds"] = round(time.time() - job_start, 1)
+    summary["job_run_id"] = job_run_id
+    summary["ingest_mode"] = config["ingest_mode"]
+    summary["commit_mode"] = commit_mode
+    summary["partition_timezone"] = partition_timezone
+    emit_emf(emf_documents(summary, config["ingest_mode"]))
+    if config["summary_prefix"]:
+        summary_uri = f"{config['summary_prefix'].rstrip('/')}/{job_run_id}.json"
+        storage.write_json(summary_uri, summary)
+        logger.info(f"Run summary written to {summary_uri}")
+    logger.info(f"Ingest summary: {summary}")
+    return summary
@@ -0,0 +1,236 @@
+"""Per-stage timing and Spark task metrics of an ingest run, in CloudWatch embedded metric format.
+
+StageTimer measures wall-clock seconds per engine stage (list, manifest_diff, write, manifest,
+delete_wait, derived_refresh, retention), summed over the pipelines that run concurrently, and
+tags the Spark jobs each thread submits with its engine stage. SparkMetricsListener is a
+SparkListener implemented in Python through the py4j callback server; it sums the task metrics
+of every completed Spark stage into the engine stage it was submitted from, so the write stage,
+which runs the read, JSON parsing, explode, shuffle and Iceberg commit as one action, still shows
+input, shuffle and spill volumes and task skew. emf_documents() turns a run summary into embedded
+metric format records.
+"""
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRIC_NAMESPACE = "CloudTrailPipeline"
+# Spark local property carrying the engine stage of the thread that submits a job
+ENGINE_STAGE_PROPERTY = "cloudtrail.engine.stage"
+
+# Summary field -> (metric name, unit) for the run as a whole
+RUN_METRICS = {
+    "files": ("IngestedFiles", "Count"),
+    "input_bytes": ("IngestedInputBytes", "Bytes"),
+    "records": ("IngestedRecords", "Count"),
+    "corrupt_files": ("CorruptFiles", "Count"),
+    "touched_partitions": ("TouchedPartitions", "Count"),
+    "elapsed_seconds": ("RunSeconds", "Seconds"),
+}
+# Spark metric field -> (metric name, unit) per engine stage
+STAGE_METRICS = {
+    "input_bytes": ("InputBytes", "Bytes"),
+    "input_records": ("InputRecords", "Count"),
+    "output_bytes": ("OutputBytes", "Bytes"),
+    "shuffle_read_bytes": ("ShuffleReadBytes", "Bytes"),
+    "shuffle_write_bytes": ("ShuffleWriteBytes", "Bytes"),
+    "memory_spilled_bytes": ("MemorySpilledBytes", "Bytes"),
+    "disk_spilled_bytes": ("DiskSpilledBytes", "Bytes"),
+    "tasks": ("Tasks", "Count"),
+    "max_task_seconds": ("MaxTaskSeconds", "Seconds"),
+    "task_skew": ("TaskSkew", "None"),
+}
+
+
+class StageTimer:
+    """Wall-clock seconds per named stage, summed over every time and thread the stage is entered.
+
+    The current stage is tracked per thread. Once attached to a SparkContext, it is also set as
+    the ENGINE_STAGE_PROPERTY local property, which Spark hands to the listener with every stage
+    the thread submits.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.spark_context = None
+
+    @property
+    def current(self):
+        return getattr(self.local, "current", None)
+
+    def attach(self, spark_context):
+        self.spark_context = spark_context
+
+    @contextmanager
+    def stage(self, name):
+        previous = self.current
+        self.local.current = name
+        if self.spark_context is not None:
+            self.spark_context.setLocalProperty(ENGINE_STAGE_PROPERTY, name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+            self.local.current = previous
+            if self.spark_context is not None:
+                self.spark_context.setLocalProperty(ENGINE_STAGE_PROPERTY, previous)
+
+    def summary(self):
+        with self.lock:
+            return {name: round(seconds, 2) for name, seconds in self.seconds.items()}
+
+
+def empty_stage_metrics():
+    metrics = {field: 0 for field in STAGE_METRICS}
+    metrics.update({"spark_stages": 0, "failed_spark_stages": 0, "max_task_seconds": 0.0, "task_skew": 0.0})
+    return metrics
+
+
+class SparkMetricsListener:
+    """Collects task and stage completions; every other listener event is ignored.
+
+    Task durations are kept per Spark stage until it completes, to compute its skew as the
+    slowest task over the median one. Each stage's accumulated TaskMetrics are then added to
+    the engine stage it was submitted from, or to "other" outside of any.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.task_durations = {}
+        self.stage_names = {}
+        self.metrics = {}
+
+    def __getattr__(self, name):
+        # py4j resolves each callback by name, so one no-op covers the rest of SparkListenerInterface
+        if name.startswith("on"):
+            return lambda *args: None
+        raise AttributeError(name)
+
+    def onStageSubmitted(self, stage_submitted):
+        info = stage_submitted.stageInfo()
+        properties = stage_submitted.properties()
+        stage_name = properties.getProperty(ENGINE_STAGE_PROPERTY) if properties is not None else None
+        with self.lock:
+            self.stage_names[(info.stageId(), info.attemptNumber())] = stage_name
+
+    def onTaskEnd(self, task_end):
+        key = (task_end.stageId(), task_end.stageAttemptId())
+        duration_ms = task_end.taskInfo().duration()
+        with self.lock:
+            self.task_durations.setdefault(key, []).append(duration_ms)
+
+    def onStageCompleted(self, stage_completed):
+        info = stage_completed.stageInfo()
+        task_metrics = info.taskMetrics()
+        key = (info.stageId(), info.attemptNumber())
+        with self.lock:
+            durations = sorted(self.task_durations.pop(key, []))
+            stage_name = self.stage_names.pop(key, None) or "other"
+        values = {
+            "input_bytes": task_metrics.inputMetrics().bytesRead(),
+            "input_records": task_metrics.inputMetrics().recordsRead(),
+            "output_bytes": task_metrics.outputMetrics().bytesWritten(),
+            "shuffle_read_bytes": task_metrics.shuffleReadMetrics().totalBytesRead(),
+            "shuffle_write_bytes": task_metrics.shuffleWriteMetrics().bytesWritten(),
+            "memory_spilled_bytes": task_metrics.memoryBytesSpilled(),
+            "disk_spilled_bytes": task_metrics.diskBytesSpilled(),
+            "tasks": info.numTasks(),
+        }
+        max_task_seconds = durations[-1] / 1000 if durations else 0.0
+        median_ms = durations[len(durations) // 2] if durations else 0
+        task_skew = durations[-1] / median_ms if median_ms else 0.0
+        with self.lock:
+            metrics = self.metrics.setdefault(stage_name, empty_stage_metrics())
+            for field, value in values.items():
+                metrics[field] += value
+            metrics["spark_stages"] += 1
+            metrics["failed_spark_stages"] += 1 if info.failureReason().isDefined() else 0
+            metrics["max_task_seconds"] = max(metrics["max_task_seconds"], round(max_task_seconds, 2))
+            metrics["task_skew"] = max(metrics["task_skew"], round(task_skew, 2))
+
+    def summary(self):
+        with self.lock:
+            return {name: dict(metrics) for name, metrics in self.metrics.items()}
+
+    class Java:
+        implements = ["org.apache.spark.scheduler.SparkListenerInterface"]
+
+
+def register_spark_listener(spark, timer):
+    """Attach a SparkMetricsListener fed by the timer's stage tags, or return None when the py4j
+    callback server cannot start."""
+    try:
+        from pyspark.java_gateway import ensure_callback_server_started
+
+        sc = spark.sparkContext
+        ensure_callback_server_started(sc._gateway)
+        listener = SparkMetricsListener()
+        sc._jsc.sc().addSparkListener(listener)
+        timer.attach(sc)
+        return listener
+    except Exception as e:
+        logger.warning(f"Spark metrics listener not registered, only stage timers are recorded: {e}")
+        return None
+
+
+def unregister_spark_listener(spark, listener):
+    if listener is None:
+        return
+    try:
+        spark.sparkContext._jsc.sc().removeSparkListener(listener)
+    except Exception as e:
+        logger.warning(f"Spark metrics listener not removed: {e}")
+
+
+def emf_document(dimensions, metrics, timestamp_ms):
+    """One embedded metric format record; metrics maps name -> (value, unit)."""
+    document = {
+        "_aws": {
+            "Timestamp": timestamp_ms,
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": METRIC_NAMESPACE,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [{"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()],
+                }
+            ],
+        },
+        **dimensions,
+    }
+    for name, (value, _) in metrics.items():
+        document[name] = value
+    return document
+
+
+def emf_documents(summary, ingest_mode):
+    """A run-level record with dimension IngestMode and one record per engine stage adding Stage."""
+    timestamp_ms = int(time.time() * 1000)
+    documents = [
+        emf_document(
+            {"IngestMode": ingest_mode},
+            {name: (summary.get(field, 0), unit) for field, (name, unit) in RUN_METRICS.items()},
+            timestamp_ms,
+        )
+    ]
+    spark_metrics = summary.get("spark_metrics", {})
+    for stage_name in sorted(set(summary.get("stage_seconds", {})) | set(spark_metrics)):
+        metrics = {"StageSeconds": (summary.get("stage_seconds", {}).get(stage_name, 0.0), "Seconds")}
+        for field, (name, unit) in STAGE_METRICS.items():
+            if stage_name in spark_metrics:
+                metrics[name] = (spark_metrics[stage_name][field], unit)
+        documents.append(emf_document({"IngestMode": ingest_mode, "Stage": stage_name}, metrics, timestamp_ms))
+    return documents
+
+
+def emit_emf(documents):
+    # Raw JSON lines, without the logging prefix, so log-based EMF extraction can parse them
+    for document in documents:
+        print(json.dumps(document))
@@ -0,0 +1,606 @@
+"""Spark stages of the per-prefix CloudTrail ingest: read, transform and write to cloudtrail_events.
+
+Shared by the Glue ingest job and the local benchmark harness through --extra-py-files, so both
+run the same code path against different catalogs and storage.
+"""
+import math
+import logging
+from contextlib import contextmanager, nullcontext
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from pyspark import StorageLevel
+from pyspark.sql.functions import col, explode, expr, lit, to_date, to_timestamp, from_utc_timestamp, input_file_name
+from pyspark.sql.functions import count as sql_count, min as sql_min, max as sql_max, collect_set, countDistinct
+from pyspark.sql.types import StructType, StructField, StringType, ArrayType, MapType
+from pyspark.sql.utils import AnalysisException
+
+from cloudtrail_common import (
+    EVENTS_SORT_ORDER,
+    REPORTING_TIMEZONE,
+    DEFAULT_PARTITION_TIMEZONE,
+    LEGACY_PARTITION_TIMEZONE,
+    PARTITION_TIMEZONE_PROPERTY
+)
+from cloudtrail_derived import ensure_derived_columns
+
+logger = logging.getLogger(__name__)
+
+# High-cardinality point-lookup columns that get Parquet bloom filters
+EVENTS_BLOOM_FILTER_COLUMNS = ["eventId", "userIdentity.principalId", "sourceIpAddress", "eventName"]
+# Bump when the table properties or sort order below change so existing tables are migrated
+EVENTS_TABLE_LAYOUT_VERSION = 1
+# Time partition of cloudtrail_events: the legacy identity partition on the derived event_date,
+# or Iceberg hidden partitioning on event_time so time-range predicates prune on their own
+EVENTS_PARTITION_GRANULARITIES = {
+    "event_date": "event_date",
+    "days": "days(event_time)",
+    "hours": "hours(event_time)",
+}
+EVENTS_BUCKET_COLUMN = "eventSource"
+# Identity partition fields ahead of the time partition; account_id is the shard key of
+# organization trails, so runs over different accounts write disjoint partitions
+EVENTS_IDENTITY_PARTITIONS = ["account_id", "region"]
+# File each event was read from, carried to the batch aggregate and dropped before the write
+SOURCE_FILE_COLUMN = "_source_file"
+
+def get_spark_session_config():
+    """Iceberg extensions and tuning shared by every session, whatever catalog it points at."""
+    return {
+        "spark.sql.extensions": "org.apache.iceberg.spark.extensions.IcebergSparkSessionExtensions",
+        "spark.sql.files.maxPartitionBytes": "134217728",
+        "spark.sql.files.openCostInBytes": "4194304",
+        "spark.sql.adaptive.enabled": "true",
+        "spark.sql.adaptive.coalescePartitions.enabled": "true",
+        "spark.sql.adaptive.coalescePartitions.minPartitionNum": "1",
+        "spark.sql.adaptive.coalescePartitions.initialPartitionNum": "20",
+        "spark.sql.adaptive.maxRecordsPerPartition": "2000000",
+        "spark.sql.adaptive.advisoryPartitionSizeInBytes": "268435456",
+        "spark.sql.autoBroadcastJoinThreshold": "10485760",
+        "spark.serializer": "org.apache.spark.serializer.KryoSerializer",
+        "spark.sql.execution.arrow.pyspark.enabled": "true",
+        "spark.sql.adaptive.localShuffleReader.enabled": "true",
+        "spark.sql.json.compression.codec": "gzip",
+        "spark.sql.caseSensitive": "false",
+        # Concurrent prefix pipelines each submit from their own pool and share the executors fairly
+        "spark.scheduler.mode": "FAIR",
+        # INSERT OVERWRITE of the rollups replaces only the partitions present in the query output
+        "spark.sql.sources.partitionOverwriteMode": "dynamic"
+    }
+
+def process_dataframe_with_partitioning(df, input_bytes, target_input_bytes_per_partition, stage_name):
+    """Size the write partitions from the listed compressed input bytes instead of a count() action."""
+    try:
+        optimal_partitions = max(1, math.ceil(input_bytes / target_input_bytes_per_partition))
+        current_partitions = df.rdd.getNumPartitions()
+        if optimal_partitions != current_partitions:
+            df = df.repartition(optimal_partitions, "event_date")
+            logger.info(f"{stage_name} repartitioned from {current_partitions} to {optimal_partitions}")
+        else:
+            logger.info(f"{stage_name} partitions OK {current_partitions}")
+    except Exception as e:
+        logger.warning(f"{stage_name} partition optimize failed: {e}")
+        df = df.repartition("event_date")
+    return df
+
+
+def get_cloudtrail_schema():
+    """Define explicit CloudTrail schema matching AWS Athena CloudTrail table definition."""
+    return StructType([
+        StructField("eventVersion", StringType(), True),
+        StructField("userIdentity", StructType([
+            StructField("type", StringType(), True),
+            StructField("principalId", StringType(), True),
+            StructField("arn", StringType(), True),
+            StructField("accountId", StringType(), True),
+            StructField("invokedBy", StringType(), True),
+            StructField("accessKeyId", StringType(), True),
+            StructField("userName", StringType(), True),
+            StructField("sessionContext", StructType([
+                StructField("attributes", StructType([
+                    StructField("mfaAuthenticated", StringType(), True),
+                    StructField("creationDate", StringType(), True)
+                ]), True),
+                StructField("sessionIssuer", StructType([
+                    StructField("type", StringType(), True),
+                    StructField("principalId", StringType(), True),
+                    StructField("arn", StringType(), True),
+                    StructField("accountId", StringType(), True),
+                    StructField("username", StringType(), True)
+                ]), True),
+                StructField("ec2RoleDelivery", StringType(), True),
+                StructField("webIdFederationData", StructType([
+                    StructField("federatedProvider", StringType(), True),
+                    StructField("attributes", MapType(StringType(), StringType()), True)
+                ]), True)
+            ]), True)
+        ]), True),
+        StructField("eventTime", StringType(), True),
+        StructField("eventSource", StringType(), True),
+        StructField("eventName", StringType(), True),
+        StructField("awsRegion", StringType(), True),
+        StructField("sourceIpAddress", StringType(), True),
+        StructField("userAgent", StringType(), True),
+        StructField("errorCode", StringType(), True),
+        StructField("errorMessage", StringType(), True),
+        StructField("requestParameters", StringType(), True),
+        StructField("responseElements", StringType(), True),
+        StructField("additionalEventData", StringType(), True),
+        StructField("requestId", StringType(), True),
+        StructField("eventId", StringType(), True),
+        StructField("resources", ArrayType(StructType([
+            StructField("arn", StringType(), True),
+            StructField("accountId", StringType(), True),
+            StructField("type", StringType(), True)
+        ])), True),
+        StructField("eventType", StringType(), True),
+        StructField("apiVersion", StringType(), True),
+        StructField("readOnly", StringType(), True),
+        StructField("recipientAccountId", StringType(), True),
+        StructField("serviceEventDetails", StringType(), True),
+        StructField("sharedEventID", StringType(), True),
+        StructField("vpcEndpointId", StringType(), True),
+        StructField("tlsDetails", StructType([
+            StructField("tlsVersion", StringType(), True),
+            StructField("cipherSuite", StringType(), True),
+            StructField("clientProvidedHostHeader", StringType(), True)
+        ]), True),
+        StructField("managementEvent", StringType(), True),
+        StructField("eventCategory", StringType(), True),
+        StructField("vpcEndpointAccountId", StringType(), True)
+    ])
+
+
+def get_cloudtrail_records_schema():
+    """Wrapper schema for CloudTrail files that have Records array."""
+    return StructType([
+        StructField("Records", ArrayType(get_cloudtrail_schema()), True),
+        StructField("_corrupt_record", StringType(), True)
+    ])
+
+
+def format_partition(partition):
+    # Metadata tables merge every spec's fields, so fields of other specs come back as null
+    return "/".join(f"{key}={value}" for key, value in partition.items() if value is not None)
+
+
+def get_events_partition_spec(granularity, bucket_count=0):
+    """Partition transforms of cloudtrail_events, optionally bucketing eventSource within each time partition."""
+    if granularity not in EVENTS_PARTITION_GRANULARITIES:
+        raise ValueError(f"Unsupported partition granularity: {granularity}")
+    spec = EVENTS_IDENTITY_PARTITIONS + [EVENTS_PARTITION_GRANULARITIES[granularity]]
+    if bucket_count > 0:
+        spec.append(f"bucket({bucket_count}, {EVENTS_BUCKET_COLUMN})")
+    return spec
+
+
+def normalize_transform(transform):
+    return transform.replace(" ", "").lower()
+
+
+def get_table_partition_spec(spark, table_fqn):
+    """Current partition transforms as DESCRIBE TABLE prints them, e.g. days(event_time)."""
+    rows = spark.sql(f"DESCRIBE TABLE {table_fqn}").collect()
+    spec = []
+    in_partitioning = False
+    for row in rows:
+        if row.col_name.strip() == "# Partitioning":
+            in_partitioning = True
+        elif in_partitioning and row.col_name.startswith("Part "):
+            spec.append(row.data_type)
+        elif in_partitioning and (not row.col_name.strip() or row.col_name.startswith("#")):
+            break
+    return spec
+
+
+def ensure_account_column(spark, table_fqn):
+    """Append account_id to an events table created before it existed; its older rows stay null."""
+    if "account_id" in {name.lower() for name in spark.table(table_fqn).columns}:
+        return False
+    spark.sql(f"ALTER TABLE {table_fqn} ADD COLUMNS (account_id string)")
+    logger.info(f"Added account_id column to {table_fqn}")
+    return True
+
+
+def ensure_events_partition_spec(spark, table_fqn, partition_spec):
+    """Evolve the partition spec in place; existing files keep the spec they were written with.
+
+    Only metadata changes: new commits use the new spec, and Iceberg plans each file with its own
+    spec, so event_date filters still prune the older files and event_time ranges the newer ones.
+    A missing identity field such as account_id is added after the existing ones, so the field
+    order of an evolved table can differ from a new one's.
+    """
+    current = get_table_partition_spec(spark, table_fqn)
+    normalized = [normalize_transform(transform) for transform in current]
+    if sorted(normalized) == sorted(normalize_transform(transform) for transform in partition_spec):
+        return False
+
+    time_fields = {normalize_transform(t) for t in EVENTS_PARTITION_GRANULARITIES.values()}
+    current_time = next((t for t, n in zip(current, normalized) if n in time_fields), None)
+    current_bucket = next((t for t, n in zip(current, normalized) if n.startswith("bucket(")), None)
+    desired_time = next(t for t in partition_spec if normalize_transform(t) in time_fields)
+    desired_bucket = next((t for t in partition_spec if t.startswith("bucket(")), None)
+
+    statements = [
+        f"ADD PARTITION FIELD {field}" for field in EVENTS_IDENTITY_PARTITIONS
+        if field in partition_spec and normalize_transform(field) not in normalized
+    ]
+    if current_time is None:
+        statements.append(f"ADD PARTITION FIELD {desired_time}")
+    elif normalize_transform(current_time) != normalize_transform(desired_time):
+        statements.append(f"REPLACE PARTITION FIELD {current_time} WITH {desired_time}")
+    if current_bucket and not desired_bucket:
+        statements.append(f"DROP PARTITION FIELD {current_bucket}")
+    elif desired_bucket and not current_bucket:
+        statements.append(f"ADD PARTITION FIELD {desired_bucket}")
+    elif current_bucket and normalize_transform(current_bucket) != normalize_transform(desired_bucket):
+        statements.append(f"REPLACE PARTITION FIELD {current_bucket} WITH {desired_bucket}")
+    for statement in statements:
+        spark.sql(f"ALTER TABLE {table_fqn} {statement}")
+    logger.info(f"Evolved partition spec of {table_fqn} from {current} to {partition_spec}")
+    return True
+
+
+def local_event_dates(start, end, partition_timezone=DEFAULT_PARTITION_TIMEZONE):
+    """event_date values, in partition_timezone, of the events in the UTC window [start, end)."""
+    zone = ZoneInfo(partition_timezone)
+    first = start.replace(tzinfo=timezone.utc).astimezone(zone).date()
+    last = (end.replace(tzinfo=timezone.utc) - timedelta(microseconds=1)).astimezone(zone).date()
+    return [first + timedelta(days=offset) for offset in range((last - first).days + 1)]
+
+
+def partition_event_dates(partition, partition_timezone=DEFAULT_PARTITION_TIMEZONE):
+    """event_date values a partition tuple can hold, whichever time transform wrote it."""
+    if partition.get("event_date") is not None:
+        return [partition["event_date"]]
+    epoch = datetime(1970, 1, 1)
+    day = partition.get("event_time_day")
+    if day is not None:
+        start = datetime.combine(day, datetime.min.time()) if isinstance(day, date) else epoch + timedelta(days=day)
+        return local_event_dates(start, start + timedelta(days=1), partition_timezone)
+    hour = partition.get("event_time_hour")
+    if hour is not None:
+        start = epoch + timedelta(hours=hour)
+        return local_event_dates(start, start + timedelta(hours=1), partition_timezone)
+    return []
+
+
+def collect_partition_counts(df):
+    """Materialize a persisted batch with one aggregate.
+
+    Returns the per-partition row counts, the sorted non-null event_date values and the batch
+    metrics: records, (min, max) event_time, the source files it has events from and the rows
+    that de-duplication on (event_date, eventId) would drop.
+    """
+    aggregations = [
+        sql_count(lit(1)).alias("records"),
+        sql_min("event_time").alias("min_event_time"),
+        sql_max("event_time").alias("max_event_time"),
+        # Rows left by dropDuplicates: one per distinct eventId, plus one for all the null ones
+        (countDistinct("eventId") + sql_max(col("eventId").isNull().cast("int"))).alias("distinct_events")
+    ]
+    if SOURCE_FILE_COLUMN in df.columns:
+        aggregations.append(collect_set(SOURCE_FILE_COLUMN).alias("source_files"))
+    rows = df.groupBy("account_id", "region", "event_date").agg(*aggregations).collect()
+    counts = {
+        format_partition({"account_id": row.account_id, "region": row.region, "event_date": row.event_date}): row.records
+        for row in rows
+    }
+    event_dates = sorted({row.event_date for row in rows if row.event_date is not None})
+    event_times = [t for row in rows for t in (row.min_event_time, row.max_event_time) if t is not None]
+    event_time_range = (min(event_times), max(event_times)) if event_times else None
+    return counts, event_dates, {
+        "records": sum(counts.values()),
+        "event_time_range": event_time_range,
+        "source_files": {path for row in rows for path in row.asDict().get("source_files") or []},
+        "batch_duplicates": sum(row.records - row.distinct_events for row in rows)
+    }
+
+
+def get_snapshot_partition_counts(spark, table_fqn, snapshot_id, entries_table="entries",
+                                  partition_timezone=DEFAULT_PARTITION_TIMEZONE):
+    """Per-partition record counts of the files a snapshot added, read from Iceberg metadata only.
+
+    A staged snapshot is not an ancestor of the current one, so its files are only listed in
+    all_entries. Returns the counts and the sorted non-null event_date values, like
+    collect_partition_counts.
+    """
+    if snapshot_id is None:
+        return {}, []
+    rows = spark.sql(
+        f"SELECT data_file.partition AS partition, SUM(data_file.record_count) AS records "
+        f"FROM {table_fqn}.{entries_table} WHERE snapshot_id = {snapshot_id} AND status = 1 "
+        f"GROUP BY data_file.partition"
+    ).collect()
+    counts = {format_partition(row.partition.asDict()): row.records for row in rows}
+    event_dates = sorted({
+        event_date for row in rows for event_date in partition_event_dates(row.partition.asDict(), partition_timezone)
+    })
+    return counts, event_dates
+
+
+def get_latest_app_snapshot(spark, table_fqn):
+    """Return (snapshot_id, summary) of the newest snapshot committed by this Spark application."""
+    app_id = spark.sparkContext.applicationId
+    rows = spark.sql(
+        f"SELECT snapshot_id, summary FROM {table_fqn}.snapshots "
+        f"WHERE summary['spark.app.id'] = '{app_id}' ORDER BY committed_at DESC LIMIT 1"
+    ).collect()
+    if not rows:
+        return None, {}
+    return rows[0].snapshot_id, rows[0].summary or {}
+
+
+def merge_into_events_table(spark, table_fqn, source_view, account_id, region, event_dates, event_time_range, source_rows):
+    """Insert events whose eventId is not yet present, scoped to the touched (account_id, region, event_date) partitions.
+
+    A duplicate carries the same eventTime, so the batch's event_time range also bounds the
+    target scan; that is what prunes tables partitioned by days or hours of event_time.
+    Rows written before account_id existed are null there and still checked for duplicates.
+    source_rows counts the batch before its own de-duplication, so the rows skipped as
+    duplicates include those within the batch as well as those already in the table.
+    Returns a dict with the number of inserted rows and rows skipped as duplicates.
+    """
+    previous_snapshot_id, _ = get_latest_app_snapshot(spark, table_fqn)
+    partition_filter = f"(t.account_id = '{account_id}' OR t.account_id IS NULL) AND t.region = '{region}'"
+    if event_dates:
+        date_list = ", ".join(f"DATE '{event_date}'" for event_date in event_dates)
+        partition_filter = f"{partition_filter} AND t.event_date IN ({date_list})"
+    if event_time_range:
+        min_event_time, max_event_time = event_time_range
+        partition_filter = f"{partition_filter} AND t.event_time BETWEEN TIMESTAMP '{min_event_time}' AND TIMESTAMP '{max_event_time}'"
+    merge_sql = f"""
+        MERGE INTO {table_fqn} t
+        USING {source_view} s
+        ON {partition_filter}
+            AND t.region = s.region
+            AND t.event_date = s.event_date
+            AND t.eventId = s.eventId
+        WHEN NOT MATCHED THEN INSERT *
+    """
+    spark.sql(merge_sql)
+    snapshot_id, summary = get_latest_app_snapshot(spark, table_fqn)
+    inserted = int(summary.get("added-records", 0)) if snapshot_id != previous_snapshot_id else 0
+    # Insert-only merges commit as appends; copy-on-write rewrites also report carried-over rows
+    inserted -= int(summary.get("deleted-records", 0)) if snapshot_id != previous_snapshot_id else 0
+    return {"inserted": inserted, "skipped_duplicates": max(0, source_rows - inserted)}
+
+
+def get_events_layout_properties():
+    properties = {
+        f"write.parquet.bloom-filter-enabled.column.{column}": "true"
+        for column in EVENTS_BLOOM_FILTER_COLUMNS
+    }
+    properties["write.parquet.bloom-filter-max-bytes"] = str(1024 * 1024)
+    properties["cloudtrail.layout-version"] = str(EVENTS_TABLE_LAYOUT_VERSION)
+    return properties
+
+
+def format_table_properties(properties):
+    return ", ".join(f"'{key}'='{value}'" for key, value in properties.items())
+
+
+def ensure_events_table_layout(spark, table_fqn):
+    """Declare the write sort order and bloom filters on a table created by an older job version.
+
+    New data files pick the layout up immediately; the maintenance job's sort rewrite
+    migrates the files written before.
+    """
+    current = {row.key: row.value for row in spark.sql(f"SHOW TBLPROPERTIES {table_fqn}").collect()}
+    if int(current.get("cloudtrail.layout-version", "0")) >= EVENTS_TABLE_LAYOUT_VERSION:
+        return False
+    spark.sql(f"ALTER TABLE {table_fqn} WRITE LOCALLY ORDERED BY {', '.join(EVENTS_SORT_ORDER)}")
+    spark.sql(f"ALTER TABLE {table_fqn} SET TBLPROPERTIES ({format_table_properties(get_events_layout_properties())})")
+    logger.info(f"Migrated {table_fqn} to layout version {EVENTS_TABLE_LAYOUT_VERSION}: sort order {EVENTS_SORT_ORDER}, bloom filters on {EVENTS_BLOOM_FILTER_COLUMNS}")
+    return True
+
+def read_raw_events(spark, paths):
+    """Read CloudTrail files with the explicit schema, tagging each with its path. Corrupt files are dropped."""
+    # Explicit schema avoids duplicate column issues from schema inference
+    df_raw = (
+        spark.read.option("multiLine", "true")
+        .option("mode", "PERMISSIVE")
+        .option("columnNameOfCorruptRecord", "_corrupt_record")
+        .schema(get_cloudtrail_records_schema())
+        .json(paths)
+    )
+    # The batch aggregate counts the files events came from; the others were corrupt or empty
+    df_raw = df_raw.withColumn(SOURCE_FILE_COLUMN, input_file_name())
+    return df_raw.filter(col("_corrupt_record").isNull()).drop("_corrupt_record")
+
+def build_events(df_raw, account_id, region, classification_expressions, extraction_expressions,
+                 partition_timezone=DEFAULT_PARTITION_TIMEZONE):
+    """One row per record with the time, partition, classification and extracted columns."""
+    df = df_raw.select(explode(col("Records")).alias("record"), SOURCE_FILE_COLUMN).select("record.*", SOURCE_FILE_COLUMN)
+
+    df = df.withColumn("event_time", to_timestamp(col("eventTime")))
+    df = df.withColumn("event_time_local", from_utc_timestamp(col("event_time"), REPORTING_TIMEZONE))
+    df = df.withColumn("event_date", to_date(from_utc_timestamp(col("event_time"), partition_timezone)))
+
+    # Add region as a column for partitioning
+    df = df.withColumn("region", lit(region))
+    for column_name, column_sql in classification_expressions:
+        df = df.withColumn(column_name, expr(column_sql))
+    # Hot request/response fields become plain columns so queries need no JSON parsing
+    parse_expressions, column_expressions, temp_columns = extraction_expressions
+    for column_name, column_sql in parse_expressions + column_expressions:
+        df = df.withColumn(column_name, expr(column_sql))
+    df = df.drop(*temp_columns)
+    # Last, where ADD COLUMNS puts it on tables created before it, as INSERT matches by position
+    df = df.withColumn("account_id", lit(account_id))
+    return df
+
+def prepare_events_for_write(df, input_bytes, target_input_bytes_per_partition, stage_name):
+    return process_dataframe_with_partitioning(df, input_bytes, target_input_bytes_per_partition, stage_name)
+
+def ensure_staged_writes(spark, table_fqn):
+    """Enable write-audit-publish, so commits made with spark.wap.id set are staged, not published."""
+    current = {row.key: row.value for row in spark.sql(f"SHOW TBLPROPERTIES {table_fqn}").collect()}
+    if current.get("write.wap.enabled", "false").lower() == "true":
+        return False
+    spark.sql(f"ALTER TABLE {table_fqn} SET TBLPROPERTIES ('write.wap.enabled'='true')")
+    logger.info(f"Enabled staged writes on {table_fqn}")
+    return True
+
+
+@contextmanager
+def staged_write(spark, wap_id, commit_lock=None):
+    """Stage the write statements run inside under wap_id; a no-op without one.
+
+    spark.wap.id is a session-wide setting that concurrent pipelines would pick up, so it is
+    only set around the write itself and under the commit lock, which is taken here. The lock
+    must be reentrant (an RLock): write_events already holds it for the DDL before the write.
+    """
+    if not wap_id:
+        yield
+        return
+    with commit_lock or nullcontext():
+        spark.conf.set("spark.wap.id", wap_id)
+        try:
+            yield
+        finally:
+            spark.conf.unset("spark.wap.id")
+
+
+def get_wap_snapshot_id(spark, table_fqn, wap_id):
+    """The snapshot staged under wap_id, or None when the write committed nothing staged."""
+    rows = spark.sql(
+        f"SELECT snapshot_id FROM {table_fqn}.snapshots WHERE summary['wap.id'] = '{wap_id}' "
+        f"ORDER BY committed_at DESC LIMIT 1"
+    ).collect()
+    return rows[0].snapshot_id if rows else None
+
+
+def get_unpublished_snapshots(spark, table_fqn):
+    """Staged snapshots not yet published, oldest first, as (snapshot_id, wap_id, committed_at).
+
+    A cherry-picked snapshot is re-committed with published-wap-id in its summary; one whose
+    parent was still current is fast-forwarded instead and shows up in the table history.
+    """
+    snapshots = spark.sql(
+        f"SELECT snapshot_id, committed_at, summary FROM {table_fqn}.snapshots ORDER BY committed_at"
+    ).collect()
+    published_wap_ids = {
+        (row.summary or {}).get("published-wap-id") for row in snapshots
+    } - {None}
+    history_ids = {row.snapshot_id for row in spark.sql(f"SELECT snapshot_id FROM {table_fqn}.history").collect()}
+    unpublished = []
+    for row in snapshots:
+        wap_id = (row.summary or {}).get("wap.id")
+        if wap_id and wap_id not in published_wap_ids and row.snapshot_id not in history_ids:
+            unpublished.append((row.snapshot_id, wap_id, row.committed_at))
+    return unpublished
+
+
+def get_partition_timezone(spark, table_fqn):
+    """Zone of the event_date values of an existing events table, or None when it does not exist."""
+    if not table_exists(spark, table_fqn):
+        return None
+    properties = {row.key: row.value for row in spark.sql(f"SHOW TBLPROPERTIES {table_fqn}").collect()}
+    return properties.get(PARTITION_TIMEZONE_PROPERTY, LEGACY_PARTITION_TIMEZONE)
+
+
+def resolve_partition_timezone(spark, table_fqn, requested):
+    """Zone to compute event_date in: the requested one for a new table, the table's otherwise.
+
+    Writing dates of another zone into an existing table would split its days differently
+    from the rows already there, so a different requested zone only takes effect once the
+    partition timezone migration job has re-partitioned the table.
+    """
+    try:
+        ZoneInfo(requested)
+    except (KeyError, ValueError):
+        logger.error(f"Unknown partition_timezone: {requested}")
+        raise ValueError(f"Unknown partition_timezone: {requested}")
+    current = get_partition_timezone(spark, table_fqn)
+    if current is None:
+        return requested
+    if current != requested:
+        logger.warning(f"{table_fqn} holds {current} event_date partitions, not {requested}; writing {current} dates until it is migrated")
+    return current
+
+
+def table_exists(spark, table_fqn):
+    try:
+        spark.sql(f"DESCRIBE TABLE {table_fqn}")
+        return True
+    except AnalysisException:
+        return False
+
+def write_events(spark, df, table_fqn, table_location, temp_view, account_id, region, write_mode, partition_spec,
+                 commit_lock=None, wap_id=None, partition_timezone=DEFAULT_PARTITION_TIMEZONE):
+    """Create cloudtrail_events from the batch, or merge or append it into the existing table.
+
+    partition_spec comes from get_events_partition_spec; an existing table is evolved to it.
+    partition_timezone, from resolve_partition_timezone, is recorded on a table this creates.
+    With a commit_lock shared by concurrent pipelines, the batch is materialized before the lock
+    is taken, so their reads, parsing and shuffles overlap and only the table DDL and Iceberg
+    commits are serialized; under the lock the newest snapshot of the app is this pipeline's.
+    With a wap_id the merge or append into an existing table is staged under that ID for the
+    commit coordinator to publish; the first batch still creates the table directly.
+    Returns the per-partition record counts written, the touched event_date values and the
+    batch metrics: records, (min, max) event_time and the files events were read from.
+    """
+    # Persist the batch so the aggregate that finds the touched partitions and the metrics is
+    # the only read of the raw JSON; the write reads the cached rows
+    df.persist(StorageLevel.MEMORY_AND_DISK)
+    batch_counts, batch_event_dates, batch_metrics = collect_partition_counts(df)
+    # Not a table column; dropped so account_id stays last for the positional INSERT
+    write_df = df.drop(SOURCE_FILE_COLUMN)
+    if write_mode == "merge":
+        # Adds no shuffle only when the batch was just hash-partitioned by event_date; otherwise
+        # it shuffles on (event_date, eventId). Counted as duplicates in the merge result
+        write_df = write_df.dropDuplicates(["event_date", "eventId"])
+    write_df.sortWithinPartitions(*EVENTS_SORT_ORDER).createOrReplaceTempView(temp_view)
+
+    with commit_lock or nullcontext():
+        if not table_exists(spark, table_fqn):
+            table_properties = {**get_events_layout_properties(), PARTITION_TIMEZONE_PROPERTY: partition_timezone}
+            # Create table with schema from the first batch of data
+            spark.sql(f"""
+                CREATE TABLE {table_fqn}
+                USING iceberg
+                LOCATION '{table_location}'
+                TBLPROPERTIES ('format-version'='2', {format_table_properties(table_properties)})
+                PARTITIONED BY ({', '.join(partition_spec)})
+                AS SELECT * FROM {temp_view}
+            """)
+            # CTAS cannot declare a sort order, the batch itself was already sorted the same way
+            spark.sql(f"ALTER TABLE {table_fqn} WRITE LOCALLY ORDERED BY {', '.join(EVENTS_SORT_ORDER)}")
+            snapshot_id, _ = get_latest_app_snapshot(spark, table_fqn)
+            partition_counts, event_dates = get_snapshot_partition_counts(
+                spark, table_fqn, snapshot_id, partition_timezone=partition_timezone
+            )
+            logger.info(f"Created Iceberg table {table_fqn} with partitions ({', '.join(partition_spec)}) on {partition_timezone} dates")
+            return partition_counts, event_dates, batch_metrics
+
+        logger.info(f"Table {table_fqn} already exists")
+        ensure_events_table_layout(spark, table_fqn)
+        ensure_derived_columns(spark, table_fqn)
+        ensure_account_column(spark, table_fqn)
+        ensure_events_partition_spec(spark, table_fqn, partition_spec)
+        if wap_id:
+            ensure_staged_writes(spark, table_fqn)
+        if write_mode == "merge":
+            with staged_write(spark, wap_id, commit_lock):
+                merge_result = merge_into_events_table(
+                    spark,
+                    table_fqn,
+                    temp_view,
+                    account_id,
+                    region,
+                    batch_event_dates,
+                    batch_metrics["event_time_range"],
+                    batch_metrics["records"]
+                )
+            logger.info(f"Merged into {table_fqn} for account_id={account_id}, region={region}, event_dates={[str(d) for d in batch_event_dates]}: {merge_result['inserted']} inserted, {merge_result['skipped_duplicates']} skipped as duplicates ({batch_metrics['batch_duplicates']} within the batch){f', staged as {wap_id}' if wap_id else ''}")
+            return batch_counts, batch_event_dates, batch_metrics
+
+        with staged_write(spark, wap_id, commit_lock):
+            spark.sql(f"INSERT INTO {table_fqn} SELECT * FROM {temp_view}")
+        snapshot_id, _ = get_latest_app_snapshot(spark, table_fqn)
+        partition_counts, event_dates = get_snapshot_partition_counts(
+            spark, table_fqn, snapshot_id, "all_entries" if wap_id else "entries", partition_timezone
+        )
+        logger.info(f"Inserted data into {table_fqn} for account_id={account_id}, region={region}, event_dates={[str(d) for d in event_dates]}{f', staged as {wap_id}' if wap_id else ''}")
+        return partition_counts, event_dates, batch_metrics
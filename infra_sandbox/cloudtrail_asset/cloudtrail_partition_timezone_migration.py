@@ -0,0 +1,100 @@
+import sys
+import time
+import logging
+from zoneinfo import ZoneInfo
+
+from awsglue.utils import getResolvedOptions
+from awsglue.context import GlueContext
+from awsglue.job import Job
+
+from cloudtrail_common import get_optional_args
+from cloudtrail_derived import (
+    ensure_rollup_tables,
+    ensure_security_events_table,
+    refresh_derived_tables
+)
+from cloudtrail_ingest_engine import (
+    CATALOG_NAME,
+    EVENTS_TABLE,
+    GlueCatalogBackend,
+    create_spark_session
+)
+from cloudtrail_ingest_stages import PARTITION_TIMEZONE_PROPERTY, get_partition_timezone
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+def build_migration_predicate(start_date, end_date, target_date_sql):
+    """Rows whose event_date was computed in another zone, optionally within an event_date range."""
+    clauses = [f"event_date <> {target_date_sql}"]
+    if start_date:
+        clauses.append(f"event_date >= DATE '{start_date}'")
+    if end_date:
+        clauses.append(f"event_date <= DATE '{end_date}'")
+    return " AND ".join(clauses)
+
+args = getResolvedOptions(
+    sys.argv,
+    [
+        "JOB_NAME",
+        "output_path",
+        "database_name"
+    ]
+)
+
+optional_args = get_optional_args(
+    sys.argv,
+    {
+        "partition_timezone": "UTC",
+        "start_date": "",
+        "end_date": ""
+    }
+)
+
+database_name = args["database_name"]
+s3_output_path = args["output_path"]
+logging_bucket_name = s3_output_path.split("/")[2]
+table_fqn = f"{CATALOG_NAME}.{database_name}.{EVENTS_TABLE}"
+partition_timezone = optional_args["partition_timezone"]
+try:
+    ZoneInfo(partition_timezone)
+except (KeyError, ValueError):
+    logger.error(f"Unknown partition_timezone: {partition_timezone}")
+    raise ValueError(f"Unknown partition_timezone: {partition_timezone}")
+
+spark = create_spark_session(GlueCatalogBackend(f"s3://{logging_bucket_name}/glue_job_tmp/"))
+glueContext = GlueContext(spark.sparkContext)
+job = Job(glueContext)
+job.init(args["JOB_NAME"], args)
+
+current_timezone = get_partition_timezone(spark, table_fqn)
+if current_timezone is None:
+    logger.error(f"{table_fqn} does not exist")
+    raise ValueError(f"{table_fqn} does not exist")
+if current_timezone != partition_timezone:
+    # Ingest runs starting from here on compute event_date in the new zone; rows written by runs
+    # already in flight are picked up by the stale-row predicate when this job is run again
+    spark.sql(f"ALTER TABLE {table_fqn} SET TBLPROPERTIES ('{PARTITION_TIMEZONE_PROPERTY}'='{partition_timezone}')")
+    logger.info(f"Switched {table_fqn} from {current_timezone} to {partition_timezone} event_date partitions")
+
+target_date_sql = f"to_date(from_utc_timestamp(event_time, '{partition_timezone}'))"
+predicate = build_migration_predicate(optional_args["start_date"], optional_args["end_date"], target_date_sql)
+moves = spark.sql(
+    f"SELECT DISTINCT region, event_date, {target_date_sql} AS target_date FROM {table_fqn} WHERE {predicate}"
+).collect()
+# Both the partitions rows leave and the ones they land in need their derived rows recomputed
+touched_partitions = {(row.region, row.event_date) for row in moves} | {(row.region, row.target_date) for row in moves}
+logger.info(f"Re-partitioning {len(moves)} (region, event_date) moves into {partition_timezone} dates matching: {predicate}")
+
+job_start = time.time()
+# One UPDATE per source event_date keeps each commit small and lets a failed run pick up where it stopped
+for event_date in sorted({row.event_date for row in moves}):
+    start_time = time.time()
+    spark.sql(f"UPDATE {table_fqn} SET event_date = {target_date_sql} WHERE event_date = DATE '{event_date}' AND {predicate}")
+    logger.info(f"Re-partitioned event_date={event_date} in {time.time() - start_time:.1f}s")
+
+ensure_rollup_tables(spark, database_name, s3_output_path)
+ensure_security_events_table(spark, database_name, s3_output_path)
+refresh_derived_tables(spark, database_name, table_fqn, touched_partitions)
+logger.info(f"Migration to {partition_timezone} event_date partitions completed for {len(touched_partitions)} partitions in {time.time() - job_start:.1f}s")
+job.commit()
@@ -0,0 +1,190 @@
+"""Retention of the CloudTrail Iceberg tables through metadata operations.
+
+Expired time partitions are dropped with a DELETE whose predicate falls on partition
+boundaries, which Iceberg carries out by removing the data and delete files from the table
+metadata, so no file is read or rewritten. Orphan files are looked for only in the data directories written
+since they were last checked, instead of listing the whole table location on every run. What
+has been checked is kept in a small JSON state document next to the other job state.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+RETENTION_STATE_KEY = "glue_job_tmp/retention/cloudtrail_events_state.json"
+# Days of events kept when a job is not given --retention_days_for_processed_logs
+DEFAULT_RETENTION_DAYS = 14
+# Files younger than this may belong to a write still in flight and are never removed as orphans
+ORPHAN_MIN_AGE_HOURS = 72
+# Snapshots younger than this are kept, Iceberg's own default for expire_snapshots
+SNAPSHOT_MAX_AGE_DAYS = 5
+
+
+def format_state_time(value):
+    """State times are naive UTC, comparable as strings and usable as Spark timestamp literals."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(sep=" ", timespec="microseconds")
+
+
+def parse_state_time(value):
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+
+def load_retention_state(storage, uri):
+    """The state written by the previous retention run, or an empty one."""
+    try:
+        return storage.read_json(uri)
+    except Exception as e:
+        logger.info(f"No retention state read from {uri} ({e}); starting with an empty one")
+        return {}
+
+
+def retention_due(state, min_interval_hours):
+    """Whether the last retention run is at least min_interval_hours old."""
+    last_run_at = state.get("last_run_at")
+    if not last_run_at or min_interval_hours <= 0:
+        return True
+    return datetime.now(timezone.utc) - parse_state_time(last_run_at) >= timedelta(hours=min_interval_hours)
+
+
+def expired_partition_predicate(spark, table_fqn, cutoff_date):
+    """files-table predicate selecting whole time partitions before cutoff_date, under any spec.
+
+    Each file matches on the time field of the spec that wrote it; the fields of other specs
+    are null for it. Returns None when the table has no time partition.
+    """
+    fields = spark.table(f"{table_fqn}.files").schema["partition"].dataType.fieldNames()
+    clauses = []
+    if "event_date" in fields:
+        clauses.append(f"partition.event_date < DATE '{cutoff_date}'")
+    if "event_time_day" in fields:
+        clauses.append(f"partition.event_time_day < DATE '{cutoff_date}'")
+    if "event_time_hour" in fields:
+        epoch_hours = int((datetime.strptime(cutoff_date, "%Y-%m-%d") - datetime(1970, 1, 1)).total_seconds() // 3600)
+        clauses.append(f"partition.event_time_hour < {epoch_hours}")
+    return " OR ".join(clauses) or None
+
+
+def expired_row_predicate(spark, table_fqn, cutoff_date):
+    """Row predicate of a DELETE that removes whole time partitions before cutoff_date.
+
+    Uses the time field of the current spec: event_time, whose day and hour partitions start on
+    UTC hour boundaries, or else event_date. Files of an older spec whose column bounds lie
+    before the cutoff are removed whole as well; only ones straddling it would be rewritten.
+    """
+    partitioning = [
+        row.data_type for row in spark.sql(f"DESCRIBE TABLE {table_fqn}").collect()
+        if row.col_name.startswith("Part ")
+    ]
+    if any(transform.startswith(("days(event_time)", "hours(event_time)")) for transform in partitioning):
+        return f"event_time < TIMESTAMP '{cutoff_date} 00:00:00Z'"
+    return f"event_date < DATE '{cutoff_date}'"
+
+
+def drop_expired_partitions(spark, table_fqn, cutoff_date):
+    """Delete the partitions before cutoff_date, data and delete files alike, in one metadata commit.
+
+    Skipped without a commit when no file of an expired partition is left. Returns the number of
+    files and data records dropped.
+    """
+    predicate = expired_partition_predicate(spark, table_fqn, cutoff_date)
+    if predicate is None:
+        logger.warning(f"{table_fqn} has no time partition; nothing dropped")
+        return {"files": 0, "records": 0}
+    rows = spark.sql(
+        f"SELECT content, record_count FROM {table_fqn}.files WHERE {predicate}"
+    ).collect()
+    if not rows:
+        return {"files": 0, "records": 0}
+    spark.sql(f"DELETE FROM {table_fqn} WHERE {expired_row_predicate(spark, table_fqn, cutoff_date)}")
+    dropped = {"files": len(rows), "records": sum(row.record_count for row in rows if row.content == 0)}
+    logger.info(f"Dropped partitions of {table_fqn} before {cutoff_date}: {dropped['files']} files, {dropped['records']} records")
+    return dropped
+
+
+def expire_snapshots(spark, table_fqn, protected_since=None, max_age_days=SNAPSHOT_MAX_AGE_DAYS):
+    """Expire snapshots older than max_age_days, always keeping the last two.
+
+    protected_since is the commit time of the oldest staged snapshot still waiting to be
+    published; nothing committed from then on is expired, so its write is not lost.
+    """
+    older_than = datetime.now(timezone.utc) - timedelta(days=max_age_days)
+    if protected_since is not None:
+        if protected_since.tzinfo is None:
+            protected_since = protected_since.replace(tzinfo=timezone.utc)
+        older_than = min(older_than, protected_since)
+    catalog_name = table_fqn.split(".", 1)[0]
+    spark.sql(
+        f"CALL {catalog_name}.system.expire_snapshots(table => '{table_fqn}', "
+        f"older_than => TIMESTAMP '{format_state_time(older_than)}', retain_last => 2)"
+    )
+    logger.info(f"Expired snapshots of {table_fqn} older than {format_state_time(older_than)}")
+
+
+def find_written_directories(spark, table_fqn, committed_after):
+    """Data directories of the files added by snapshots committed after committed_after.
+
+    Staged snapshots count too, since their writes land in the same directories. Returns a
+    dict of directory -> newest commit time, formatted like the state.
+    """
+    committed_clause = f"AND s.committed_at > TIMESTAMP '{committed_after}'" if committed_after else ""
+    rows = spark.sql(f"""
+        SELECT regexp_extract(e.data_file.file_path, '^(.*)/[^/]+$', 1) AS directory,
+               MAX(s.committed_at) AS last_written
+        FROM {table_fqn}.all_entries e
+        JOIN {table_fqn}.snapshots s ON e.snapshot_id = s.snapshot_id
+        WHERE e.status = 1 {committed_clause}
+        GROUP BY 1
+    """).collect()
+    return {row.directory: format_state_time(row.last_written) for row in rows if row.directory}
+
+
+def remove_orphan_files(spark, table_fqn, older_than, location=None):
+    catalog_name = table_fqn.split(".", 1)[0]
+    arguments = [f"table => '{table_fqn}'", f"older_than => TIMESTAMP '{older_than}'", "dry_run => false"]
+    if location:
+        arguments.append(f"location => '{location}'")
+    return len(spark.sql(f"CALL {catalog_name}.system.remove_orphan_files({', '.join(arguments)})").collect())
+
+
+def remove_recent_orphan_files(spark, table_fqn, orphan_state, full_scan=False, min_age_hours=ORPHAN_MIN_AGE_HOURS):
+    """Remove orphan files from the data directories written since they were last checked.
+
+    orphan_state holds the newest commit already looked at and, per directory, when it was last
+    written and the time through which it has been checked. Files younger than min_age_hours
+    are left alone, so a directory stays due until a check covers its last write; it is then
+    dropped from the state and comes back when it is written again. full_scan lists the whole
+    table location once, e.g. for directories that only ever received failed writes.
+    Returns the updated state and the number of files removed.
+    """
+    checked_through = format_state_time(datetime.now(timezone.utc) - timedelta(hours=min_age_hours))
+    directories = dict(orphan_state.get("directories", {}))
+    written = find_written_directories(spark, table_fqn, orphan_state.get("commits_through"))
+    for directory, last_written in written.items():
+        entry = directories.setdefault(directory, {})
+        entry["last_written"] = max(entry.get("last_written", ""), last_written)
+    commits_through = max([orphan_state.get("commits_through") or "", *written.values()]) or None
+
+    removed = 0
+    if full_scan:
+        removed = remove_orphan_files(spark, table_fqn, checked_through)
+        for entry in directories.values():
+            entry["checked_through"] = checked_through
+    else:
+        due = sorted(
+            directory for directory, entry in directories.items()
+            if entry["last_written"] > entry.get("checked_through", "")
+        )
+        for directory in due:
+            removed += remove_orphan_files(spark, table_fqn, checked_through, directory)
+            directories[directory]["checked_through"] = checked_through
+        logger.info(f"Checked {len(due)} of {len(directories)} tracked directories of {table_fqn} for orphan files")
+
+    remaining = {
+        directory: entry for directory, entry in directories.items()
+        if entry["last_written"] > entry.get("checked_through", "")
+    }
+    logger.info(f"Removed {removed} orphan files of {table_fqn}; {len(remaining)} directories have writes newer than {checked_through} to check later")
+    return {"commits_through": commits_through, "directories": remaining}, removed
@@ -0,0 +1,178 @@
+"""Concurrent, rate-adaptive deletion of ingested raw CloudTrail objects.
+
+Shared by the Spark and fast ingest jobs through --extra-py-files.
+"""
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# delete_objects accepts at most this many keys per request
+DELETE_BATCH_SIZE = 1000
+THROTTLE_ERROR_CODES = ("SlowDown", "ServiceUnavailable", "RequestLimitExceeded", "503")
+
+class TokenBucketRateLimiter:
+    """Token bucket over objects per second with additive increase, multiplicative decrease.
+
+    Every throttled request halves the rate, every successful one raises it by a fixed step, so
+    the workers converge on what the bucket's prefixes can sustain.
+    """
+
+    def __init__(self, rate, min_rate, max_rate, increase_step):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.increase_step = float(increase_step)
+        self.tokens = float(DELETE_BATCH_SIZE)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        # Capacity of at least one full request, otherwise a large batch could never be admitted
+        capacity = max(self.rate, DELETE_BATCH_SIZE)
+        self.tokens = min(capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, tokens):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_seconds = (tokens - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttle(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            # Drop the accumulated burst so the slowdown takes effect immediately
+            self.tokens = min(self.tokens, 0.0)
+
+def is_throttle_error(error):
+    code = str(error.response.get("Error", {}).get("Code", ""))
+    status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return code in THROTTLE_ERROR_CODES or status == 503
+
+def create_deleter_client(max_workers):
+    # Retries are left to the deleter so throttling reaches the rate limiter instead of being absorbed
+    return boto3.client(
+        "s3",
+        config=Config(max_pool_connections=max_workers, retries={"max_attempts": 1, "mode": "standard"})
+    )
+
+class RawLogDeleter:
+    """Deletes keys in concurrent delete_objects calls behind one shared rate limiter.
+
+    Callers pass only keys recorded in the processed-object manifest. Keys are sorted and cut
+    into contiguous ranges of up to 1000, so each request stays within one key range of the bucket.
+    Use as a context manager; leaving the block waits for every pending delete.
+    """
+
+    def __init__(self, bucket, max_workers=16, initial_rate=3000, min_rate=100, max_rate=10000,
+                 increase_step=100, max_attempts=8, s3_client=None):
+        self.bucket = bucket
+        self.max_attempts = max_attempts
+        self.s3_client = s3_client or create_deleter_client(max_workers)
+        self.rate_limiter = TokenBucketRateLimiter(initial_rate, min_rate, max_rate, increase_step)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.futures = []
+        self.stats_lock = threading.Lock()
+        self.stats = {"requested": 0, "deleted": 0, "failed": 0, "throttled": 0}
+        self.prefix_stats = {}
+        self.started_at = None
+        self.finished_at = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def delete(self, prefix, keys):
+        """Schedule the deletion of keys under prefix and return immediately."""
+        keys = sorted(set(keys))
+        if not keys:
+            return
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+        with self.stats_lock:
+            self.stats["requested"] += len(keys)
+            self.prefix_stats.setdefault(prefix, {"requested": 0, "deleted": 0, "failed": 0})["requested"] += len(keys)
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            self.futures.append(self.executor.submit(self._delete_shard, prefix, keys[start:start + DELETE_BATCH_SIZE]))
+
+    def _record(self, prefix, deleted=0, failed=0, throttled=0):
+        with self.stats_lock:
+            self.stats["deleted"] += deleted
+            self.stats["failed"] += failed
+            self.stats["throttled"] += throttled
+            self.prefix_stats[prefix]["deleted"] += deleted
+            self.prefix_stats[prefix]["failed"] += failed
+
+    def _delete_shard(self, prefix, keys):
+        pending = keys
+        for attempt in range(1, self.max_attempts + 1):
+            self.rate_limiter.acquire(len(pending))
+            try:
+                response = self.s3_client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={"Objects": [{"Key": key} for key in pending], "Quiet": True}
+                )
+            except ClientError as e:
+                if not is_throttle_error(e):
+                    logger.error(f"delete_objects failed for {len(pending)} keys under {prefix}: {e}")
+                    self._record(prefix, failed=len(pending))
+                    return
+                self.rate_limiter.on_throttle()
+                self._record(prefix, throttled=1)
+                logger.warning(f"S3 throttled delete of {len(pending)} keys under {prefix}, attempt {attempt}, rate now {self.rate_limiter.rate:.0f} objects/s")
+                continue
+
+            errors = response.get("Errors", [])
+            retry_keys = [error["Key"] for error in errors if error.get("Code") in THROTTLE_ERROR_CODES]
+            for error in errors:
+                if error.get("Code") not in THROTTLE_ERROR_CODES:
+                    logger.warning(f"Failed to delete {error.get('Key')}: {error.get('Code')} {error.get('Message')}")
+            self._record(prefix, deleted=len(pending) - len(errors), failed=len(errors) - len(retry_keys))
+            if not retry_keys:
+                self.rate_limiter.on_success()
+                return
+            self.rate_limiter.on_throttle()
+            self._record(prefix, throttled=1)
+            pending = retry_keys
+        logger.error(f"Giving up on {len(pending)} keys under {prefix} after {self.max_attempts} throttled attempts")
+        self._record(prefix, failed=len(pending))
+
+    def close(self):
+        """Wait for all scheduled deletes and return the summary."""
+        for future in self.futures:
+            future.result()
+        self.executor.shutdown(wait=True)
+        self.futures = []
+        if self.finished_at is None:
+            self.finished_at = time.monotonic()
+        return self.summary()
+
+    def summary(self):
+        elapsed = (self.finished_at or time.monotonic()) - (self.started_at or time.monotonic())
+        with self.stats_lock:
+            summary = dict(self.stats)
+            summary["prefixes"] = len(self.prefix_stats)
+            summary["failed_prefixes"] = sorted(prefix for prefix, stats in self.prefix_stats.items() if stats["failed"])
+        summary["elapsed_seconds"] = round(elapsed, 1)
+        summary["objects_per_second"] = round(summary["deleted"] / elapsed, 1) if elapsed > 0 else 0.0
+        summary["final_rate"] = round(self.rate_limiter.rate, 1)
+        return summary
@@ -0,0 +1,171 @@
+import sys
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+
+from awsglue.utils import getResolvedOptions
+from awsglue.context import GlueContext
+from awsglue.job import Job
+
+from cloudtrail_common import get_optional_args
+from cloudtrail_derived import event_time_bound_sql
+from cloudtrail_ingest_engine import GlueCatalogBackend, create_spark_session
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+def table_has_column(spark, table_fqn, column_name):
+    return column_name in spark.table(table_fqn).columns
+
+def recent_partition_predicate(spark, table_fqn, start_date):
+    """files-table predicate on the time partition, whichever partition spec wrote each file.
+
+    cloudtrail_events may be partitioned by event_date, days(event_time) or hours(event_time),
+    and after a spec evolution its files carry a mix of them.
+    """
+    fields = spark.table(f"{table_fqn}.files").schema["partition"].dataType.fieldNames()
+    clauses = []
+    if "event_date" in fields:
+        clauses.append(f"partition.event_date >= DATE '{start_date}'")
+    if "event_time_day" in fields:
+        clauses.append(f"partition.event_time_day >= DATE '{start_date}'")
+    if "event_time_hour" in fields:
+        epoch_hours = int((datetime.strptime(start_date, "%Y-%m-%d") - datetime(1970, 1, 1)).total_seconds() // 3600)
+        clauses.append(f"partition.event_time_hour >= {epoch_hours}")
+    return " OR ".join(clauses) or None
+
+def get_file_stats(spark, table_fqn, partition_predicate):
+    """Count data files, bytes and records of the table, optionally limited to some partitions."""
+    where_clause = f"WHERE {partition_predicate}" if partition_predicate else ""
+    row = spark.sql(
+        f"SELECT COUNT(*) AS files, COALESCE(SUM(file_size_in_bytes), 0) AS bytes, "
+        f"COALESCE(SUM(record_count), 0) AS records FROM {table_fqn}.files {where_clause}"
+    ).collect()[0]
+    return {"files": row.files, "bytes": row.bytes, "records": row.records}
+
+def get_manifest_count(spark, table_fqn):
+    return spark.sql(f"SELECT COUNT(*) AS manifests FROM {table_fqn}.manifests").collect()[0].manifests
+
+def rewrite_data_files(spark, table_fqn, strategy, sort_order, options, where):
+    """Compact small files with the bin-pack or sort strategy and return the procedure output."""
+    options_sql = ", ".join(f"'{key}', '{value}'" for key, value in options.items())
+    arguments = [f"table => '{table_fqn}'", f"strategy => '{strategy}'", f"options => map({options_sql})"]
+    if strategy == "sort" and sort_order:
+        # Without an explicit order the table's declared write order is used
+        arguments.append(f"sort_order => '{sort_order}'")
+    if where:
+        arguments.append(f'where => "{where}"')
+    rows = spark.sql(f"CALL glue_catalog.system.rewrite_data_files({', '.join(arguments)})").collect()
+    return rows[0].asDict() if rows else {}
+
+def rewrite_manifests(spark, table_fqn):
+    rows = spark.sql(f"CALL glue_catalog.system.rewrite_manifests(table => '{table_fqn}')").collect()
+    return rows[0].asDict() if rows else {}
+
+def maintain_table(spark, table_fqn, strategy, sort_order, options, lookback_days, run_manifest_rewrite):
+    """Compact recently written partitions of one table and report files before and after."""
+    start_time = time.time()
+    recent_predicate = None
+    where = None
+    if lookback_days > 0 and table_has_column(spark, table_fqn, "event_date"):
+        start_date = (datetime.now(timezone.utc) - timedelta(days=lookback_days)).strftime("%Y-%m-%d")
+        recent_predicate = recent_partition_predicate(spark, table_fqn, start_date)
+        where = f"event_date >= '{start_date}'"
+        if table_has_column(spark, table_fqn, "event_time"):
+            # Selects the recent files of a table partitioned by event_time as well
+            where = f"{where} AND {event_time_bound_sql(start_date)}"
+
+    files_before = get_file_stats(spark, table_fqn, recent_predicate)
+    manifests_before = get_manifest_count(spark, table_fqn)
+    rewrite_result = rewrite_data_files(spark, table_fqn, strategy, sort_order, options, where)
+    manifest_result = rewrite_manifests(spark, table_fqn) if run_manifest_rewrite else {}
+    files_after = get_file_stats(spark, table_fqn, recent_predicate)
+    manifests_after = get_manifest_count(spark, table_fqn)
+
+    report = {
+        "table": table_fqn,
+        "strategy": strategy,
+        "scope": where or "all partitions",
+        "files_before": files_before,
+        "files_after": files_after,
+        "manifests_before": manifests_before,
+        "manifests_after": manifests_after,
+        "rewrite_data_files": rewrite_result,
+        "rewrite_manifests": manifest_result,
+        "duration_seconds": round(time.time() - start_time, 1)
+    }
+    logger.info(f"Maintenance report: {report}")
+    return report
+
+args = getResolvedOptions(
+    sys.argv,
+    [
+        "JOB_NAME",
+        "output_path",
+        "database_name"
+    ]
+)
+
+optional_args = get_optional_args(
+    sys.argv,
+    {
+        "tables": "cloudtrail_events",
+        "strategy": "binpack",
+        "sort_order": "",
+        "sort_tables": "cloudtrail_events",
+        "target_file_size_bytes": str(256 * 1024 * 1024),
+        "min_input_files": "5",
+        "lookback_days": "3",
+        "rewrite_all": "false",
+        "rewrite_manifests": "true"
+    }
+)
+
+database_name = args["database_name"]
+logging_bucket_name = args["output_path"].split("/")[2]
+strategy = optional_args["strategy"].lower()
+if strategy not in ("binpack", "sort"):
+    logger.error(f"Unsupported strategy: {strategy}")
+    raise ValueError(f"Unsupported strategy: {strategy}")
+rewrite_options = {
+    "target-file-size-bytes": optional_args["target_file_size_bytes"],
+    "min-input-files": optional_args["min_input_files"],
+    "partial-progress.enabled": "true"
+}
+if optional_args["rewrite_all"].lower() == "true":
+    # Rewrite every file in scope, e.g. to add bloom filters and the sort order to old files
+    rewrite_options["rewrite-all"] = "true"
+
+spark = create_spark_session(GlueCatalogBackend(f"s3://{logging_bucket_name}/glue_job_tmp/"))
+glueContext = GlueContext(spark.sparkContext)
+job = Job(glueContext)
+job.init(args["JOB_NAME"], args)
+
+# Only tables with a declared write order can be sort-rewritten, the rest are bin-packed
+sort_tables = {t.strip() for t in optional_args["sort_tables"].split(",") if t.strip()}
+
+reports = []
+for table_name in [t.strip() for t in optional_args["tables"].split(",") if t.strip()]:
+    table_fqn = f"glue_catalog.{database_name}.{table_name}"
+    try:
+        reports.append(
+            maintain_table(
+                spark,
+                table_fqn,
+                strategy if table_name in sort_tables else "binpack",
+                optional_args["sort_order"],
+                rewrite_options,
+                int(optional_args["lookback_days"]),
+                optional_args["rewrite_manifests"].lower() == "true"
+            )
+        )
+    except Exception as e:
+        logger.error(f"Maintenance failed for {table_fqn}: {e}")
+        raise
+
+for report in reports:
+    logger.info(
+        f"{report['table']}: files {report['files_before']['files']} -> {report['files_after']['files']}, "
+        f"manifests {report['manifests_before']} -> {report['manifests_after']} in {report['duration_seconds']}s"
+    )
+job.commit()
@@ -0,0 +1,221 @@
+import json
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import boto3
+
+# DynamoDB table holding one item per finished Glue run; RUN_HISTORY_PATH switches to a local JSONL file
+RUN_HISTORY_TABLE = os.environ.get("RUN_HISTORY_TABLE", "")
+RUN_HISTORY_PATH = os.environ.get("RUN_HISTORY_PATH", "")
+HISTORY_LIMIT = int(os.environ.get("HISTORY_LIMIT", "200"))
+# A worker type needs at least this many recorded runs before its own model replaces the prior
+MIN_RUNS_FOR_FIT = int(os.environ.get("MIN_RUNS_FOR_FIT", "5"))
+TARGET_RUNTIME_SECONDS = int(os.environ.get("TARGET_RUNTIME_SECONDS", "900"))
+MIN_WORKERS = int(os.environ.get("MIN_WORKERS", "2"))
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "50"))
+WORKER_TYPES = [
+    t.strip() for t in os.environ.get("WORKER_TYPES", "G.1X,G.2X").split(",") if t.strip()
+]
+
+DPU_PER_WORKER = {"G.1X": 1, "G.2X": 2, "G.4X": 4, "G.8X": 8}
+# Coefficients used until a worker type has enough history:
+# seconds = startup + per_byte * bytes / workers + per_file * files / workers
+PRIOR_COEFFICIENTS = {
+    "G.1X": (120.0, 60.0 / 1024**3, 0.05),
+    "G.2X": (120.0, 30.0 / 1024**3, 0.025),
+    "G.4X": (120.0, 15.0 / 1024**3, 0.0125),
+    "G.8X": (120.0, 7.5 / 1024**3, 0.00625),
+}
+
+
+def lambda_handler(event, context):
+    """
+    Choose the Glue worker type and count for a batch, and record how finished runs performed.
+    {"action": "recommend", "job_name", "total_bytes", "file_count"} fits, per worker type,
+    seconds = startup + per_byte * bytes / workers + per_file * files / workers on the recorded
+    runs and returns the cheapest configuration (in DPU-hours) predicted to finish within
+    TARGET_RUNTIME_SECONDS.
+    {"action": "record", "job_name", "job_run_id", "worker_type", "number_of_workers",
+    "execution_time", "total_bytes", "file_count"} stores a successful run.
+    """
+    action = event.get("action", "recommend")
+    job_name = event["job_name"]
+    store = create_store()
+
+    if action == "record":
+        try:
+            run = {
+                "job_name": job_name,
+                "job_run_id": event["job_run_id"],
+                "worker_type": event["worker_type"],
+                "number_of_workers": int(event["number_of_workers"]),
+                "execution_time": int(event["execution_time"]),
+                "total_bytes": int(event.get("total_bytes", 0) or 0),
+                "file_count": int(event.get("file_count", 0) or 0),
+                "recorded_at": datetime.now(timezone.utc).isoformat(),
+            }
+            store.record(run)
+            print(f"recorded run: {run}")
+            return {"statusCode": 200, "recorded": run}
+        except Exception as e:
+            print(f"Error recording run: {str(e)}")
+            return {"statusCode": 500, "error": str(e)}
+
+    total_bytes = int(event.get("total_bytes", 0) or 0)
+    file_count = int(event.get("file_count", 0) or 0)
+    try:
+        runs = store.recent_runs(job_name, HISTORY_LIMIT)
+    except Exception as e:
+        # Sizing must never block ingestion, the priors still give a sensible answer
+        print(f"Error loading run history, using priors: {str(e)}")
+        runs = []
+
+    models = fit_models(runs)
+    recommendation = recommend(models, total_bytes, file_count)
+    print(
+        f"recommended {recommendation} for {total_bytes} bytes, {file_count} files "
+        f"from {len(runs)} recorded runs"
+    )
+    return {"statusCode": 200, **recommendation}
+
+
+class DynamoDBRunHistoryStore:
+    """Runs keyed by job_name (partition) and recorded_at (sort)."""
+
+    def __init__(self, table_name: str):
+        self.table_name = table_name
+        self.client = boto3.client("dynamodb")
+
+    def record(self, run: Dict):
+        item = {
+            key: {"N": str(value)} if isinstance(value, int) else {"S": str(value)}
+            for key, value in run.items()
+        }
+        self.client.put_item(TableName=self.table_name, Item=item)
+
+    def recent_runs(self, job_name: str, limit: int) -> List[Dict]:
+        response = self.client.query(
+            TableName=self.table_name,
+            KeyConditionExpression="job_name = :job_name",
+            ExpressionAttributeValues={":job_name": {"S": job_name}},
+            ScanIndexForward=False,
+            Limit=limit,
+        )
+        return [
+            {
+                key: int(value["N"]) if "N" in value else value["S"]
+                for key, value in item.items()
+            }
+            for item in response.get("Items", [])
+        ]
+
+
+class FileRunHistoryStore:
+    """Runs appended to a local JSON lines file, for running the sizing logic off AWS."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def record(self, run: Dict):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(run) + "\n")
+
+    def recent_runs(self, job_name: str, limit: int) -> List[Dict]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            runs = [json.loads(line) for line in f if line.strip()]
+        runs = [run for run in runs if run["job_name"] == job_name]
+        return sorted(runs, key=lambda run: run["recorded_at"], reverse=True)[:limit]
+
+
+def create_store():
+    if RUN_HISTORY_PATH:
+        return FileRunHistoryStore(RUN_HISTORY_PATH)
+    return DynamoDBRunHistoryStore(RUN_HISTORY_TABLE)
+
+
+def features(total_bytes: int, file_count: int, workers: int) -> List[float]:
+    return [1.0, total_bytes / workers, file_count / workers]
+
+
+def solve_least_squares(rows: List[List[float]], targets: List[float]) -> Optional[List[float]]:
+    """Solve the normal equations with Gaussian elimination; None when they are singular."""
+    size = len(rows[0])
+    matrix = [
+        [sum(row[i] * row[j] for row in rows) for j in range(size)]
+        + [sum(row[i] * target for row, target in zip(rows, targets))]
+        for i in range(size)
+    ]
+    for column in range(size):
+        pivot = max(range(column, size), key=lambda r: abs(matrix[r][column]))
+        if abs(matrix[pivot][column]) < 1e-12:
+            return None
+        matrix[column], matrix[pivot] = matrix[pivot], matrix[column]
+        for r in range(size):
+            if r != column:
+                factor = matrix[r][column] / matrix[column][column]
+                matrix[r] = [a - factor * b for a, b in zip(matrix[r], matrix[column])]
+    return [matrix[i][size] / matrix[i][i] for i in range(size)]
+
+
+def fit_models(runs: List[Dict]) -> Dict[str, Dict]:
+    """
+    Coefficients per worker type. Types with too little history, or whose fit is
+    degenerate (a negative coefficient), keep the prior.
+    """
+    models = {}
+    for worker_type in WORKER_TYPES:
+        typed = [run for run in runs if run["worker_type"] == worker_type]
+        coefficients = None
+        if len(typed) >= MIN_RUNS_FOR_FIT:
+            coefficients = solve_least_squares(
+                [
+                    features(run["total_bytes"], run["file_count"], run["number_of_workers"])
+                    for run in typed
+                ],
+                [float(run["execution_time"]) for run in typed],
+            )
+            if coefficients is not None and min(coefficients) < 0:
+                coefficients = None
+        models[worker_type] = {
+            "coefficients": coefficients or list(PRIOR_COEFFICIENTS[worker_type]),
+            "source": "history" if coefficients else "prior",
+            "runs": len(typed),
+        }
+    return models
+
+
+def recommend(models: Dict[str, Dict], total_bytes: int, file_count: int) -> Dict:
+    """
+    The predicted runtime falls with workers while DPU-hours grow with them, so per worker
+    type the cheapest count is the smallest one that meets the target. Across types the
+    lowest DPU-hours wins; if nothing meets the target, the fastest configuration is used.
+    """
+    candidates = []
+    for worker_type, model in models.items():
+        for workers in range(MIN_WORKERS, MAX_WORKERS + 1):
+            seconds = sum(
+                c * x
+                for c, x in zip(model["coefficients"], features(total_bytes, file_count, workers))
+            )
+            if seconds <= TARGET_RUNTIME_SECONDS or workers == MAX_WORKERS:
+                candidates.append(
+                    {
+                        "worker_type": worker_type,
+                        "number_of_workers": workers,
+                        "predicted_seconds": round(seconds, 1),
+                        "predicted_dpu_hours": round(
+                            workers * DPU_PER_WORKER[worker_type] * seconds / 3600, 3
+                        ),
+                        "model_source": model["source"],
+                        "meets_target": seconds <= TARGET_RUNTIME_SECONDS,
+                    }
+                )
+                break
+
+    meeting = [c for c in candidates if c["meets_target"]]
+    if meeting:
+        return min(meeting, key=lambda c: c["predicted_dpu_hours"])
+    return min(candidates, key=lambda c: c["predicted_seconds"])
@@ -1,46 +1,410 @@
-from typing import List
+import csv
+import gzip
+import io
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from urllib.parse import unquote
 
 import boto3
+from botocore.config import Config
 
-s3_client = boto3.client("s3")
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "16"))
+# Days before the watermark that are listed again to pick up late CloudTrail deliveries
+LOOKBACK_DAYS = int(os.environ.get("LOOKBACK_DAYS", "1"))
+WATERMARK_KEY = os.environ.get(
+    "WATERMARK_KEY", "glue_job_tmp/discovery/day_prefix_watermarks.json"
+)
+# s3://bucket/.../manifest.json of a CSV S3 Inventory report; sizes come from it when set
+INVENTORY_MANIFEST_URI = os.environ.get("INVENTORY_MANIFEST_URI", "")
+# With a discovery_id the sized prefixes and watermarks go to {DISCOVERY_KEY_PREFIX}/{discovery_id}.json
+# instead of the response, which stays small however many accounts an organization trail covers
+DISCOVERY_KEY_PREFIX = os.environ.get("DISCOVERY_KEY_PREFIX", "glue_job_tmp/discovery/runs")
+# A day prefix whose newest object is older than its shard's LastModified high-water mark minus
+# this margin was fully listed by the last successful run; the margin covers objects whose
+# upload had started, and so LastModified was set, but not completed when that run listed
+MODIFIED_GRACE_SECONDS = int(os.environ.get("MODIFIED_GRACE_SECONDS", "900"))
+
+ORG_ID_PATTERN = re.compile(r"^o-[a-z0-9]{10,32}$")
+ACCOUNT_ID_PATTERN = re.compile(r"^\d{12}$")
+# Key below base_prefix: [[o-xxxx/]{account}/CloudTrail/]{region}/YYYY/MM/DD/{file}
+LOG_KEY_PATTERN = re.compile(
+    r"^(?P<shard>(?:(?:o-[a-z0-9]{10,32}/)?\d{12}/CloudTrail/)?[a-z0-9-]+)/(?P<day>\d{4}/\d{2}/\d{2})/[^/]+$"
+)
+ACCOUNT_PATTERN = re.compile(r"AWSLogs/(?:o-[a-z0-9]{10,32}/)?(\d{12})/CloudTrail/([a-z0-9-]+)/")
+
+s3_client = boto3.client("s3", config=Config(max_pool_connections=MAX_WORKERS))
 
 
 def lambda_handler(event, context):
     """
-    Recursively list all day-level prefixes in CloudTrail logs structure.
+    Find the day-level prefixes that can have changed since the last successful run and size
+    them in the same pass.
     Expected structure: raw-cloudtrail-logs/AWSLogs/{account}/CloudTrail/{region}/{year}/{month}/{day}/
+    or, for an organization trail, raw-cloudtrail-logs/AWSLogs/{o-xxxx}/{account}/CloudTrail/...
+    base_prefix is either one account's CloudTrail/ prefix or the AWSLogs/ prefix, below which
+    every account and organization is discovered.
+    A watermark per shard, the region prefix relative to base_prefix (e.g. "us-east-1" or
+    "o-xxxx/{account}/CloudTrail/us-east-1"), is kept in s3://{bucket_name}/{WATERMARK_KEY}.
+    Years and months at or after watermark - LOOKBACK_DAYS are found with delimiter listings,
+    then every such month is listed flat, concurrently, which yields the object count, bytes
+    and newest LastModified of each day prefix without one listing per prefix. With an
+    inventory_manifest (or INVENTORY_MANIFEST_URI) the sizes are read from S3 Inventory instead.
+    Each shard also keeps the newest LastModified seen, and day prefixes in the lookback window
+    whose newest object is not past it (less MODIFIED_GRACE_SECONDS) are dropped as unchanged.
+    The new watermarks are returned and only persisted by a later {"action": "commit"} call
+    once the run has succeeded. With a discovery_id, prefix_sizes and watermarks are written to
+    S3 and only their discovery_manifest URI is returned, for the planner and the commit to read.
     """
     bucket_name = event["bucket_name"]
     base_prefix = event["base_prefix"]
-
-    day_prefixes = []
+    action = event.get("action", "discover")
 
     try:
-        # Get all regions
-        regions = list_prefixes(bucket_name, base_prefix)
-
-        for region_prefix in regions:
-            # Get all years for this region
-            years = list_prefixes(bucket_name, region_prefix)
+        if action == "commit":
+            watermarks = event.get("watermarks")
+            modified_watermarks = event.get("modified_watermarks")
+            if watermarks is None and event.get("discovery_manifest"):
+                discovery = read_json(event["discovery_manifest"])
+                watermarks = discovery.get("watermarks", {})
+                modified_watermarks = discovery.get("modified_watermarks", {})
+            committed = commit_watermarks(bucket_name, base_prefix, watermarks or {}, modified_watermarks or {})
+            return {"statusCode": 200, "committed_watermarks": committed}
 
-            for year_prefix in years:
-                # Get all months for this year
-                months = list_prefixes(bucket_name, year_prefix)
+        if event.get("full_scan"):
+            stored, stored_modified = {}, {}
+        else:
+            stored, stored_modified = load_watermarks(bucket_name, base_prefix)
+        inventory_manifest = event.get("inventory_manifest", INVENTORY_MANIFEST_URI)
+        if inventory_manifest:
+            sizes = size_from_inventory(inventory_manifest, base_prefix, stored)
+        else:
+            sizes = size_by_listing(bucket_name, base_prefix, stored)
 
-                for month_prefix in months:
-                    # Get all days for this month
-                    days = list_prefixes(bucket_name, month_prefix)
-                    day_prefixes.extend(days)
+        modified_watermarks = dict(stored_modified)
+        prefix_sizes = []
+        unchanged = 0
+        for prefix in sorted(sizes):
+            item = sizes[prefix]
+            shard, _ = split_day_prefix(base_prefix, prefix)
+            newest = parse_modified(item["newest_last_modified"])
+            stored_mark = stored_modified.get(shard)
+            if stored_mark and newest <= parse_modified(stored_mark) - timedelta(seconds=MODIFIED_GRACE_SECONDS):
+                unchanged += 1
+                continue
+            prefix_sizes.append(item)
+            modified_watermarks[shard] = max(
+                newest, parse_modified(modified_watermarks.get(shard) or item["newest_last_modified"])
+            ).isoformat()
+        watermarks = dict(stored)
+        for item in prefix_sizes:
+            shard, day_key = split_day_prefix(base_prefix, item["prefix"])
+            watermarks[shard] = max(day_key, watermarks.get(shard, ""))
+            match = ACCOUNT_PATTERN.search(item["prefix"])
+            if match:
+                item["account_id"], item["region"] = match.groups()
+        total_files = sum(item["file_count"] for item in prefix_sizes)
+        total_bytes = sum(item["total_bytes"] for item in prefix_sizes)
+        accounts = {item.get("account_id") for item in prefix_sizes}
+        print(
+            f"sized {len(prefix_sizes)} day prefixes of {len(accounts)} accounts "
+            f"({total_files} files, {total_bytes} bytes), {len(watermarks)} shard watermarks, "
+            f"{unchanged} unchanged day prefixes dropped"
+        )
 
-        return {
+        result = {
             "statusCode": 200,
-            "day_prefixes": day_prefixes,
-            "total_count": len(day_prefixes),
+            "total_count": len(prefix_sizes),
+            "total_accounts": len(accounts),
+            "total_files": total_files,
+            "total_bytes": total_bytes,
+            "unchanged_count": unchanged,
+        }
+        if event.get("discovery_id"):
+            key = f"{DISCOVERY_KEY_PREFIX}/{event['discovery_id']}.json"
+            s3_client.put_object(
+                Bucket=bucket_name,
+                Key=key,
+                Body=json.dumps(
+                    {
+                        "prefix_sizes": prefix_sizes,
+                        "watermarks": watermarks,
+                        "modified_watermarks": modified_watermarks,
+                    }
+                ).encode("utf-8"),
+                ContentType="application/json",
+            )
+            return {**result, "discovery_manifest": f"s3://{bucket_name}/{key}"}
+        return {
+            **result,
+            "day_prefixes": [item["prefix"] for item in prefix_sizes],
+            "prefix_sizes": prefix_sizes,
+            "watermarks": watermarks,
+            "modified_watermarks": modified_watermarks,
         }
 
     except Exception as e:
         print(f"Error listing prefixes: {str(e)}")
-        return {"statusCode": 500, "error": str(e), "day_prefixes": []}
+        return {
+            "statusCode": 500,
+            "error": str(e),
+            "day_prefixes": [],
+            "prefix_sizes": [],
+            "total_count": 0,
+        }
+
+
+def read_json(uri: str) -> Dict:
+    bucket, _, key = uri.replace("s3://", "", 1).partition("/")
+    return json.loads(s3_client.get_object(Bucket=bucket, Key=key)["Body"].read())
+
+
+def parse_modified(value: str) -> datetime:
+    """LastModified from a listing (isoformat) or an inventory report (...Z) as an aware datetime."""
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(timezone.utc)
+
+
+def load_watermarks(bucket: str, base_prefix: str):
+    """
+    Day and LastModified watermarks stored for base_prefix. Those stored for a narrower
+    base_prefix below it, e.g. a single account's CloudTrail/ prefix before discovery moved up
+    to AWSLogs/, are carried over under their shard key so widening base_prefix does not list
+    every account from the start.
+    """
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=WATERMARK_KEY)["Body"].read()
+    except s3_client.exceptions.NoSuchKey:
+        return {}, {}
+    document = json.loads(body)
+    watermarks = {}
+    modified_watermarks = {}
+    for stored_prefix, entry in document.items():
+        if stored_prefix == base_prefix or not stored_prefix.startswith(base_prefix):
+            continue
+        for shard, watermark in entry.get("regions", {}).items():
+            shard_key = f"{stored_prefix[len(base_prefix):]}{shard}"
+            watermarks[shard_key] = max(watermark, watermarks.get(shard_key, ""))
+        # Only one base_prefix can cover a shard at a time, so no two marks need merging
+        for shard, modified in entry.get("last_modified", {}).items():
+            modified_watermarks[f"{stored_prefix[len(base_prefix):]}{shard}"] = modified
+    watermarks.update(document.get(base_prefix, {}).get("regions", {}))
+    modified_watermarks.update(document.get(base_prefix, {}).get("last_modified", {}))
+    return watermarks, modified_watermarks
+
+
+def commit_watermarks(
+    bucket: str, base_prefix: str, watermarks: Dict[str, str], modified_watermarks: Dict[str, str]
+) -> Dict[str, str]:
+    """Merge the watermarks of a successful run into the stored ones, never moving one back."""
+    try:
+        document = json.loads(
+            s3_client.get_object(Bucket=bucket, Key=WATERMARK_KEY)["Body"].read()
+        )
+    except s3_client.exceptions.NoSuchKey:
+        document = {}
+    shards = document.setdefault(base_prefix, {}).setdefault("regions", {})
+    for shard, watermark in watermarks.items():
+        shards[shard] = max(watermark, shards.get(shard, ""))
+    modified_shards = document[base_prefix].setdefault("last_modified", {})
+    for shard, modified in modified_watermarks.items():
+        if shard not in modified_shards or parse_modified(modified) > parse_modified(modified_shards[shard]):
+            modified_shards[shard] = modified
+    document[base_prefix]["updated_at"] = datetime.now(timezone.utc).isoformat()
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=WATERMARK_KEY,
+        Body=json.dumps(document).encode("utf-8"),
+        ContentType="application/json",
+    )
+    print(f"committed {len(shards)} shard watermarks for {base_prefix}")
+    return shards
+
+
+def lower_bound(watermark: Optional[str]) -> Optional[str]:
+    """First day to list for a shard, as YYYY/MM/DD, or None to list everything."""
+    if not watermark:
+        return None
+    start = datetime.strptime(watermark, "%Y/%m/%d") - timedelta(days=LOOKBACK_DAYS)
+    return start.strftime("%Y/%m/%d")
+
+
+def at_or_after(bound: Optional[str], parts: List[str]) -> bool:
+    if bound is None:
+        return True
+    value = "/".join(parts)
+    return value >= bound[: len(value)]
+
+
+def prefix_part(prefix: str) -> str:
+    return prefix.rstrip("/").rsplit("/", 1)[-1]
+
+
+def split_day_prefix(base_prefix: str, day_prefix: str):
+    """("us-east-1", "2024/05/01") for base_prefix + "us-east-1/2024/05/01/", the shard being
+    everything between base_prefix and the day, e.g. "o-xxxx/{account}/CloudTrail/us-east-1"."""
+    parts = day_prefix[len(base_prefix):].rstrip("/").split("/")
+    return "/".join(parts[:-3]), "/".join(parts[-3:])
+
+
+def shard_key(base_prefix: str, region_prefix: str) -> str:
+    return region_prefix[len(base_prefix):].rstrip("/")
+
+
+def list_trail_roots(bucket: str, base_prefix: str) -> List[str]:
+    """
+    The {account}/CloudTrail/ prefixes below base_prefix: base_prefix itself when it already is
+    one, otherwise every account directly below it and below each organization ID.
+    """
+    if base_prefix.endswith("/CloudTrail/"):
+        return [base_prefix]
+    roots = []
+    for child in list_prefixes(bucket, base_prefix):
+        name = prefix_part(child)
+        if ORG_ID_PATTERN.match(name):
+            roots.extend(
+                f"{account}CloudTrail/"
+                for account in list_prefixes(bucket, child)
+                if ACCOUNT_ID_PATTERN.match(prefix_part(account))
+            )
+        elif ACCOUNT_ID_PATTERN.match(name):
+            roots.append(f"{child}CloudTrail/")
+    return roots
+
+
+def add_object(sizes: Dict[str, Dict], day_prefix: str, size: int, last_modified: str):
+    entry = sizes.setdefault(
+        day_prefix,
+        {"prefix": day_prefix, "file_count": 0, "total_bytes": 0, "newest_last_modified": ""},
+    )
+    entry["file_count"] += 1
+    entry["total_bytes"] += size
+    entry["newest_last_modified"] = max(entry["newest_last_modified"], last_modified)
+
+
+def merge_sizes(target: Dict[str, Dict], source: Dict[str, Dict]):
+    for day_prefix, entry in source.items():
+        existing = target.get(day_prefix)
+        if existing is None:
+            target[day_prefix] = entry
+            continue
+        existing["file_count"] += entry["file_count"]
+        existing["total_bytes"] += entry["total_bytes"]
+        existing["newest_last_modified"] = max(
+            existing["newest_last_modified"], entry["newest_last_modified"]
+        )
+
+
+def size_by_listing(bucket: str, base_prefix: str, stored: Dict[str, str]) -> Dict[str, Dict]:
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+
+        def list_level(parents):
+            return [
+                (parent, child)
+                for parent, children in zip(
+                    parents, executor.map(lambda p: list_prefixes(bucket, p[1]), parents)
+                )
+                for child in children
+            ]
+
+        # Accounts are listed per organization, their regions concurrently
+        roots = list_trail_roots(bucket, base_prefix)
+        regions = [region for _, region in list_level([(root, root) for root in roots])]
+        shards = [(shard_key(base_prefix, r), r) for r in regions]
+        bounds = {shard: lower_bound(stored.get(shard)) for shard, _ in shards}
+        years = [
+            (shard, year)
+            for (shard, _), year in list_level(shards)
+            if at_or_after(bounds[shard], [prefix_part(year)])
+        ]
+        months = [
+            (shard, month)
+            for (shard, year), month in list_level(years)
+            if at_or_after(bounds[shard], [prefix_part(year), prefix_part(month)])
+        ]
+
+        def size_month(item):
+            shard, month_prefix = item
+            bound = bounds[shard]
+            # Keys sort by day, so the listing can start right at the first day that matters
+            start_after = None
+            if bound is not None and month_prefix.endswith(f"{bound[:7]}/"):
+                start_after = f"{base_prefix}{shard}/{bound}"
+            return size_month_prefix(bucket, month_prefix, start_after)
+
+        sizes = {}
+        for month_sizes in executor.map(size_month, months):
+            merge_sizes(sizes, month_sizes)
+    return sizes
+
+
+def size_month_prefix(bucket: str, month_prefix: str, start_after: Optional[str]) -> Dict[str, Dict]:
+    sizes = {}
+    paginator = s3_client.get_paginator("list_objects_v2")
+    params = {"Bucket": bucket, "Prefix": month_prefix}
+    if start_after:
+        params["StartAfter"] = start_after
+    for page in paginator.paginate(**params):
+        for obj in page.get("Contents", []):
+            day, separator, name = obj["Key"][len(month_prefix):].partition("/")
+            if not separator or not name:
+                continue
+            add_object(
+                sizes,
+                f"{month_prefix}{day}/",
+                obj["Size"],
+                obj["LastModified"].astimezone(timezone.utc).isoformat(),
+            )
+    return sizes
+
+
+def size_from_inventory(manifest_uri: str, base_prefix: str, stored: Dict[str, str]) -> Dict[str, Dict]:
+    """
+    Size day prefixes from a CSV S3 Inventory report instead of listing the bucket.
+    The report must include the Size and LastModifiedDate fields. Objects delivered after
+    the report was generated are not counted, but the Glue job lists each prefix itself,
+    so they are still ingested.
+    """
+    bucket, _, key = manifest_uri.replace("s3://", "", 1).partition("/")
+    manifest = json.loads(s3_client.get_object(Bucket=bucket, Key=key)["Body"].read())
+    if manifest.get("fileFormat", "CSV").upper() != "CSV":
+        raise ValueError(f"Unsupported inventory format: {manifest.get('fileFormat')}")
+    columns = [name.strip() for name in manifest["fileSchema"].split(",")]
+    key_index = columns.index("Key")
+    size_index = columns.index("Size")
+    modified_index = columns.index("LastModifiedDate")
+    bounds = {shard: lower_bound(watermark) for shard, watermark in stored.items()}
+    # destinationBucket is an ARN, arn:aws:s3:::bucket
+    inventory_bucket = manifest["destinationBucket"].split(":::")[-1]
+
+    def size_file(file_entry):
+        sizes = {}
+        body = s3_client.get_object(Bucket=inventory_bucket, Key=file_entry["key"])["Body"].read()
+        for row in csv.reader(io.StringIO(gzip.decompress(body).decode("utf-8"))):
+            object_key = unquote(row[key_index])
+            if not object_key.startswith(base_prefix):
+                continue
+            match = LOG_KEY_PATTERN.match(object_key[len(base_prefix):])
+            if not match:
+                continue
+            shard, day = match.group("shard", "day")
+            if not at_or_after(bounds.get(shard), day.split("/")):
+                continue
+            add_object(
+                sizes,
+                f"{base_prefix}{shard}/{day}/",
+                int(row[size_index] or 0),
+                row[modified_index],
+            )
+        return sizes
+
+    sizes = {}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for file_sizes in executor.map(size_file, manifest.get("files", [])):
+            merge_sizes(sizes, file_sizes)
+    return sizes
 
 
 def list_prefixes(bucket: str, prefix: str) -> List[str]:
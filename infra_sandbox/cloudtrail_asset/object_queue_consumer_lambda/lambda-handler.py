@@ -0,0 +1,384 @@
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+from urllib.parse import unquote_plus
+
+import boto3
+
+QUEUE_URL = os.environ.get("QUEUE_URL", "")
+GLUE_JOB_NAME = os.environ.get("GLUE_JOB_NAME", "infra_glue_fast_ingest_cloudtrail_logs")
+# Refreshes the derived tables for the region-days fast ingest runs left under DERIVED_REFRESH_PREFIX
+COMMIT_JOB_NAME = os.environ.get("COMMIT_JOB_NAME", "infra_glue_commit_cloudtrail_events")
+BUCKET_NAME = os.environ.get("BUCKET_NAME", "")
+DERIVED_REFRESH_PREFIX = os.environ.get("DERIVED_REFRESH_PREFIX", "glue_job_tmp/derived_refresh/")
+MANIFEST_KEY_PREFIX = os.environ.get("MANIFEST_KEY_PREFIX", "glue_job_tmp/micro_batches")
+MAX_BATCH_FILES = int(os.environ.get("MAX_BATCH_FILES", "2000"))
+MAX_BATCH_BYTES = int(os.environ.get("MAX_BATCH_BYTES", str(128 * 1024 * 1024)))
+# A window is flushed once it has this many objects or its oldest object has waited this long
+MIN_BATCH_FILES = int(os.environ.get("MIN_BATCH_FILES", "200"))
+MAX_WAIT_SECONDS = int(os.environ.get("MAX_WAIT_SECONDS", "600"))
+# Upper bound on Glue runs, and so on commits to cloudtrail_events, per invocation
+MAX_BATCHES_PER_RUN = int(os.environ.get("MAX_BATCHES_PER_RUN", "4"))
+METRIC_NAMESPACE = os.environ.get("METRIC_NAMESPACE", "CloudTrailPipeline")
+# Batches whose job run has not succeeded yet; their messages are already deleted from the queue
+IN_FLIGHT_PREFIX = os.environ.get("IN_FLIGHT_PREFIX", "glue_job_tmp/micro_batches/in_flight")
+# A batch whose runs failed this many times is sent to the dead-letter queue instead of rerun
+MAX_BATCH_ATTEMPTS = int(os.environ.get("MAX_BATCH_ATTEMPTS", "3"))
+DEAD_LETTER_QUEUE_URL = os.environ.get("DEAD_LETTER_QUEUE_URL", "")
+FAILED_RUN_STATES = {"FAILED", "ERROR", "TIMEOUT", "STOPPED"}
+
+
+def lambda_handler(event, context):
+    """
+    Turn the S3 ObjectCreated notifications queued for raw-cloudtrail-logs/ into micro-batches.
+    Runs on a schedule. Each run drains the queue, and when enough objects have arrived or the
+    oldest one has waited MAX_WAIT_SECONDS, cuts them into batches of at most MAX_BATCH_FILES
+    objects and MAX_BATCH_BYTES. For each batch it writes a key manifest to
+    s3://{bucket}/{MANIFEST_KEY_PREFIX}/ and starts the fast ingest job with --key_manifest.
+    Messages are released if the job run does not start. Once it has, the batch is recorded under
+    s3://{bucket}/{IN_FLIGHT_PREFIX}/ before its messages are deleted, and every later run checks
+    it: a failed run is started again on the same key manifest, and after MAX_BATCH_ATTEMPTS
+    the batch is sent to the dead-letter queue. So an object is ingested at least once or ends
+    up in the dead-letter queue; the processed-objects manifest drops repeats.
+    Fast ingest runs leave the derived refresh of the region-days they wrote to the commit
+    coordinator, so each run also starts it while refreshes are pending.
+    """
+    queue = SqsQueue(QUEUE_URL)
+    s3_client = boto3.client("s3")
+    glue_client = boto3.client("glue")
+
+    def submit_batch(batch: Dict) -> bool:
+        bucket = batch["bucket"]
+        manifest_key = f"{MANIFEST_KEY_PREFIX}/{batch['batch_id']}.json"
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=manifest_key,
+            Body=json.dumps(batch).encode("utf-8"),
+            ContentType="application/json",
+        )
+        try:
+            response = glue_client.start_job_run(
+                JobName=GLUE_JOB_NAME,
+                Arguments={
+                    "--key_manifest": f"s3://{bucket}/{manifest_key}",
+                    "--ingest_mode": "event-driven",
+                },
+            )
+        except glue_client.exceptions.ConcurrentRunsExceededException:
+            print(f"{GLUE_JOB_NAME} is at its concurrency limit, keeping {batch['batch_id']} queued")
+            return False
+        record_in_flight(
+            s3_client,
+            bucket,
+            {
+                "batch_id": batch["batch_id"],
+                "key_manifest": f"s3://{bucket}/{manifest_key}",
+                "job_run_id": response["JobRunId"],
+                "attempts": 1,
+            },
+        )
+        print(f"started {response['JobRunId']} for {batch['batch_id']}: {len(batch['objects'])} objects")
+        return True
+
+    def start_derived_refresh():
+        pending = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=DERIVED_REFRESH_PREFIX, MaxKeys=1)
+        if not pending.get("KeyCount"):
+            return
+        try:
+            # Skips retention, which the weekly orchestrator run applies
+            response = glue_client.start_job_run(
+                JobName=COMMIT_JOB_NAME,
+                Arguments={"--run_retention": "false"},
+            )
+        except glue_client.exceptions.ConcurrentRunsExceededException:
+            # The run in progress, or the next tick, picks the pending refreshes up
+            print(f"{COMMIT_JOB_NAME} is already running, leaving the derived refreshes pending")
+            return
+        print(f"started {response['JobRunId']} of {COMMIT_JOB_NAME} for the pending derived refreshes")
+
+    try:
+        remaining_ms = context.get_remaining_time_in_millis if context else None
+        summary = consume(queue, submit_batch, remaining_ms=remaining_ms)
+        if BUCKET_NAME:
+            summary.update(reconcile_in_flight(s3_client, glue_client, boto3.client("sqs"), BUCKET_NAME))
+            start_derived_refresh()
+        return {"statusCode": 200, **summary}
+    except Exception as e:
+        print(f"Error consuming object queue: {str(e)}")
+        return {"statusCode": 500, "error": str(e)}
+
+
+class SqsQueue:
+    def __init__(self, queue_url: str):
+        self.queue_url = queue_url
+        self.client = boto3.client("sqs")
+
+    def receive(self, max_messages: int = 10) -> List[Dict]:
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=max_messages,
+            WaitTimeSeconds=1,
+        )
+        return [
+            {"receipt_handle": m["ReceiptHandle"], "body": m["Body"]}
+            for m in response.get("Messages", [])
+        ]
+
+    def delete(self, receipt_handles: List[str]):
+        for start in range(0, len(receipt_handles), 10):
+            self.client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {"Id": str(i), "ReceiptHandle": handle}
+                    for i, handle in enumerate(receipt_handles[start:start + 10])
+                ],
+            )
+
+    def release(self, receipt_handles: List[str]):
+        """Make the messages visible again right away instead of after the visibility timeout."""
+        for start in range(0, len(receipt_handles), 10):
+            self.client.change_message_visibility_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {"Id": str(i), "ReceiptHandle": handle, "VisibilityTimeout": 0}
+                    for i, handle in enumerate(receipt_handles[start:start + 10])
+                ],
+            )
+
+
+class LocalQueue:
+    """In-memory stand-in for SqsQueue with the same receive/delete/release semantics."""
+
+    def __init__(self):
+        self.messages = {}
+        self.in_flight = set()
+
+    def send(self, body: str) -> str:
+        receipt_handle = str(uuid.uuid4())
+        self.messages[receipt_handle] = body
+        return receipt_handle
+
+    def receive(self, max_messages: int = 10) -> List[Dict]:
+        visible = [h for h in self.messages if h not in self.in_flight][:max_messages]
+        self.in_flight.update(visible)
+        return [{"receipt_handle": h, "body": self.messages[h]} for h in visible]
+
+    def delete(self, receipt_handles: List[str]):
+        for handle in receipt_handles:
+            self.messages.pop(handle, None)
+            self.in_flight.discard(handle)
+
+    def release(self, receipt_handles: List[str]):
+        self.in_flight.difference_update(receipt_handles)
+
+
+def record_in_flight(s3_client, bucket: str, record: Dict):
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=f"{IN_FLIGHT_PREFIX}/{record['batch_id']}.json",
+        Body=json.dumps(record).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def reconcile_in_flight(s3_client, glue_client, sqs_client, bucket: str) -> Dict:
+    """
+    Check the job run of every in-flight batch. Succeeded batches are forgotten, failed ones
+    are started again on the same key manifest, or sent to the dead-letter queue once they
+    have failed MAX_BATCH_ATTEMPTS times.
+    """
+    summary = {"batches_retried": 0, "batches_dead_lettered": 0}
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=f"{IN_FLIGHT_PREFIX}/"):
+        for obj in page.get("Contents", []):
+            record = json.loads(s3_client.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read())
+            job_run = glue_client.get_job_run(JobName=GLUE_JOB_NAME, RunId=record["job_run_id"])["JobRun"]
+            state = job_run["JobRunState"]
+            if state == "SUCCEEDED":
+                s3_client.delete_object(Bucket=bucket, Key=obj["Key"])
+                continue
+            if state not in FAILED_RUN_STATES:
+                continue
+            if record["attempts"] >= MAX_BATCH_ATTEMPTS:
+                sqs_client.send_message(
+                    QueueUrl=DEAD_LETTER_QUEUE_URL,
+                    MessageBody=json.dumps({**record, "error": job_run.get("ErrorMessage", state)}),
+                )
+                s3_client.delete_object(Bucket=bucket, Key=obj["Key"])
+                print(f"{record['batch_id']} failed {record['attempts']} times, sent to the dead-letter queue")
+                summary["batches_dead_lettered"] += 1
+                continue
+            try:
+                response = glue_client.start_job_run(
+                    JobName=GLUE_JOB_NAME,
+                    Arguments={
+                        "--key_manifest": record["key_manifest"],
+                        "--ingest_mode": "event-driven",
+                    },
+                )
+            except glue_client.exceptions.ConcurrentRunsExceededException:
+                # Still recorded as failed, so the next run tries again
+                print(f"{GLUE_JOB_NAME} is at its concurrency limit, retrying {record['batch_id']} later")
+                continue
+            record_in_flight(
+                s3_client,
+                bucket,
+                {**record, "job_run_id": response["JobRunId"], "attempts": record["attempts"] + 1},
+            )
+            print(f"{record['job_run_id']} of {record['batch_id']} ended {state}, started {response['JobRunId']}")
+            summary["batches_retried"] += 1
+    return summary
+
+
+def parse_notification(body: str) -> List[Dict]:
+    """Objects created by one S3 event notification; empty for s3:TestEvent and other prefixes."""
+    objects = []
+    for record in json.loads(body).get("Records", []):
+        if not record.get("eventName", "").startswith("ObjectCreated"):
+            continue
+        s3_entity = record["s3"]
+        key = unquote_plus(s3_entity["object"]["key"])
+        # CloudTrail also delivers digest files, which are not event logs
+        if "/CloudTrail/" not in key or key.endswith("/"):
+            continue
+        objects.append(
+            {
+                "bucket": s3_entity["bucket"]["name"],
+                "key": key,
+                "etag": s3_entity["object"].get("eTag", ""),
+                "size": int(s3_entity["object"].get("size", 0)),
+                "event_time": record["eventTime"],
+            }
+        )
+    return objects
+
+
+def parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def plan_micro_batches(entries: List[Dict]) -> List[Dict]:
+    """
+    Cut the queued objects, in key order so a batch covers few day prefixes, into batches
+    capped by MAX_BATCH_FILES and MAX_BATCH_BYTES. Each entry is one message and its objects.
+    """
+    batches = []
+    current = None
+    for entry in sorted(entries, key=lambda e: min(o["key"] for o in e["objects"])):
+        entry_bytes = sum(o["size"] for o in entry["objects"])
+        if (
+            current is None
+            or len(current["objects"]) + len(entry["objects"]) > MAX_BATCH_FILES
+            or current["total_bytes"] + entry_bytes > MAX_BATCH_BYTES
+        ) and (current is None or current["objects"]):
+            current = {"objects": [], "total_bytes": 0, "receipt_handles": []}
+            batches.append(current)
+        current["objects"].extend(entry["objects"])
+        current["total_bytes"] += entry_bytes
+        current["receipt_handles"].append(entry["receipt_handle"])
+    return batches
+
+
+def consume(
+    queue,
+    submit_batch: Callable[[Dict], bool],
+    now: Optional[Callable[[], datetime]] = None,
+    remaining_ms: Optional[Callable[[], int]] = None,
+) -> Dict:
+    now = now or (lambda: datetime.now(timezone.utc))
+    entries = []
+    empty_handles = []
+    max_objects = MAX_BATCH_FILES * MAX_BATCHES_PER_RUN
+    queued_objects = 0
+    while queued_objects < max_objects:
+        # Leave time to start the jobs before the Lambda times out
+        if remaining_ms is not None and remaining_ms() < 30000:
+            break
+        messages = queue.receive(10)
+        if not messages:
+            break
+        for message in messages:
+            objects = parse_notification(message["body"])
+            if objects:
+                entries.append({"receipt_handle": message["receipt_handle"], "objects": objects})
+                queued_objects += len(objects)
+            else:
+                empty_handles.append(message["receipt_handle"])
+    if empty_handles:
+        queue.delete(empty_handles)
+
+    current_time = now()
+    object_times = [parse_time(o["event_time"]) for e in entries for o in e["objects"]]
+    oldest_age = max(((current_time - t).total_seconds() for t in object_times), default=0.0)
+    summary = {
+        "queued_objects": queued_objects,
+        "oldest_object_age_seconds": round(oldest_age, 1),
+        "batches_started": 0,
+        "batched_objects": 0,
+        "batched_bytes": 0,
+    }
+
+    if queued_objects < MIN_BATCH_FILES and oldest_age < MAX_WAIT_SECONDS:
+        queue.release([e["receipt_handle"] for e in entries])
+        print(f"holding {queued_objects} objects, oldest {oldest_age:.0f}s, until the window fills")
+        emit_metrics(summary)
+        return summary
+
+    batches = plan_micro_batches(entries)
+    for index, batch in enumerate(batches):
+        started = False
+        if index < MAX_BATCHES_PER_RUN:
+            batch_id = f"{current_time.strftime('%Y%m%dT%H%M%SZ')}-{uuid.uuid4().hex[:8]}"
+            started = submit_batch(
+                {
+                    "batch_id": batch_id,
+                    "bucket": batch["objects"][0]["bucket"],
+                    "created_at": current_time.isoformat(),
+                    "objects": [
+                        {k: o[k] for k in ("key", "etag", "size", "event_time")}
+                        for o in batch["objects"]
+                    ],
+                }
+            )
+        if started:
+            queue.delete(batch["receipt_handles"])
+            summary["batches_started"] += 1
+            summary["batched_objects"] += len(batch["objects"])
+            summary["batched_bytes"] += batch["total_bytes"]
+        else:
+            queue.release(batch["receipt_handles"])
+    print(f"micro-batch summary: {summary}")
+    emit_metrics(summary)
+    return summary
+
+
+def emit_metrics(summary: Dict):
+    """Print the summary in CloudWatch embedded metric format, which Lambda logs turn into metrics."""
+    metrics = {
+        "QueuedObjects": ("queued_objects", "Count"),
+        "OldestObjectAgeSeconds": ("oldest_object_age_seconds", "Seconds"),
+        "MicroBatchesStarted": ("batches_started", "Count"),
+        "MicroBatchObjects": ("batched_objects", "Count"),
+        "MicroBatchBytes": ("batched_bytes", "Bytes"),
+    }
+    document = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": METRIC_NAMESPACE,
+                    "Dimensions": [["IngestMode"]],
+                    "Metrics": [
+                        {"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()
+                    ],
+                }
+            ],
+        },
+        "IngestMode": "event-driven",
+    }
+    for name, (field, _) in metrics.items():
+        document[name] = summary[field]
+    print(json.dumps(document))
@@ -0,0 +1,145 @@
+import json
+import os
+import time
+from typing import Dict, List
+
+import boto3
+
+s3_client = boto3.client("s3")
+
+SUMMARY_KEY_PREFIX = os.environ.get("SUMMARY_KEY_PREFIX", "glue_job_tmp/run_summaries")
+METRIC_NAMESPACE = os.environ.get("METRIC_NAMESPACE", "CloudTrailPipeline")
+
+# Run summary fields summed across runs, with their metric name and unit
+RUN_TOTALS = {
+    "files": ("IngestedFiles", "Count"),
+    "input_bytes": ("IngestedInputBytes", "Bytes"),
+    "records": ("IngestedRecords", "Count"),
+    "corrupt_files": ("CorruptFiles", "Count"),
+    "touched_partitions": ("TouchedPartitions", "Count"),
+    "elapsed_seconds": ("RunSeconds", "Seconds"),
+}
+# Spark metrics per stage: summed, except the skew figures where the worst run is kept
+STAGE_TOTALS = {
+    "input_bytes": ("InputBytes", "Bytes"),
+    "input_records": ("InputRecords", "Count"),
+    "output_bytes": ("OutputBytes", "Bytes"),
+    "shuffle_read_bytes": ("ShuffleReadBytes", "Bytes"),
+    "shuffle_write_bytes": ("ShuffleWriteBytes", "Bytes"),
+    "memory_spilled_bytes": ("MemorySpilledBytes", "Bytes"),
+    "disk_spilled_bytes": ("DiskSpilledBytes", "Bytes"),
+    "tasks": ("Tasks", "Count"),
+}
+STAGE_MAXIMUMS = {
+    "max_task_seconds": ("MaxTaskSeconds", "Seconds"),
+    "task_skew": ("TaskSkew", "None"),
+}
+
+
+def lambda_handler(event, context):
+    """
+    Aggregate the run summaries the Glue ingest wrote for one orchestrator execution.
+    Expected event: {"bucket_name", "execution_id"}; every Map iteration's job run writes
+    s3://{bucket_name}/{SUMMARY_KEY_PREFIX}/{execution_id}/{job_run_id}.json.
+    Totals, stage seconds and Spark stage metrics are summed over the runs, printed as
+    embedded metric format records with dimension Scope=execution, and returned with the
+    stage that took the most time.
+    """
+    try:
+        bucket_name = event["bucket_name"]
+        prefix = f"{SUMMARY_KEY_PREFIX}/{event['execution_id']}/"
+        summaries = load_summaries(bucket_name, prefix)
+        aggregate = aggregate_summaries(summaries)
+        emit_metrics(aggregate)
+        print(
+            f"aggregated {aggregate['runs']} run summaries under s3://{bucket_name}/{prefix}, "
+            f"slowest stage {aggregate['slowest_stage']}"
+        )
+        return {"statusCode": 200, **aggregate}
+    except Exception as e:
+        print(f"Error aggregating run summaries: {str(e)}")
+        return {"statusCode": 500, "error": str(e)}
+
+
+def load_summaries(bucket_name: str, prefix: str) -> List[Dict]:
+    summaries = []
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if not obj["Key"].endswith(".json"):
+                continue
+            body = s3_client.get_object(Bucket=bucket_name, Key=obj["Key"])["Body"].read()
+            summaries.append(json.loads(body))
+    return summaries
+
+
+def aggregate_summaries(summaries: List[Dict]) -> Dict:
+    totals = {field: 0 for field in RUN_TOTALS}
+    stage_seconds = {}
+    spark_metrics = {}
+    for summary in summaries:
+        for field in RUN_TOTALS:
+            totals[field] += summary.get(field, 0) or 0
+        for stage, seconds in summary.get("stage_seconds", {}).items():
+            stage_seconds[stage] = round(stage_seconds.get(stage, 0.0) + seconds, 2)
+        for stage, metrics in summary.get("spark_metrics", {}).items():
+            merged = spark_metrics.setdefault(
+                stage, {field: 0 for field in {**STAGE_TOTALS, **STAGE_MAXIMUMS}}
+            )
+            for field in STAGE_TOTALS:
+                merged[field] += metrics.get(field, 0)
+            for field in STAGE_MAXIMUMS:
+                merged[field] = max(merged[field], metrics.get(field, 0))
+    return {
+        "runs": len(summaries),
+        "totals": totals,
+        "stage_seconds": stage_seconds,
+        "spark_metrics": spark_metrics,
+        "slowest_stage": max(stage_seconds, key=stage_seconds.get) if stage_seconds else None,
+    }
+
+
+def emf_document(dimensions: Dict, metrics: Dict) -> Dict:
+    document = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": METRIC_NAMESPACE,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [
+                        {"Name": name, "Unit": unit} for name, (_, unit) in metrics.items()
+                    ],
+                }
+            ],
+        },
+        **dimensions,
+    }
+    for name, (value, _) in metrics.items():
+        document[name] = value
+    return document
+
+
+def emit_metrics(aggregate: Dict):
+    """Print one record for the execution and one per stage; Lambda logs turn them into metrics."""
+    documents = [
+        emf_document(
+            {"Scope": "execution"},
+            {
+                "Runs": (aggregate["runs"], "Count"),
+                **{
+                    name: (aggregate["totals"][field], unit)
+                    for field, (name, unit) in RUN_TOTALS.items()
+                },
+            },
+        )
+    ]
+    spark_metrics = aggregate["spark_metrics"]
+    for stage in sorted(set(aggregate["stage_seconds"]) | set(spark_metrics)):
+        metrics = {"StageSeconds": (aggregate["stage_seconds"].get(stage, 0.0), "Seconds")}
+        if stage in spark_metrics:
+            for field, (name, unit) in {**STAGE_TOTALS, **STAGE_MAXIMUMS}.items():
+                metrics[name] = (spark_metrics[stage][field], unit)
+        documents.append(emf_document({"Scope": "execution", "Stage": stage}, metrics))
+    for document in documents:
+        print(json.dumps(document))
@@ -6,12 +6,12 @@ SELECT
 , operation_type
 , user_type
 , time_category
-, COUNT(*) total_events
-, COUNT(DISTINCT user_principal_id) unique_users
-, COUNT(DISTINCT sourceipaddress) unique_ips
-, SUM(is_failed) failed_events
-, SUM(is_root_user) root_user_events
-, COUNT(DISTINCT eventname) unique_api_calls
+, total_events
+, unique_users
+, unique_ips
+, failed_events
+, root_user_events
+, unique_api_calls
 FROM
-  cloudtrail_flattened
-GROUP BY 1, 2, 3, 4, 5, 6
+  cloudtrail_daily_metrics_rollup
+WHERE (event_date >= (current_date - INTERVAL  '90' DAY))
\ No newline at end of file
@@ -4,6 +4,8 @@ SELECT
 , eventtime
 , event_time
 , event_date
+, event_time_local
+, CAST(event_time_local AS date) event_date_local
 , region
 , eventsource
 , eventname
@@ -26,12 +28,22 @@ SELECT
 , eventcategory
 , requestparameters
 , responseelements
-, HOUR(event_time) hour_of_day
-, DAY_OF_WEEK(event_time) day_of_week
-, (CASE WHEN (errorcode IS NOT NULL) THEN 1 ELSE 0 END) is_failed
-, (CASE WHEN (useridentity.type = 'Root') THEN 1 ELSE 0 END) is_root_user
-, (CASE WHEN (eventname LIKE '%Create%') THEN 'Create' WHEN (eventname LIKE '%Delete%') THEN 'Delete' WHEN ((eventname LIKE '%Update%') OR (eventname LIKE '%Modify%') OR (eventname LIKE '%Put%')) THEN 'Update' WHEN ((eventname LIKE '%Get%') OR (eventname LIKE '%Describe%') OR (eventname LIKE '%List%')) THEN 'Read' ELSE 'Other' END) operation_type
-, (CASE WHEN ((hour(event_time) >= 9) AND (hour(event_time) <= 17)) THEN 'Business Hours' ELSE 'Off Hours' END) time_category
+, hour_of_day
+, day_of_week
+, hour(event_time_local) hour_of_day_local
+, is_failed
+, is_root_user
+, operation_type
+, time_category
+, classification_version
+, s3_bucket_name
+, iam_role_name
+, iam_policy_arn
+, iam_user_name
+, ec2_instance_id
+, kms_key_id
+, lambda_function_name
+, extracted_attributes
 FROM
   cloudtrail_events
 WHERE (event_date >= (current_date - INTERVAL  '90' DAY))
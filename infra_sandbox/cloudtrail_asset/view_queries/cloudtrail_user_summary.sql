@@ -2,14 +2,15 @@ CREATE OR REPLACE VIEW "cloudtrail_user_summary" AS
 SELECT
   user_principal_id
 , user_type
-, COUNT(*) total_api_calls
+, SUM(total_api_calls) total_api_calls
 , COUNT(DISTINCT event_date) active_days
 , COUNT(DISTINCT region) regions_accessed
 , COUNT(DISTINCT eventsource) services_used
 , COUNT(DISTINCT eventname) unique_actions
-, SUM(is_failed) failed_attempts
-, MAX(event_time) last_activity
-, MIN(event_time) first_activity
+, SUM(failed_attempts) failed_attempts
+, MAX(last_activity) last_activity
+, MIN(first_activity) first_activity
 FROM
-  cloudtrail_flattened
-GROUP BY 1, 2
+  cloudtrail_user_activity_rollup
+WHERE (event_date >= (current_date - INTERVAL  '90' DAY))
+GROUP BY 1, 2
\ No newline at end of file
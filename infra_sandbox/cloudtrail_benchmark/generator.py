@@ -0,0 +1,243 @@
+"""Synthetic CloudTrail log generator for local benchmarks.
+
+Writes gzip JSON files in the layout CloudTrail delivers to S3:
+
+    {output}/AWSLogs/{account_id}/CloudTrail/{region}/YYYY/MM/DD/{account_id}_CloudTrail_{region}_{timestamp}_{id}.json.gz
+
+Event sources and names are drawn from a Zipf distribution, so a handful of APIs dominate as in
+real trails, and request/response payloads carry the fields the ingest extracts into columns.
+
+    python -m infra_sandbox.cloudtrail_benchmark.generator --output /tmp/cloudtrail-bench \
+        --days 2 --files-per-day 200 --records-per-file 100 --corrupt-file-rate 0.01
+"""
+import os
+import gzip
+import json
+import uuid
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+
+# (eventSource, eventName, readOnly), most frequent first
+EVENT_CATALOG = [
+    ("sts.amazonaws.com", "AssumeRole", True),
+    ("s3.amazonaws.com", "GetObject", True),
+    ("ec2.amazonaws.com", "DescribeInstances", True),
+    ("kms.amazonaws.com", "Decrypt", True),
+    ("s3.amazonaws.com", "PutObject", False),
+    ("lambda.amazonaws.com", "Invoke", False),
+    ("iam.amazonaws.com", "GetRole", True),
+    ("kms.amazonaws.com", "GenerateDataKey", True),
+    ("s3.amazonaws.com", "ListBucket", True),
+    ("ec2.amazonaws.com", "RunInstances", False),
+    ("lambda.amazonaws.com", "GetFunction", True),
+    ("ec2.amazonaws.com", "AuthorizeSecurityGroupIngress", False),
+    ("iam.amazonaws.com", "AttachRolePolicy", False),
+    ("signin.amazonaws.com", "ConsoleLogin", False),
+    ("iam.amazonaws.com", "CreateRole", False),
+    ("iam.amazonaws.com", "CreateAccessKey", False),
+    ("s3.amazonaws.com", "PutBucketPublicAccessBlock", False),
+    ("iam.amazonaws.com", "CreateUser", False),
+    ("iam.amazonaws.com", "DeleteUser", False),
+]
+IDENTITY_TYPES = [("AssumedRole", 0.7), ("IAMUser", 0.25), ("Root", 0.03), ("AWSService", 0.02)]
+ERROR_CODES = ["AccessDenied", "UnauthorizedOperation", "ThrottlingException", "NoSuchKey"]
+USER_AGENTS = ["aws-cli/2.15.0", "Boto3/1.34.66", "console.amazonaws.com", "aws-sdk-java/2.20.0"]
+
+
+def zipf_weights(count, skew):
+    return [1.0 / (rank + 1) ** skew for rank in range(count)]
+
+
+def build_identity(rng, account_id, identity_type):
+    principal = f"AROA{rng.randrange(10**12):012d}"
+    identity = {"type": identity_type, "principalId": principal, "accountId": account_id}
+    if identity_type == "Root":
+        identity.update({"principalId": account_id, "arn": f"arn:aws:iam::{account_id}:root"})
+    elif identity_type == "IAMUser":
+        user_name = f"user-{rng.randrange(50)}"
+        identity.update({
+            "arn": f"arn:aws:iam::{account_id}:user/{user_name}",
+            "userName": user_name,
+            "accessKeyId": f"AKIA{rng.randrange(10**12):012d}",
+        })
+    elif identity_type == "AssumedRole":
+        role_name = f"role-{rng.randrange(30)}"
+        identity.update({
+            "arn": f"arn:aws:sts::{account_id}:assumed-role/{role_name}/session-{rng.randrange(1000)}",
+            "accessKeyId": f"ASIA{rng.randrange(10**12):012d}",
+            "sessionContext": {
+                "attributes": {"mfaAuthenticated": "false", "creationDate": "2024-01-01T00:00:00Z"},
+                "sessionIssuer": {
+                    "type": "Role",
+                    "principalId": principal,
+                    "arn": f"arn:aws:iam::{account_id}:role/{role_name}",
+                    "accountId": account_id,
+                    "userName": role_name,
+                },
+            },
+        })
+    else:
+        identity = {"type": identity_type, "invokedBy": "lambda.amazonaws.com"}
+    return identity
+
+
+def build_payloads(rng, account_id, region, event_source, event_name):
+    """requestParameters, responseElements and additionalEventData carrying the extracted fields."""
+    request, response, additional = None, None, None
+    if event_source == "s3.amazonaws.com":
+        request = {"bucketName": f"bench-bucket-{rng.randrange(20)}", "key": f"data/object-{rng.randrange(10**6)}.json"}
+        additional = {"bytesTransferredOut": rng.randrange(10**6)}
+    elif event_source == "iam.amazonaws.com":
+        request = {
+            "roleName": f"role-{rng.randrange(30)}",
+            "userName": f"user-{rng.randrange(50)}",
+            "policyArn": "arn:aws:iam::aws:policy/ReadOnlyAccess",
+        }
+        if event_name == "CreateAccessKey":
+            response = {"accessKey": {"accessKeyId": f"AKIA{rng.randrange(10**12):012d}", "status": "Active"}}
+    elif event_source == "ec2.amazonaws.com":
+        instance_id = f"i-{rng.randrange(16**17):017x}"
+        request = {"instancesSet": {"items": [{"instanceId": instance_id}]}, "groupId": f"sg-{rng.randrange(16**8):08x}"}
+        if event_name == "RunInstances":
+            response = {"instancesSet": {"items": [{"instanceId": instance_id, "instanceType": "t3.micro"}]}}
+    elif event_source == "kms.amazonaws.com":
+        function_arn = f"arn:aws:lambda:{region}:{account_id}:function:fn-{rng.randrange(40)}"
+        request = {
+            "keyId": f"arn:aws:kms:{region}:{account_id}:key/{uuid.UUID(int=rng.getrandbits(128))}",
+            "encryptionContext": {"aws:lambda:FunctionArn": function_arn},
+        }
+    elif event_source == "lambda.amazonaws.com":
+        request = {"functionName": f"fn-{rng.randrange(40)}"}
+    elif event_source == "sts.amazonaws.com":
+        request = {
+            "roleArn": f"arn:aws:iam::{account_id}:role/role-{rng.randrange(30)}",
+            "roleSessionName": f"session-{rng.randrange(1000)}",
+        }
+    elif event_source == "signin.amazonaws.com":
+        additional = {"MFAUsed": rng.choice(["Yes", "No"]), "LoginTo": "https://console.aws.amazon.com/"}
+        response = {"ConsoleLogin": "Success"}
+    return request, response, additional
+
+
+def build_record(rng, account_id, region, event_time, catalog_entry, error_rate):
+    event_source, event_name, read_only = catalog_entry
+    identity_type = rng.choices([t for t, _ in IDENTITY_TYPES], weights=[w for _, w in IDENTITY_TYPES])[0]
+    request, response, additional = build_payloads(rng, account_id, region, event_source, event_name)
+    record = {
+        "eventVersion": "1.08",
+        "userIdentity": build_identity(rng, account_id, identity_type),
+        "eventTime": event_time.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "eventSource": event_source,
+        "eventName": event_name,
+        "awsRegion": region,
+        "sourceIPAddress": f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}",
+        "userAgent": rng.choice(USER_AGENTS),
+        "requestParameters": request,
+        "responseElements": response,
+        "requestID": str(uuid.UUID(int=rng.getrandbits(128))),
+        "eventID": str(uuid.UUID(int=rng.getrandbits(128))),
+        "readOnly": read_only,
+        "eventType": "AwsConsoleSignIn" if event_source == "signin.amazonaws.com" else "AwsApiCall",
+        "managementEvent": True,
+        "recipientAccountId": account_id,
+        "eventCategory": "Management",
+        "tlsDetails": {
+            "tlsVersion": "TLSv1.3",
+            "cipherSuite": "TLS_AES_128_GCM_SHA256",
+            "clientProvidedHostHeader": event_source.replace("amazonaws.com", f"{region}.amazonaws.com"),
+        },
+    }
+    if additional is not None:
+        record["additionalEventData"] = additional
+    if rng.random() < error_rate:
+        record["errorCode"] = rng.choice(ERROR_CODES)
+        record["errorMessage"] = f"User is not authorized to perform: {event_name}"
+        record["responseElements"] = None
+    return record
+
+
+def generate(output, account_id="123456789012", regions=("us-east-1",), start_date=None, days=1,
+             files_per_day=100, records_per_file=100, skew=1.1, error_rate=0.05,
+             corrupt_file_rate=0.0, seed=7):
+    """Write the files and return a summary with file, record and byte counts per day prefix."""
+    rng = random.Random(seed)
+    weights = zipf_weights(len(EVENT_CATALOG), skew)
+    start_date = start_date or (datetime.now(timezone.utc) - timedelta(days=days)).date()
+    summary = {"files": 0, "records": 0, "corrupt_files": 0, "bytes": 0, "prefixes": {}}
+    for region in regions:
+        for day_offset in range(days):
+            day = start_date + timedelta(days=day_offset)
+            relative_prefix = f"AWSLogs/{account_id}/CloudTrail/{region}/{day:%Y/%m/%d}/"
+            directory = os.path.join(output, relative_prefix)
+            os.makedirs(directory, exist_ok=True)
+            day_start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+            prefix_stats = {"files": 0, "records": 0, "bytes": 0}
+            for file_index in range(files_per_day):
+                delivered_at = day_start + timedelta(seconds=file_index * 86400 // files_per_day)
+                records = [
+                    build_record(
+                        rng,
+                        account_id,
+                        region,
+                        delivered_at - timedelta(seconds=rng.randrange(300)),
+                        rng.choices(EVENT_CATALOG, weights=weights)[0],
+                        error_rate,
+                    )
+                    for _ in range(records_per_file)
+                ]
+                payload = json.dumps({"Records": records}).encode("utf-8")
+                if rng.random() < corrupt_file_rate:
+                    # Truncated delivery: the whole file fails to parse, like a partial upload
+                    payload = payload[: len(payload) // 2]
+                    summary["corrupt_files"] += 1
+                else:
+                    prefix_stats["records"] += len(records)
+                file_name = (
+                    f"{account_id}_CloudTrail_{region}_{delivered_at:%Y%m%dT%H%MZ}_"
+                    f"{rng.getrandbits(64):016x}.json.gz"
+                )
+                path = os.path.join(directory, file_name)
+                with gzip.open(path, "wb") as f:
+                    f.write(payload)
+                prefix_stats["files"] += 1
+                prefix_stats["bytes"] += os.path.getsize(path)
+            summary["prefixes"][relative_prefix] = prefix_stats
+            summary["files"] += prefix_stats["files"]
+            summary["records"] += prefix_stats["records"]
+            summary["bytes"] += prefix_stats["bytes"]
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic CloudTrail log files")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--account-id", default="123456789012")
+    parser.add_argument("--regions", default="us-east-1")
+    parser.add_argument("--start-date", help="YYYY-MM-DD, defaults to --days ago")
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--files-per-day", type=int, default=100)
+    parser.add_argument("--records-per-file", type=int, default=100)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent over eventSource/eventName")
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--corrupt-file-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+    summary = generate(
+        args.output,
+        account_id=args.account_id,
+        regions=[r.strip() for r in args.regions.split(",") if r.strip()],
+        start_date=datetime.strptime(args.start_date, "%Y-%m-%d").date() if args.start_date else None,
+        days=args.days,
+        files_per_day=args.files_per_day,
+        records_per_file=args.records_per_file,
+        skew=args.skew,
+        error_rate=args.error_rate,
+        corrupt_file_rate=args.corrupt_file_rate,
+        seed=args.seed,
+    )
+    print(json.dumps({k: v for k, v in summary.items() if k != "prefixes"}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Local throughput benchmark of the Spark ingest against a Hadoop-catalog Iceberg warehouse.
+
+Runs the Glue job's ingest engine (cloudtrail_ingest_engine.run) on local Spark with a Hadoop
+catalog and local file storage, over files from the generator, and reports files/s, records/s,
+per-stage seconds and Spark task metrics, and the data files written. Results are compared
+with a stored baseline and the run fails when a metric regresses by more than the tolerance.
+
+Needs pyspark 3.3 and network access for the Iceberg runtime package (or --iceberg-package
+pointing at a local jar via spark.jars):
+
+    python -m infra_sandbox.cloudtrail_benchmark.harness --generate --files-per-day 500
+    python -m infra_sandbox.cloudtrail_benchmark.harness --data /tmp/cloudtrail-bench --update-baseline
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+ASSET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cloudtrail_asset")
+if ASSET_DIR not in sys.path:
+    # The shared modules are flat files shipped to Glue with --extra-py-files
+    sys.path.insert(0, ASSET_DIR)
+
+from pyspark.sql import SparkSession
+
+from cloudtrail_ingest_engine import HadoopCatalogBackend, LocalStorage, run
+from cloudtrail_ingest_stages import get_spark_session_config
+
+from .generator import generate
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# Glue 4.0 runs Spark 3.3 with Iceberg 1.0
+DEFAULT_ICEBERG_PACKAGE = "org.apache.iceberg:iceberg-spark-runtime-3.3_2.12:1.0.0"
+DATABASE_NAME = "cloudtrail_bench"
+# Metric name -> True when higher is better
+BASELINE_METRICS = {
+    "files_per_second": True,
+    "records_per_second": True,
+    "output_data_files": False,
+}
+
+
+def create_local_spark_session(catalog, iceberg_package, shuffle_partitions):
+    builder = (
+        SparkSession.builder.master("local[*]")
+        .appName("cloudtrail-ingest-benchmark")
+        .config("spark.jars.packages", iceberg_package)
+        .config("spark.sql.shuffle.partitions", str(shuffle_partitions))
+        .config("spark.ui.enabled", "false")
+    )
+    for key, value in {**catalog.spark_config(), **get_spark_session_config()}.items():
+        builder = builder.config(key, value)
+    return builder.getOrCreate()
+
+
+def list_day_prefixes(data_dir):
+    """Local day directories with their .json.gz files and sizes, like the S3 prefix listing."""
+    prefixes = []
+    for root, _, files in os.walk(data_dir):
+        objects = [
+            {"key": os.path.join(root, name), "size": os.path.getsize(os.path.join(root, name))}
+            for name in sorted(files) if name.endswith(".json.gz")
+        ]
+        if objects:
+            prefixes.append((os.path.relpath(root, data_dir).replace(os.sep, "/") + "/", objects))
+    return sorted(prefixes)
+
+
+def run_benchmark(spark, data_dir, warehouse, write_mode="merge", target_input_bytes_per_partition=32 * 1024 * 1024,
+                  partition_granularity="event_date", partition_bucket_count=0, prefix_concurrency=4):
+    catalog = HadoopCatalogBackend(warehouse)
+    day_prefixes = [prefix for prefix, _ in list_day_prefixes(data_dir)]
+    summary = run(
+        {
+            "database_name": DATABASE_NAME,
+            "output_path": catalog.output_path(DATABASE_NAME),
+            "prefixes": ",".join(day_prefixes),
+            "write_mode": write_mode,
+            "target_input_bytes_per_partition": str(target_input_bytes_per_partition),
+            "partition_granularity": partition_granularity,
+            "partition_bucket_count": str(partition_bucket_count),
+            "prefix_concurrency": str(prefix_concurrency),
+            # Keep the generated files for repeated runs; a fresh warehouse has nothing to expire
+            "delete_raw_objects": "false",
+            "run_retention": "false",
+        },
+        spark=spark,
+        catalog=catalog,
+        storage=LocalStorage(data_dir),
+    )
+
+    table_fqn = f"glue_catalog.{DATABASE_NAME}.cloudtrail_events"
+    files_row = spark.sql(
+        f"SELECT COUNT(*) AS files, COALESCE(SUM(file_size_in_bytes), 0) AS bytes FROM {table_fqn}.files"
+    ).collect()[0]
+    stage_seconds = summary["stage_seconds"]
+    # Wall time of the prefix pipelines; stage seconds add up the concurrent ones
+    ingest_seconds = summary.get("ingest_seconds", 0.0)
+    return {
+        "prefixes": summary["prefixes"],
+        **{key: summary[key] for key in ("files", "corrupt_files", "records", "input_bytes")},
+        "ingest_seconds": round(ingest_seconds, 2),
+        "files_per_second": round(summary["files"] / ingest_seconds, 1) if ingest_seconds else 0.0,
+        "records_per_second": round(summary["records"] / ingest_seconds, 1) if ingest_seconds else 0.0,
+        "stage_seconds": stage_seconds,
+        "spark_metrics": summary["spark_metrics"],
+        "output_data_files": files_row.files,
+        "output_bytes": files_row.bytes,
+        "avg_output_file_bytes": files_row.bytes // files_row.files if files_row.files else 0,
+    }
+
+
+def compare_with_baseline(result, baseline, tolerance):
+    """Regression messages for metrics worse than the baseline by more than tolerance."""
+    regressions = []
+    for metric, higher_is_better in BASELINE_METRICS.items():
+        expected = baseline.get(metric)
+        if not expected:
+            continue
+        actual = result[metric]
+        change = (actual - expected) / expected
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{metric}: {actual} vs baseline {expected} ({change:+.1%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the CloudTrail Spark ingest locally")
+    parser.add_argument("--data", help="Directory with AWSLogs/... files; generated when omitted or with --generate")
+    parser.add_argument("--generate", action="store_true")
+    parser.add_argument("--regions", default="us-east-1")
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--files-per-day", type=int, default=200)
+    parser.add_argument("--records-per-file", type=int, default=100)
+    parser.add_argument("--skew", type=float, default=1.1)
+    parser.add_argument("--corrupt-file-rate", type=float, default=0.01)
+    parser.add_argument("--write-mode", default="merge", choices=["merge", "append"])
+    parser.add_argument("--partition-granularity", default="event_date", choices=["event_date", "days", "hours"])
+    parser.add_argument("--partition-buckets", type=int, default=0, help="bucket(N, eventSource) partitions")
+    parser.add_argument("--prefix-concurrency", type=int, default=4, help="Day prefixes ingested concurrently")
+    parser.add_argument("--scenario", default="default", help="Baseline entry to compare with")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--iceberg-package", default=DEFAULT_ICEBERG_PACKAGE)
+    parser.add_argument("--shuffle-partitions", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="cloudtrail-bench-")
+    try:
+        data_dir = args.data or os.path.join(work_dir, "data")
+        if args.generate or not args.data:
+            generate(
+                data_dir,
+                regions=[r.strip() for r in args.regions.split(",") if r.strip()],
+                days=args.days,
+                files_per_day=args.files_per_day,
+                records_per_file=args.records_per_file,
+                skew=args.skew,
+                corrupt_file_rate=args.corrupt_file_rate,
+            )
+        warehouse = os.path.join(work_dir, "warehouse")
+        spark = create_local_spark_session(
+            HadoopCatalogBackend(warehouse), args.iceberg_package, args.shuffle_partitions
+        )
+        try:
+            result = run_benchmark(
+                spark,
+                data_dir,
+                warehouse,
+                write_mode=args.write_mode,
+                partition_granularity=args.partition_granularity,
+                partition_bucket_count=args.partition_buckets,
+                prefix_concurrency=args.prefix_concurrency,
+            )
+        finally:
+            spark.stop()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps(result, indent=2, default=str))
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    if args.update_baseline:
+        baselines[args.scenario] = {metric: result[metric] for metric in BASELINE_METRICS}
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline {args.scenario} updated in {args.baseline}")
+        return 0
+    if args.scenario not in baselines:
+        print(f"No baseline {args.scenario} in {args.baseline}; run with --update-baseline to record one")
+        return 0
+    regressions = compare_with_baseline(result, baselines[args.scenario], args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
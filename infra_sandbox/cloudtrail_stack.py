@@ -3,11 +3,16 @@ import os
 import aws_cdk.aws_events as events
 from aws_cdk import Aws, Duration, RemovalPolicy, Stack
 from aws_cdk import aws_cloudtrail as cloudtrail
+from aws_cdk import aws_dynamodb as dynamodb
 from aws_cdk import aws_events_targets as targets
+from aws_cdk import aws_glue as glue
 from aws_cdk import aws_glue_alpha as alpha_glue
 from aws_cdk import aws_iam as iam
 from aws_cdk import aws_kms as kms
+from aws_cdk import aws_lambda as lambda_
 from aws_cdk import aws_s3 as s3
+from aws_cdk import aws_s3_notifications as s3n
+from aws_cdk import aws_sqs as sqs
 from cdk_nag import NagSuppressions
 from constructs import Construct
 from playbook.cdk.eventbridge_construct import PlaybookEventBridgeRule
@@ -235,6 +240,16 @@ class CloudTrailWithKmsAndIcebergStack(Stack):
             )
         )
 
+        glue_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["cloudwatch:PutMetricData"],
+                resources=["*"],
+                conditions={
+                    "StringEquals": {"cloudwatch:namespace": "CloudTrailPipeline"}
+                },
+            )
+        )
+
         glue_role.add_to_policy(
             iam.PolicyStatement(
                 actions=[
@@ -268,15 +283,82 @@ class CloudTrailWithKmsAndIcebergStack(Stack):
             "--log_level": "INFO",
             "--datalake-formats": "iceberg",
             "--retention_days_for_processed_logs": str(log_expiration_days),
+            # Hidden partitioning on days(event_time); an existing event_date table is evolved in place
+            "--partition_granularity": "days",
+            "--partition_bucket_count": "0",
+            # event_date in UTC, like the raw day prefixes; an existing table keeps its recorded
+            # zone until the partition timezone migration job re-partitions it
+            "--partition_timezone": "UTC",
+            # Day prefixes ingested concurrently by each run, in FAIR scheduler pools
+            "--prefix_concurrency": "4",
+            # Writes are staged and published by the commit coordinator, which also refreshes
+            # the derived tables and applies retention once per orchestrator execution
+            "--commit_mode": "staged",
+            "--run_retention": "false",
         }
 
-        env_account_id = env_vars.get("account-id", "unknown-account")
-        if env_account_id in ["067157108346", "397422540095"]:
-            number_of_workers = 10
-            worker_type = alpha_glue.WorkerType.G_1_X
-        else:
-            number_of_workers = 5
-            worker_type = alpha_glue.WorkerType.G_1_X
+        # Only used when a job is started by hand; the orchestrator passes the worker type and
+        # count recommended by the sizing Lambda from the recorded run history
+        number_of_workers = 2
+        worker_type = alpha_glue.WorkerType.G_1_X
+
+        # Argument, logging, prefix and S3 helpers shared by every job, Spark or Python shell
+        common_module = alpha_glue.Code.from_asset(
+            os.path.join(
+                os.path.dirname(__file__),
+                "cloudtrail_asset",
+                "cloudtrail_common.py",
+            )
+        )
+        # Shared classification rules and rollup refresh, imported by the ingest and backfill jobs
+        derived_module = alpha_glue.Code.from_asset(
+            os.path.join(
+                os.path.dirname(__file__),
+                "cloudtrail_asset",
+                "cloudtrail_derived.py",
+            )
+        )
+        # Rate-adaptive deletion of ingested raw objects, imported by both ingest engines
+        deleter_module = alpha_glue.Code.from_asset(
+            os.path.join(
+                os.path.dirname(__file__),
+                "cloudtrail_asset",
+                "cloudtrail_s3_deleter.py",
+            )
+        )
+
+        # Read, transform and write stages of the Spark ingest
+        stages_module = alpha_glue.Code.from_asset(
+            os.path.join(
+                os.path.dirname(__file__),
+                "cloudtrail_asset",
+                "cloudtrail_ingest_stages.py",
+            )
+        )
+        # The whole Spark ingest behind run(config), wrapped by the Glue script and the benchmark
+        engine_module = alpha_glue.Code.from_asset(
+            os.path.join(
+                os.path.dirname(__file__),
+                "cloudtrail_asset",
+                "cloudtrail_ingest_engine.py",
+            )
+        )
+        # Metadata-only partition drops and incremental orphan file removal used by the engine
+        retention_module = alpha_glue.Code.from_asset(
+            os.path.join(
+                os.path.dirname(__file__),
+                "cloudtrail_asset",
+                "cloudtrail_retention.py",
+            )
+        )
+        # Stage timers, the Spark metrics listener and EMF output used by the engine
+        metrics_module = alpha_glue.Code.from_asset(
+            os.path.join(
+                os.path.dirname(__file__),
+                "cloudtrail_asset",
+                "cloudtrail_ingest_metrics.py",
+            )
+        )
 
         # Glue Job Definition for CloudTrail processing
         glue_job_name = "infra_glue_transform_cloudtrail_logs"
@@ -303,27 +385,216 @@ class CloudTrailWithKmsAndIcebergStack(Stack):
                         "cloudtrail_log_processing.py",
                     )
                 ),
+                extra_python_files=[common_module, engine_module, metrics_module, derived_module, stages_module, retention_module, deleter_module],
             ),
             default_arguments=default_arguments,
         )
 
+        # Single writer that publishes the staged ingest commits, then refreshes the derived
+        # tables and applies retention at most once a day
+        commit_coordinator_job_name = "infra_glue_commit_cloudtrail_events"
+        _ = alpha_glue.Job(
+            self,
+            "CloudTrailCommitCoordinatorGlueJob",
+            job_name=commit_coordinator_job_name,
+            role=glue_role,
+            worker_count=2,
+            max_concurrent_runs=1,
+            timeout=Duration.hours(2),
+            max_retries=1,
+            worker_type=alpha_glue.WorkerType.G_1_X,
+            executable=alpha_glue.JobExecutable.python_etl(
+                glue_version=alpha_glue.GlueVersion.V4_0,
+                python_version=alpha_glue.PythonVersion.THREE,
+                script=alpha_glue.Code.from_asset(
+                    os.path.join(
+                        os.path.dirname(__file__),
+                        "cloudtrail_asset",
+                        "cloudtrail_commit_coordinator.py",
+                    )
+                ),
+                extra_python_files=[common_module, engine_module, metrics_module, derived_module, stages_module, retention_module, deleter_module],
+            ),
+            default_arguments={
+                "--output_path": default_arguments["--output_path"],
+                "--database_name": default_arguments["--database_name"],
+                "--datalake-formats": "iceberg",
+                "--retention_days_for_processed_logs": default_arguments["--retention_days_for_processed_logs"],
+                "--run_retention": "true",
+                "--retention_interval_hours": "24",
+            },
+        )
+
+        # Python shell engine for small batches: threaded gzip/JSON -> Arrow -> Iceberg append
+        fast_ingest_job_name = "infra_glue_fast_ingest_cloudtrail_logs"
+        _ = alpha_glue.Job(
+            self,
+            "CloudTrailFastIngestGlueJob",
+            job_name=fast_ingest_job_name,
+            role=glue_role,
+            max_capacity=1,
+            max_concurrent_runs=25,
+            timeout=Duration.hours(1),
+            max_retries=0,
+            executable=alpha_glue.JobExecutable.python_shell(
+                glue_version=alpha_glue.GlueVersion.V3_0,
+                python_version=alpha_glue.PythonVersion.THREE_NINE,
+                script=alpha_glue.Code.from_asset(
+                    os.path.join(
+                        os.path.dirname(__file__),
+                        "cloudtrail_asset",
+                        "cloudtrail_fast_ingest.py",
+                    )
+                ),
+                extra_python_files=[common_module, metrics_module, derived_module, deleter_module],
+            ),
+            default_arguments={
+                "--input_path": default_arguments["--input_path"],
+                "--database_name": default_arguments["--database_name"],
+                "--additional-python-modules": "pyiceberg[glue,pyarrow]==0.7.1,orjson==3.10.7",
+                "--max_workers": "32",
+            },
+        )
+
+        # Scheduled compaction and manifest rewrite of the Iceberg tables
+        maintenance_job_name = "infra_glue_maintain_cloudtrail_tables"
+        maintenance_job = alpha_glue.Job(
+            self,
+            "CloudTrailTableMaintenanceGlueJob",
+            job_name=maintenance_job_name,
+            role=glue_role,
+            worker_count=2,
+            max_concurrent_runs=1,
+            timeout=Duration.hours(4),
+            max_retries=1,
+            worker_type=alpha_glue.WorkerType.G_1_X,
+            executable=alpha_glue.JobExecutable.python_etl(
+                glue_version=alpha_glue.GlueVersion.V4_0,
+                python_version=alpha_glue.PythonVersion.THREE,
+                script=alpha_glue.Code.from_asset(
+                    os.path.join(
+                        os.path.dirname(__file__),
+                        "cloudtrail_asset",
+                        "cloudtrail_table_maintenance.py",
+                    )
+                ),
+                extra_python_files=[common_module, engine_module, metrics_module, derived_module, stages_module, retention_module, deleter_module],
+            ),
+            default_arguments={
+                "--output_path": default_arguments["--output_path"],
+                "--database_name": default_arguments["--database_name"],
+                "--datalake-formats": "iceberg",
+                "--tables": "cloudtrail_events,cloudtrail_processed_objects,cloudtrail_daily_metrics_rollup,cloudtrail_user_activity_rollup,cloudtrail_security_events",
+                "--strategy": "binpack",
+                "--target_file_size_bytes": str(256 * 1024 * 1024),
+                "--lookback_days": "3",
+            },
+        )
+
+        # Run on demand after adding a classification rule version to recompute older partitions
+        classification_backfill_job_name = "infra_glue_backfill_cloudtrail_classification"
+        _ = alpha_glue.Job(
+            self,
+            "CloudTrailClassificationBackfillGlueJob",
+            job_name=classification_backfill_job_name,
+            role=glue_role,
+            worker_count=number_of_workers,
+            max_concurrent_runs=1,
+            timeout=Duration.hours(10),
+            max_retries=0,
+            worker_type=worker_type,
+            executable=alpha_glue.JobExecutable.python_etl(
+                glue_version=alpha_glue.GlueVersion.V4_0,
+                python_version=alpha_glue.PythonVersion.THREE,
+                script=alpha_glue.Code.from_asset(
+                    os.path.join(
+                        os.path.dirname(__file__),
+                        "cloudtrail_asset",
+                        "cloudtrail_classification_backfill.py",
+                    )
+                ),
+                extra_python_files=[common_module, engine_module, metrics_module, derived_module, stages_module, retention_module, deleter_module],
+            ),
+            default_arguments={
+                "--output_path": default_arguments["--output_path"],
+                "--database_name": default_arguments["--database_name"],
+                "--datalake-formats": "iceberg",
+                "--rule_version": "latest",
+            },
+        )
+
+        # Run on demand to re-partition cloudtrail_events into another zone's event_date days
+        partition_timezone_migration_job_name = "infra_glue_migrate_cloudtrail_partition_timezone"
+        _ = alpha_glue.Job(
+            self,
+            "CloudTrailPartitionTimezoneMigrationGlueJob",
+            job_name=partition_timezone_migration_job_name,
+            role=glue_role,
+            worker_count=number_of_workers,
+            max_concurrent_runs=1,
+            timeout=Duration.hours(10),
+            max_retries=0,
+            worker_type=worker_type,
+            executable=alpha_glue.JobExecutable.python_etl(
+                glue_version=alpha_glue.GlueVersion.V4_0,
+                python_version=alpha_glue.PythonVersion.THREE,
+                script=alpha_glue.Code.from_asset(
+                    os.path.join(
+                        os.path.dirname(__file__),
+                        "cloudtrail_asset",
+                        "cloudtrail_partition_timezone_migration.py",
+                    )
+                ),
+                extra_python_files=[common_module, engine_module, metrics_module, derived_module, stages_module, retention_module, deleter_module],
+            ),
+            default_arguments={
+                "--output_path": default_arguments["--output_path"],
+                "--database_name": default_arguments["--database_name"],
+                "--datalake-formats": "iceberg",
+                "--partition_timezone": default_arguments["--partition_timezone"],
+            },
+        )
+
+        maintenance_trigger = glue.CfnTrigger(
+            self,
+            "CloudTrailTableMaintenanceTrigger",
+            name="infra_glue_maintain_cloudtrail_tables_daily",
+            type="SCHEDULED",
+            schedule="cron(0 3 * * ? *)",
+            start_on_creation=True,
+            actions=[glue.CfnTrigger.ActionProperty(job_name=maintenance_job.job_name)],
+        )
+        # The action names the job by string only, so CloudFormation must be told to create it first
+        maintenance_trigger.node.add_dependency(maintenance_job)
+
         self.trail_bucket = trail_bucket
 
         # Lambda functions for orchestration
-        file_count_lambda_path = os.path.join(
+        last_7_days_lambda_path = os.path.join(
             os.path.dirname(__file__),
             "cloudtrail_asset",
-            "file_count_lambda",
+            "last_7_days_lambda",
             "lambda-handler.py",
         )
-        file_count_lambda = PlaybookLambdaFunction(
+        last_7_days_lambda = PlaybookLambdaFunction(
             self,
-            "CountCloudTrailFilesLambda",
+            "GetLastDaysCloudTrailLambda",
             nag_suppression=NagSuppressions,
             env_vars=env_vars,
-            lambda_path=file_count_lambda_path,
+            function_env_vars={
+                "ACCOUNT_ID": account_id,
+                "REGION": region,
+                "MAX_WORKERS": "16",
+                "LOOKBACK_DAYS": "1",
+                "WATERMARK_KEY": "glue_job_tmp/discovery/day_prefix_watermarks.json",
+                # Sized prefixes and watermarks of each execution, read by the planner and the commit
+                "DISCOVERY_KEY_PREFIX": "glue_job_tmp/discovery/runs",
+                # s3://.../manifest.json of a CSV S3 Inventory report to size from instead of listing
+                "INVENTORY_MANIFEST_URI": "",
+            },
+            lambda_path=last_7_days_lambda_path,
+            # Discovery also sizes every prefix, which lists each changed month in full
             timeout=Duration.minutes(15),
-            memory_size=512,
             additional_iam_policies={
                 "lambda_policy": iam.PolicyDocument(
                     statements=[
@@ -333,59 +604,175 @@ class CloudTrailWithKmsAndIcebergStack(Stack):
                                 f"arn:aws:s3:::{cloudtrail_bucket_name}",
                                 f"arn:aws:s3:::{cloudtrail_bucket_name}/*",
                             ],
-                        )
+                        ),
+                        iam.PolicyStatement(
+                            actions=["s3:GetObject", "s3:PutObject"],
+                            resources=[
+                                f"arn:aws:s3:::{cloudtrail_bucket_name}/glue_job_tmp/discovery/*",
+                            ],
+                        ),
+                        iam.PolicyStatement(
+                            actions=["s3:GetObject"],
+                            resources=[
+                                f"arn:aws:s3:::{cloudtrail_bucket_name}/inventory/*",
+                            ],
+                        ),
+                        iam.PolicyStatement(
+                            actions=["kms:Decrypt", "kms:GenerateDataKey"],
+                            resources=[kms_key.key_arn],
+                        ),
                     ]
                 )
             },
+            memory_size=1024,
         )
 
-        last_7_days_lambda_path = os.path.join(
+        max_file_count_lambda_path = os.path.join(
             os.path.dirname(__file__),
             "cloudtrail_asset",
-            "last_7_days_lambda",
+            "max_file_count_lambda",
             "lambda-handler.py",
         )
-        last_7_days_lambda = PlaybookLambdaFunction(
+        max_file_count_lambda = PlaybookLambdaFunction(
             self,
-            "GetLastDaysCloudTrailLambda",
+            "FindMaxFileCountCloudTrailLambda",
+            nag_suppression=NagSuppressions,
+            env_vars=env_vars,
+            lambda_path=max_file_count_lambda_path,
+            timeout=Duration.minutes(2),
+            memory_size=512,
+        )
+
+        batch_planner_lambda_path = os.path.join(
+            os.path.dirname(__file__),
+            "cloudtrail_asset",
+            "batch_planner_lambda",
+            "lambda-handler.py",
+        )
+        batch_planner_lambda = PlaybookLambdaFunction(
+            self,
+            "PlanCloudTrailBatchesLambda",
             nag_suppression=NagSuppressions,
             env_vars=env_vars,
             function_env_vars={
-                "ACCOUNT_ID": account_id,
-                "REGION": region,
+                "MAX_FILES_PER_BATCH": "20000",
+                "MAX_BYTES_PER_BATCH": str(10 * 1024 * 1024 * 1024),
+                "MAX_PREFIXES_PER_BATCH": "50",
+                "PLAN_KEY_PREFIX": "glue_job_tmp/batch_plans",
             },
-            lambda_path=last_7_days_lambda_path,
+            lambda_path=batch_planner_lambda_path,
             timeout=Duration.minutes(2),
             additional_iam_policies={
                 "lambda_policy": iam.PolicyDocument(
                     statements=[
                         iam.PolicyStatement(
-                            actions=["s3:ListBucket"],
+                            actions=["s3:PutObject"],
                             resources=[
-                                f"arn:aws:s3:::{cloudtrail_bucket_name}",
-                                f"arn:aws:s3:::{cloudtrail_bucket_name}/*",
+                                f"arn:aws:s3:::{cloudtrail_bucket_name}/glue_job_tmp/batch_plans/*",
                             ],
-                        )
+                        ),
+                        iam.PolicyStatement(
+                            actions=["s3:GetObject"],
+                            resources=[
+                                f"arn:aws:s3:::{cloudtrail_bucket_name}/glue_job_tmp/discovery/runs/*",
+                            ],
+                        ),
+                        iam.PolicyStatement(
+                            actions=["kms:Decrypt", "kms:GenerateDataKey"],
+                            resources=[kms_key.key_arn],
+                        ),
                     ]
                 )
             },
             memory_size=512,
         )
 
-        max_file_count_lambda_path = os.path.join(
+        # Input size, workers and duration of every finished Glue run, used to size the next ones
+        glue_run_history_table = dynamodb.Table(
+            self,
+            "GlueRunHistoryTable",
+            partition_key=dynamodb.Attribute(
+                name="job_name", type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(
+                name="recorded_at", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            point_in_time_recovery=True,
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+
+        glue_sizing_lambda_path = os.path.join(
             os.path.dirname(__file__),
             "cloudtrail_asset",
-            "max_file_count_lambda",
+            "glue_sizing_lambda",
             "lambda-handler.py",
         )
-        max_file_count_lambda = PlaybookLambdaFunction(
+        glue_sizing_lambda = PlaybookLambdaFunction(
             self,
-            "FindMaxFileCountCloudTrailLambda",
+            "SizeCloudTrailGlueJobLambda",
             nag_suppression=NagSuppressions,
             env_vars=env_vars,
-            lambda_path=max_file_count_lambda_path,
+            function_env_vars={
+                "RUN_HISTORY_TABLE": glue_run_history_table.table_name,
+                "TARGET_RUNTIME_SECONDS": "900",
+                "MIN_WORKERS": "2",
+                "MAX_WORKERS": "50",
+                "WORKER_TYPES": "G.1X,G.2X",
+            },
+            lambda_path=glue_sizing_lambda_path,
+            timeout=Duration.minutes(1),
+            memory_size=256,
+            additional_iam_policies={
+                "lambda_policy": iam.PolicyDocument(
+                    statements=[
+                        iam.PolicyStatement(
+                            actions=["dynamodb:PutItem", "dynamodb:Query"],
+                            resources=[glue_run_history_table.table_arn],
+                        )
+                    ]
+                )
+            },
+        )
+
+        run_metrics_lambda_path = os.path.join(
+            os.path.dirname(__file__),
+            "cloudtrail_asset",
+            "run_metrics_lambda",
+            "lambda-handler.py",
+        )
+        run_metrics_lambda = PlaybookLambdaFunction(
+            self,
+            "AggregateCloudTrailRunMetricsLambda",
+            nag_suppression=NagSuppressions,
+            env_vars=env_vars,
+            function_env_vars={
+                "SUMMARY_KEY_PREFIX": "glue_job_tmp/run_summaries",
+                "METRIC_NAMESPACE": "CloudTrailPipeline",
+            },
+            lambda_path=run_metrics_lambda_path,
             timeout=Duration.minutes(2),
-            memory_size=512,
+            memory_size=256,
+            additional_iam_policies={
+                "lambda_policy": iam.PolicyDocument(
+                    statements=[
+                        iam.PolicyStatement(
+                            actions=["s3:ListBucket"],
+                            resources=[f"arn:aws:s3:::{cloudtrail_bucket_name}"],
+                        ),
+                        iam.PolicyStatement(
+                            actions=["s3:GetObject"],
+                            resources=[
+                                f"arn:aws:s3:::{cloudtrail_bucket_name}/glue_job_tmp/run_summaries/*",
+                            ],
+                        ),
+                        iam.PolicyStatement(
+                            actions=["kms:Decrypt"],
+                            resources=[kms_key.key_arn],
+                        ),
+                    ]
+                )
+            },
         )
 
         policy_statements = [
@@ -425,9 +812,11 @@ class CloudTrailWithKmsAndIcebergStack(Stack):
                 effect=iam.Effect.ALLOW,
                 actions=["lambda:InvokeFunction"],
                 resources=[
-                    f"arn:aws:lambda:{region}:{account_id}:function:{file_count_lambda.function_name}",
                     f"arn:aws:lambda:{region}:{account_id}:function:{last_7_days_lambda.function_name}",
                     f"arn:aws:lambda:{region}:{account_id}:function:{max_file_count_lambda.function_name}",
+                    f"arn:aws:lambda:{region}:{account_id}:function:{batch_planner_lambda.function_name}",
+                    f"arn:aws:lambda:{region}:{account_id}:function:{glue_sizing_lambda.function_name}",
+                    f"arn:aws:lambda:{region}:{account_id}:function:{run_metrics_lambda.function_name}",
                 ],
             ),
         ]
@@ -465,6 +854,135 @@ class CloudTrailWithKmsAndIcebergStack(Stack):
             targets.SfnStateMachine(step_function.state_machine)
         )
 
+        # Event-driven path: new raw objects are queued and ingested in micro-batches between
+        # the weekly runs, which still sweep up anything the queue missed
+        object_created_dlq = sqs.Queue(
+            self,
+            "CloudTrailObjectCreatedDLQ",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            retention_period=Duration.days(14),
+        )
+        object_created_queue = sqs.Queue(
+            self,
+            "CloudTrailObjectCreatedQueue",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            enforce_ssl=True,
+            visibility_timeout=Duration.minutes(5),
+            retention_period=Duration.days(4),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=50, queue=object_created_dlq
+            ),
+        )
+        trail_bucket.add_event_notification(
+            s3.EventType.OBJECT_CREATED,
+            s3n.SqsDestination(object_created_queue),
+            s3.NotificationKeyFilter(prefix="raw-cloudtrail-logs/"),
+        )
+
+        object_queue_consumer_lambda_path = os.path.join(
+            os.path.dirname(__file__),
+            "cloudtrail_asset",
+            "object_queue_consumer_lambda",
+            "lambda-handler.py",
+        )
+        object_queue_consumer_lambda = PlaybookLambdaFunction(
+            self,
+            "ConsumeCloudTrailObjectQueueLambda",
+            nag_suppression=NagSuppressions,
+            env_vars=env_vars,
+            function_env_vars={
+                "QUEUE_URL": object_created_queue.queue_url,
+                "GLUE_JOB_NAME": fast_ingest_job_name,
+                "COMMIT_JOB_NAME": commit_coordinator_job_name,
+                "BUCKET_NAME": cloudtrail_bucket_name,
+                "DEAD_LETTER_QUEUE_URL": object_created_dlq.queue_url,
+                "MAX_BATCH_ATTEMPTS": "3",
+                "MANIFEST_KEY_PREFIX": "glue_job_tmp/micro_batches",
+                "MAX_BATCH_FILES": "2000",
+                "MAX_BATCH_BYTES": str(128 * 1024 * 1024),
+                "MIN_BATCH_FILES": "200",
+                "MAX_WAIT_SECONDS": "600",
+                "MAX_BATCHES_PER_RUN": "4",
+            },
+            lambda_path=object_queue_consumer_lambda_path,
+            timeout=Duration.minutes(2),
+            memory_size=512,
+            additional_iam_policies={
+                "lambda_policy": iam.PolicyDocument(
+                    statements=[
+                        iam.PolicyStatement(
+                            actions=[
+                                "sqs:ReceiveMessage",
+                                "sqs:DeleteMessage",
+                                "sqs:ChangeMessageVisibility",
+                                "sqs:GetQueueAttributes",
+                            ],
+                            resources=[object_created_queue.queue_arn],
+                        ),
+                        iam.PolicyStatement(
+                            actions=["sqs:SendMessage"],
+                            resources=[object_created_dlq.queue_arn],
+                        ),
+                        iam.PolicyStatement(
+                            actions=["s3:PutObject"],
+                            resources=[
+                                f"arn:aws:s3:::{cloudtrail_bucket_name}/glue_job_tmp/micro_batches/*",
+                            ],
+                        ),
+                        iam.PolicyStatement(
+                            actions=["s3:GetObject", "s3:DeleteObject"],
+                            resources=[
+                                f"arn:aws:s3:::{cloudtrail_bucket_name}/glue_job_tmp/micro_batches/in_flight/*",
+                            ],
+                        ),
+                        iam.PolicyStatement(
+                            actions=["s3:ListBucket"],
+                            resources=[f"arn:aws:s3:::{cloudtrail_bucket_name}"],
+                            conditions={
+                                "StringLike": {
+                                    "s3:prefix": [
+                                        "glue_job_tmp/derived_refresh/*",
+                                        "glue_job_tmp/micro_batches/in_flight/*",
+                                    ]
+                                }
+                            },
+                        ),
+                        iam.PolicyStatement(
+                            actions=["kms:GenerateDataKey", "kms:Decrypt"],
+                            resources=[kms_key.key_arn],
+                        ),
+                        iam.PolicyStatement(
+                            actions=["glue:StartJobRun", "glue:GetJobRun"],
+                            resources=[
+                                f"arn:aws:glue:{region}:{account_id}:job/{fast_ingest_job_name}",
+                                f"arn:aws:glue:{region}:{account_id}:job/{commit_coordinator_job_name}",
+                            ],
+                        ),
+                    ]
+                )
+            },
+        )
+
+        # The schedule bounds how often micro-batches are committed to cloudtrail_events
+        micro_batch_rule = PlaybookEventBridgeRule(
+            self,
+            "CloudTrailMicroBatchEventBridgeRule",
+            nag_suppression=NagSuppressions,
+            env_vars=env_vars,
+            schedule=events.Schedule.rate(Duration.minutes(5)),
+        )
+        micro_batch_rule.rule.add_target(
+            targets.LambdaFunction(
+                lambda_.Function.from_function_attributes(
+                    self,
+                    "ConsumeCloudTrailObjectQueueLambdaRef",
+                    function_arn=f"arn:aws:lambda:{region}:{account_id}:function:{object_queue_consumer_lambda.function_name}",
+                    same_environment=True,
+                )
+            )
+        )
+
         # CloudTrail configuration - writes to raw-cloudtrail-logs prefix
         trail = cloudtrail.Trail(
             self,